@@ -1,23 +1,39 @@
 # Image Captioning global plugin main module
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
+import time
+#: Time at which the add-on started loading, to measure its startup cost
+_loadStartTime = time.perf_counter()
+
+import sys
+import core
 import globalPluginHandler
+from logHandler import log
 from scriptHandler import script
 from globalCommands import SCRCAT_VISION
 import vision
 import ui
-import time
-from visionEnhancementProviders.screenCurtain import ScreenCurtainSettings
 from visionEnhancementProviders.imageCaptioning import ImageCaptioning
+from ._idle import IDLE_DELAY, secondsSinceLastInput
+
+# The other modules of the add-on, the captioning backends and their dependencies (wx, screenBitmap,
+# contentRecog, NumPy, onnxruntime...) are only imported when first used, as most NVDA sessions never caption
+# an image.
 
-from ._doImageCaptioning import DoImageCaptioning
-from ._resultUI import recognizeNavigatorObject, SpeakResult, BrowseableResult
+#: Number of seconds after NVDA startup before the captioning model is warmed up, if enabled
+_warmUpDelay = 10
+
+
+def _loadedModule(name: str):
+	"""@return: the add-on module with the given name if it was already imported, else None"""
+	return sys.modules.get(f"{__name__}.{name}")
 
 
 def isScreenCurtainEnabled() -> bool:
 	"""Checks if screen curtain is currently enabled or not. Speaks message if it is enabled.
 	@return: True if screen curtain is enabled else False
 	"""
+	from visionEnhancementProviders.screenCurtain import ScreenCurtainSettings
 	isEnabled = any([x.providerId == ScreenCurtainSettings.getId() for x in vision.handler.getActiveProviderInfos()])
 	if isEnabled:
 		#Translators: reported when the user tries to start a recognition process while the screen curtain
@@ -46,6 +62,60 @@ def recentlyCalled() -> bool:
 
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 
+	def __init__(self):
+		super().__init__()
+		# Created on first use by L{_getPrefetcher} and L{script_watchObject}
+		self._prefetcher = None
+		self._watcher = None
+		self._warmUpTimer = None
+		if ImageCaptioning.getSettings().warmUpModel:
+			self._warmUpTimer = core.callLater(_warmUpDelay * 1000, self._warmUp)
+		loadTime = time.perf_counter() - _loadStartTime
+		log.debug(f"(imageCaptioning) Add-on loaded in {loadTime * 1000:.1f} ms")
+
+	def terminate(self):
+		if self._warmUpTimer:
+			self._warmUpTimer.Stop()
+		if self._prefetcher:
+			self._prefetcher.cancel()
+		if self._watcher:
+			self._watcher.stop()
+		# Stop the recognition worker, then unload the captioning model and DLLs kept resident between
+		# recognitions. Modules that were never imported have nothing to clean up.
+		scheduler = _loadedModule("_scheduler")
+		if scheduler:
+			scheduler.terminateScheduler()
+		backends = _loadedModule("_sayLookTell")
+		if backends:
+			backends.terminateEngine()
+		resultUI = _loadedModule("_resultUI")
+		if resultUI:
+			resultUI.saveCaptionCache()
+			resultUI.closeCacheBundles()
+		instrumentation = _loadedModule("_instrumentation")
+		if instrumentation:
+			# closes the file timings are exported to
+			instrumentation.configure(False)
+		super().terminate()
+
+	def _warmUp(self):
+		"""Loads the captioning model in the background once the user is idle."""
+		self._warmUpTimer = None
+		idleTime = secondsSinceLastInput()
+		if idleTime < IDLE_DELAY:
+			self._warmUpTimer = core.callLater(int((IDLE_DELAY - idleTime) * 1000), self._warmUp)
+			return
+		startTime = time.perf_counter()
+		from ._doImageCaptioning import warmUp
+		log.debug(f"(imageCaptioning) Modules imported in {(time.perf_counter() - startTime) * 1000:.1f} ms")
+		warmUp()
+
+	def _getPrefetcher(self):
+		if self._prefetcher is None:
+			from ._prefetch import Prefetcher
+			self._prefetcher = Prefetcher()
+		return self._prefetcher
+
 	@script(
 		# Translators: Input trigger to perform object detection on focused image
 		description=_("Perform image captioning on focused image. Press once to speak result, more than "
@@ -53,9 +123,12 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		category=SCRCAT_VISION,
 	)
 	def script_imageCaptioning(self, gesture):
+		from ._doImageCaptioning import DoImageCaptioning
+		from ._resultUI import recognizeNavigatorObject, SpeakResult, BrowseableResult, DetailedResult
 		wasRecentlyCalled = recentlyCalled()
+		settings = ImageCaptioning.getSettings()
 		# get filterNonGraphic preference
-		filterNonGraphic = ImageCaptioning.getSettings().filterNonGraphicElements
+		filterNonGraphic = settings.filterNonGraphicElements
 
 		# If the screen curtain is enabled, a screenshot of the element will only contain black pixels.
 		# Such an image won't produce good results so inform the user and quit.
@@ -65,7 +138,64 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 				recognizer = DoImageCaptioning(SpeakResult, time.time())
 				recognizeNavigatorObject(recognizer, filterNonGraphic=filterNonGraphic)
 			# Script was called in the last 3 seconds so the user probably pressed the gesture multiple
-			# times and wants the result to be presented in a virtual result window.
+			# times and wants the result to be presented in a virtual result window, with more detail if enabled.
 			else:
-				recognizer = DoImageCaptioning(BrowseableResult, time.time())
+				resultHandlerClass = DetailedResult if settings.describeMoreOnRepeat else BrowseableResult
+				recognizer = DoImageCaptioning(resultHandlerClass, time.time())
 				recognizeNavigatorObject(recognizer, filterNonGraphic=filterNonGraphic)
+
+	@script(
+		# Translators: Input trigger to caption all images of the focused document
+		description=_("Perform image captioning on all visible images of the focused document or object and "
+					"present the results in a virtual window."),
+		category=SCRCAT_VISION,
+	)
+	def script_captionAllImages(self, gesture):
+		if not isScreenCurtainEnabled():
+			from ._resultUI import recognizeAllGraphics
+			recognizeAllGraphics()
+
+	@script(
+		# Translators: Input trigger to caption the navigator object whenever it changes
+		description=_("Start or stop captioning the navigator object, such as a video or a slideshow, "
+					"whenever it changes."),
+		category=SCRCAT_VISION,
+	)
+	def script_watchObject(self, gesture):
+		if self._watcher and self._watcher.isWatching:
+			self._watcher.stop()
+			# Translators: Reported when the navigator object is no longer captioned whenever it changes.
+			ui.message(_("Stopped watching"))
+			return
+		if isScreenCurtainEnabled():
+			return
+		import api
+		if self._watcher is None:
+			from ._watch import RegionWatcher
+			self._watcher = RegionWatcher()
+		# Translators: Reported when the navigator object starts being captioned whenever it changes.
+		ui.message(_("Watching"))
+		self._watcher.start(api.getNavigatorObject())
+
+	@script(
+		# Translators: Input trigger to present the timings of image captioning
+		description=_("Present how long each stage of image captioning took, if timings are collected."),
+		category=SCRCAT_VISION,
+	)
+	def script_reportTimings(self, gesture):
+		from ._resultUI import presentTimings
+		presentTimings()
+
+	def event_gainFocus(self, obj, nextHandler):
+		# Caption the visible images of browse mode documents in the background, if enabled.
+		if (
+			ImageCaptioning.getSettings().prefetchImages
+			and obj.treeInterceptor and not obj.treeInterceptor.passThrough
+		):
+			self._getPrefetcher().onDocumentFocused(obj.treeInterceptor)
+		nextHandler()
+
+	def event_documentLoadComplete(self, obj, nextHandler):
+		if ImageCaptioning.getSettings().prefetchImages and obj.treeInterceptor:
+			self._getPrefetcher().onDocumentFocused(obj.treeInterceptor)
+		nextHandler()
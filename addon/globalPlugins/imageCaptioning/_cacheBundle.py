@@ -0,0 +1,290 @@
+# Image Captioning caption cache bundles
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+	from logHandler import log
+except ImportError:
+	# running outside of NVDA, for example in the tools
+	import logging
+	log = logging.getLogger(__name__)
+
+#: Identifies caption cache bundles
+_magic = b"ICBUNDLE"
+#: Version of the bundle format written by L{writeBundle}
+FORMAT_VERSION = 1
+#: Magic, format version, number of entries and size of the metadata, little endian
+_header = struct.Struct("<8sIII")
+#: Index record: content digest, offset and size of the caption in the caption area
+_record = struct.Struct("<16sIH")
+#: Size of content digests, see L{contentDigest}
+DIGEST_SIZE = 16
+#: File name extension of bundles
+EXTENSION = ".icb"
+#: Policies of L{mergeEntries} for digests with different captions in several bundles
+CONFLICT_POLICIES = ("first", "last", "drop")
+
+#: (content digest, caption) pair
+Entry = Tuple[bytes, str]
+
+
+def contentDigest(imageHash: str) -> bytes:
+	"""@param imageHash: hash of an image calculated by L{_imageHash.hashPixels}, which is prefixed with the
+	name of its hash function
+	@return: fixed size digest keying the caption of the image in bundles
+	"""
+	return hashlib.blake2b(imageHash.encode("ascii"), digest_size=DIGEST_SIZE).digest()
+
+
+def writeBundle(
+		path: str,
+		entries: Iterable[Entry],
+		modelVersion: str,
+		metadata: Optional[dict] = None,
+) -> int:
+	"""Writes a bundle. Captions shared by several images are only stored once.
+	The layout is a header, the metadata as JSON, an index of fixed size records sorted by digest and the
+	UTF-8 captions.
+	@param path: path of the bundle
+	@param entries: digests and captions, a digest must only appear once
+	@param modelVersion: version of the model that generated the captions, see L{_modelVariants.modelVersion}
+	@param metadata: other JSON serializable information stored in the bundle, such as where it comes from
+	@return: number of entries written
+	"""
+	metadataBytes = json.dumps(
+		dict(metadata or {}, modelVersion=modelVersion), separators=(",", ":")
+	).encode("utf-8")
+	records = []
+	captionOffsets: Dict[str, int] = {}
+	captions = bytearray()
+	for digest, caption in sorted(entries):
+		encoded = caption.encode("utf-8")
+		if len(encoded) > 0xFFFF:
+			continue
+		offset = captionOffsets.get(caption)
+		if offset is None:
+			offset = captionOffsets[caption] = len(captions)
+			captions += encoded
+		records.append(_record.pack(digest, offset, len(encoded)))
+	# write to a temporary file first so that a bundle being read is never seen half written
+	tempPath = path + ".tmp"
+	with open(tempPath, "wb") as f:
+		f.write(_header.pack(_magic, FORMAT_VERSION, len(records), len(metadataBytes)))
+		f.write(metadataBytes)
+		f.writelines(records)
+		f.write(captions)
+	os.replace(tempPath, path)
+	return len(records)
+
+
+class CacheBundle():
+	"""Read-only bundle of captions keyed by content digest, written by L{writeBundle}, so that captions
+	generated on one machine can be reused on others. Only the header is read when the bundle is opened. The
+	index is read into a dictionary by the first lookup and captions are read from the memory mapped file on
+	demand.
+	"""
+	def __init__(self, path: str):
+		"""Opens a bundle. Raises a L{ValueError} if the file is not a bundle of a supported version and an
+		L{OSError} if it cannot be read.
+		@param path: path of the bundle
+		"""
+		self.path = path
+		with open(path, "rb") as f:
+			header = f.read(_header.size)
+			if len(header) < _header.size:
+				raise ValueError(f"imageCaptioning: {path} is not a caption cache bundle")
+			magic, version, self._count, metadataSize = _header.unpack(header)
+			if magic != _magic:
+				raise ValueError(f"imageCaptioning: {path} is not a caption cache bundle")
+			if version != FORMAT_VERSION:
+				raise ValueError(f"imageCaptioning: Unsupported version {version} of caption cache bundle {path}")
+			#: Information stored with the bundle, see L{writeBundle}
+			self.metadata: dict = json.loads(f.read(metadataSize).decode("utf-8"))
+		self._indexStart = _header.size + metadataSize
+		self._captionsStart = self._indexStart + self._count * _record.size
+		# Maps digest to caption offset and size, read by the first lookup
+		self._index: Optional[Dict[bytes, Tuple[int, int]]] = None
+		self._mmap = None
+		self._lock = threading.Lock()
+
+	@property
+	def modelVersion(self) -> str:
+		return self.metadata.get("modelVersion", "")
+
+	def __len__(self) -> int:
+		return self._count
+
+	def _load(self):
+		with open(self.path, "rb") as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self._mmap) < self._captionsStart:
+			self._mmap.close()
+			self._mmap = None
+			raise ValueError(f"imageCaptioning: Truncated caption cache bundle {self.path}")
+		self._index = {
+			digest: (offset, size)
+			for digest, offset, size in _record.iter_unpack(self._mmap[self._indexStart:self._captionsStart])
+		}
+
+	def getByDigest(self, digest: bytes) -> Optional[str]:
+		"""@return: the caption of the image with the given content digest, None if it is not in the bundle"""
+		with self._lock:
+			if self._index is None:
+				self._load()
+			location = self._index.get(digest)
+			if location is None:
+				return None
+			offset, size = location
+			start = self._captionsStart + offset
+			return self._mmap[start:start + size].decode("utf-8")
+
+	def get(self, imageHash: str) -> Optional[str]:
+		"""@param imageHash: hash of an image calculated by L{_imageHash.hashPixels}
+		@return: the caption of the image, None if it is not in the bundle"""
+		return self.getByDigest(contentDigest(imageHash))
+
+	def entries(self) -> Iterator[Entry]:
+		"""@return: the digests and captions of the bundle, in index order"""
+		with self._lock:
+			if self._index is None:
+				self._load()
+			data = self._mmap[self._captionsStart:]
+			records = list(_record.iter_unpack(self._mmap[self._indexStart:self._captionsStart]))
+		for digest, offset, size in records:
+			yield digest, data[offset:offset + size].decode("utf-8")
+
+	def close(self):
+		with self._lock:
+			if self._mmap:
+				self._mmap.close()
+				self._mmap = None
+			self._index = None
+
+
+def mergeEntries(
+		bundles: Sequence[Iterable[Entry]],
+		conflicts: str = "first",
+		maxEntries: Optional[int] = None,
+		maxBytes: Optional[int] = None,
+) -> List[Entry]:
+	"""Merges the entries of several bundles.
+	@param bundles: entries of each bundle, in order of precedence
+	@param conflicts: what to do with digests that have different captions in several bundles, one of
+	L{CONFLICT_POLICIES}: keep the caption of the first or last bundle holding the digest, or drop the digest
+	@param maxEntries: maximum number of merged entries, None for no limit
+	@param maxBytes: maximum size of the merged entries in a bundle (index records and captions), None for no
+	limit
+	@return: merged entries. If they do not fit in the limits, images found in the most bundles are kept
+	first since they are the most likely to be seen again, then images of the first bundles.
+	"""
+	if conflicts not in CONFLICT_POLICIES:
+		raise ValueError(f"imageCaptioning: Unknown conflict policy {conflicts}")
+	merged: Dict[bytes, str] = OrderedDict()
+	occurrences: Dict[bytes, int] = {}
+	conflicting = set()
+	for entries in bundles:
+		for digest, caption in entries:
+			occurrences[digest] = occurrences.get(digest, 0) + 1
+			known = merged.get(digest)
+			if known is None:
+				merged[digest] = caption
+			elif known != caption:
+				conflicting.add(digest)
+				if conflicts == "last":
+					merged[digest] = caption
+	if conflicts == "drop":
+		for digest in conflicting:
+			del merged[digest]
+	if conflicting:
+		log.debug(f"(imageCaptioning) {len(conflicting)} conflicting captions merged with policy {conflicts}")
+	order = {digest: index for index, digest in enumerate(merged)}
+	ranked = sorted(merged, key=lambda digest: (-occurrences[digest], order[digest]))
+	result = []
+	size = 0
+	for digest in ranked:
+		if maxEntries is not None and len(result) >= maxEntries:
+			break
+		caption = merged[digest]
+		entrySize = _record.size + len(caption.encode("utf-8"))
+		if maxBytes is not None and size + entrySize > maxBytes:
+			continue
+		size += entrySize
+		result.append((digest, caption))
+	return result
+
+
+class CacheBundleSet():
+	"""The bundles of a directory (files with the L{EXTENSION} extension) that were generated by a given model
+	version, used as a read-only second source of captions behind the caption cache. Bundles are found by the
+	first lookup. If several bundles hold a caption for the same image, the first bundle in file name order
+	wins.
+	"""
+	def __init__(self, directory: str, modelVersion: str):
+		"""
+		@param directory: directory holding the bundles
+		@param modelVersion: bundles generated by another model version are ignored
+		"""
+		self.directory = directory
+		self.modelVersion = modelVersion
+		self._bundles: Optional[List[CacheBundle]] = None
+		self._lock = threading.Lock()
+
+	def _findBundles(self) -> List[CacheBundle]:
+		try:
+			names = sorted(name for name in os.listdir(self.directory) if name.endswith(EXTENSION))
+		except OSError:
+			return []
+		bundles = []
+		for name in names:
+			path = os.path.join(self.directory, name)
+			try:
+				bundle = CacheBundle(path)
+			except (OSError, ValueError):
+				log.warning(f"imageCaptioning: Could not read caption cache bundle {path}", exc_info=True)
+				continue
+			if bundle.modelVersion != self.modelVersion:
+				log.debug(f"(imageCaptioning) Ignoring caption cache bundle {path} of another model version")
+				continue
+			bundles.append(bundle)
+		if bundles:
+			log.debug(
+				f"(imageCaptioning) Using {len(bundles)} caption cache bundles holding "
+				f"{sum(len(bundle) for bundle in bundles)} captions"
+			)
+		return bundles
+
+	def get(self, imageHash: str) -> Optional[str]:
+		"""@param imageHash: hash of an image calculated by L{_imageHash.hashPixels}
+		@return: the caption of the image, None if no bundle holds it"""
+		with self._lock:
+			if self._bundles is None:
+				self._bundles = self._findBundles()
+			bundles = self._bundles
+		if not bundles:
+			return None
+		digest = contentDigest(imageHash)
+		for bundle in bundles:
+			try:
+				caption = bundle.getByDigest(digest)
+			except (OSError, ValueError):
+				log.warning(f"imageCaptioning: Could not read caption cache bundle {bundle.path}", exc_info=True)
+				with self._lock:
+					self._bundles = [other for other in self._bundles or () if other is not bundle]
+				continue
+			if caption is not None:
+				return caption
+		return None
+
+	def close(self):
+		with self._lock:
+			for bundle in self._bundles or ():
+				bundle.close()
+			self._bundles = None
@@ -0,0 +1,246 @@
+# Image Captioning result cache
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from ._perceptualHash import PerceptualIndex
+
+#: Version of the on-disk format written by L{CaptionCache.save}
+_storeVersion = 1
+
+
+class CaptionCache():
+	"""Least recently used cache of captions keyed by image hash (see L{_imageHash.hashPixels}).
+	The cache is bounded both by number of entries and by the approximate number of bytes used by the keys
+	and captions. If a store path is given, the cache is loaded from it on first use and can be written back
+	with L{save} so that captions survive NVDA restarts.
+	Captions may also be stored with the perceptual hash of their image (see L{_perceptualHash.dHash}) so
+	that captions of visually identical images can be found with L{findSimilar}.
+	Object identities (see L{_objectIdentity.getImageIdentity}) are mapped to the image hash of the image
+	the object last showed, so that the caption of a known object is found without capturing it. An identity
+	is forgotten once the caption of its image is evicted, and can be ignored once it has not been confirmed
+	by a capture for a while since the object may show another image by now.
+	"""
+	def __init__(self, maxEntries: int = 100, maxBytes: int = 1024 * 1024, storePath: Optional[str] = None):
+		"""
+		@param maxEntries: maximum number of cached captions
+		@param maxBytes: maximum total size of the cached keys and captions
+		@param storePath: file system path of the on-disk store, or None to keep the cache in memory only
+		"""
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.storePath = storePath
+		# Maps image hash to caption, least recently used entries first
+		self._entries = OrderedDict()
+		self._bytes = 0
+		self._perceptualIndex = PerceptualIndex()
+		# Maps object identity to image hash and the time (L{time.time}) the object was last captured showing
+		# that image, least recently used identities first
+		self._identities = OrderedDict()
+		self._loaded = storePath is None
+		self._dirty = False
+		# Results are cached from the recognition thread while lookups happen on the main thread
+		self._lock = threading.RLock()
+
+	def _entrySize(self, key: str, caption: str) -> int:
+		size = len(key) + len(caption.encode("utf-8"))
+		if self._perceptualIndex.getHash(key) is not None:
+			size += 8
+		return size
+
+	def __len__(self) -> int:
+		with self._lock:
+			self._ensureLoaded()
+			return len(self._entries)
+
+	def __contains__(self, key: str) -> bool:
+		with self._lock:
+			self._ensureLoaded()
+			return key in self._entries
+
+	@property
+	def sizeInBytes(self) -> int:
+		with self._lock:
+			self._ensureLoaded()
+			return self._bytes
+
+	def items(self) -> List[Tuple[str, str]]:
+		"""@return: the image hashes and captions of the cache, least recently used first"""
+		with self._lock:
+			self._ensureLoaded()
+			return list(self._entries.items())
+
+	def get(self, key: str) -> Optional[str]:
+		"""Returns the caption cached for an image and marks it as most recently used.
+		@param key: image hash
+		@return: cached caption or None if the image is not cached
+		"""
+		with self._lock:
+			self._ensureLoaded()
+			caption = self._entries.get(key)
+			if caption is not None:
+				self._entries.move_to_end(key)
+			return caption
+
+	def put(self, key: str, caption: str, perceptualHash: Optional[int] = None):
+		"""Caches the caption of an image, evicting the least recently used captions if required.
+		@param key: image hash
+		@param caption: caption of the image
+		@param perceptualHash: perceptual hash of the image, if known
+		"""
+		with self._lock:
+			self._ensureLoaded()
+			if perceptualHash is None:
+				perceptualHash = self._perceptualIndex.getHash(key)
+			self._remove(key)
+			self._add(key, caption, perceptualHash)
+			self._dirty = True
+			self._evict()
+
+	def getByIdentity(self, identity: str, maxAge: Optional[float] = None) -> Optional[Tuple[str, str]]:
+		"""Returns the caption of the image last shown by an object and marks it as most recently used.
+		@param identity: identity of the object
+		@param maxAge: number of seconds after which the image recorded for the object is no longer trusted and
+		the object must be captured again, None to always trust it
+		@return: image hash and caption, None if the identity is unknown, stale or its caption was evicted
+		"""
+		with self._lock:
+			self._ensureLoaded()
+			record = self._identities.get(identity)
+			if record is None:
+				return None
+			key, recordedTime = record
+			if maxAge is not None and time.time() - recordedTime > maxAge:
+				return None
+			caption = self.get(key)
+			if caption is None:
+				del self._identities[identity]
+				return None
+			self._identities.move_to_end(identity)
+			return key, caption
+
+	def putIdentity(self, identity: str, key: str):
+		"""Records the image an object was just captured showing. Does nothing if the image is not cached.
+		@param identity: identity of the object
+		@param key: image hash
+		"""
+		with self._lock:
+			self._ensureLoaded()
+			if key not in self._entries:
+				return
+			self._identities[identity] = (key, time.time())
+			self._dirty = True
+			self._identities.move_to_end(identity)
+			self._evict()
+
+	def findSimilar(self, perceptualHash: int, maxDistance: int) -> Optional[str]:
+		"""Finds the cached image most similar to an image.
+		@param perceptualHash: perceptual hash of the image
+		@param maxDistance: maximum number of differing bits of the perceptual hashes of similar images
+		@return: image hash of the most similar cached image or None if no cached image is similar enough
+		"""
+		with self._lock:
+			self._ensureLoaded()
+			return self._perceptualIndex.findSimilar(perceptualHash, maxDistance)
+
+	def configure(self, maxEntries: int, maxBytes: int):
+		"""Changes the bounds of the cache, evicting captions if the cache no longer fits."""
+		with self._lock:
+			self.maxEntries = maxEntries
+			self.maxBytes = maxBytes
+			if self._loaded:
+				self._evict()
+
+	def clear(self):
+		"""Removes all the cached captions."""
+		with self._lock:
+			self._entries.clear()
+			self._identities.clear()
+			self._perceptualIndex.clear()
+			self._bytes = 0
+			self._loaded = True
+			self._dirty = True
+
+	def _add(self, key: str, caption: str, perceptualHash: Optional[int]):
+		self._entries[key] = caption
+		if perceptualHash is not None:
+			self._perceptualIndex.add(key, perceptualHash)
+		self._bytes += self._entrySize(key, caption)
+
+	def _remove(self, key: str):
+		caption = self._entries.pop(key, None)
+		if caption is not None:
+			self._bytes -= self._entrySize(key, caption)
+			self._perceptualIndex.remove(key)
+
+	def _evict(self):
+		"""Removes least recently used entries until the cache is within its bounds."""
+		evicted = set()
+		while self._entries and (len(self._entries) > self.maxEntries or self._bytes > self.maxBytes):
+			key = next(iter(self._entries))
+			self._remove(key)
+			evicted.add(key)
+			self._dirty = True
+		if evicted:
+			for identity in [identity for identity, (key, _time) in self._identities.items() if key in evicted]:
+				del self._identities[identity]
+		# identities are small, there are at most as many of them as captions
+		while len(self._identities) > self.maxEntries:
+			self._identities.popitem(last=False)
+
+	def _ensureLoaded(self):
+		"""Loads the on-disk store the first time the cache is used. A missing or unreadable store results in
+		an empty cache."""
+		if self._loaded:
+			return
+		self._loaded = True
+		try:
+			with gzip.open(self.storePath, "rt", encoding="utf-8") as f:
+				store = json.load(f)
+		except (OSError, ValueError):
+			return
+		if store.get("version") != _storeVersion:
+			return
+		# entries are [imageHash, caption] or [imageHash, caption, perceptualHash] lists
+		for entry in store.get("entries", []):
+			key, caption = entry[0], entry[1]
+			self._remove(key)
+			self._add(key, caption, entry[2] if len(entry) > 2 else None)
+		# identities are [identity, imageHash, time] lists, stores written by older versions have none or lack
+		# the time, which makes them stale
+		for entry in store.get("identities", []):
+			identity, key = entry[0], entry[1]
+			if key in self._entries:
+				self._identities[identity] = (key, entry[2] if len(entry) > 2 else 0)
+		self._evict()
+		self._dirty = False
+
+	def save(self):
+		"""Writes the cache to its on-disk store if anything changed since it was loaded. Does nothing for
+		in-memory caches."""
+		with self._lock:
+			if not self.storePath or not self._dirty:
+				return
+			entries = []
+			for key, caption in self._entries.items():
+				perceptualHash = self._perceptualIndex.getHash(key)
+				entries.append([key, caption] if perceptualHash is None else [key, caption, perceptualHash])
+			identities = [
+				[identity, key, recordedTime]
+				for identity, (key, recordedTime) in self._identities.items()
+				if key in self._entries
+			]
+			store = {"version": _storeVersion, "entries": entries, "identities": identities}
+			os.makedirs(os.path.dirname(self.storePath), exist_ok=True)
+			# write to a temporary file first so that an interrupted save cannot corrupt the store
+			tempPath = self.storePath + ".tmp"
+			with gzip.open(tempPath, "wt", encoding="utf-8") as f:
+				json.dump(store, f, separators=(",", ":"))
+			os.replace(tempPath, self.storePath)
+			self._dirty = False
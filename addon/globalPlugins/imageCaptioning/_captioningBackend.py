@@ -0,0 +1,197 @@
+# Image Captioning backend interface
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import abc
+import os
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from . import _modelVariants, _preprocess
+from ._vocabulary import isCaptionWord
+
+#: Directory holding the model and vocabulary files
+DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
+
+#: Called with the next words of a caption while it is generated, see L{CaptioningBackend.getCaptionFromTensor}
+WordsCallback = Callable[[List[str]], None]
+
+
+class CaptioningBackend(abc.ABC):
+	"""Base class of the classes that run the image captioning model. A backend is meant to be long-lived:
+	the model is loaded once by L{initialize} and stays resident until L{terminate} is called.
+	Backends must implement the abstract L{initialize}, L{terminate} and L{isInitialized}, and at least one of
+	L{getCaption}, L{getCaptionFromPixels} and L{getCaptionFromTensor}, advertising the latter two with
+	L{supportsPixelInput} and L{supportsTensorInput}.
+	"""
+	#: Identifies the backend in the add-on settings
+	name = None
+
+	def __init__(self, modelVariant: str = _modelVariants.VARIANTS[0], dataDir: str = DATA_DIR):
+		"""
+		@param modelVariant: variant of the models to load, one of L{_modelVariants.VARIANTS}
+		@param dataDir: directory holding the model and vocabulary files
+		"""
+		# Only one caption may be generated at a time
+		self._lock = threading.RLock()
+		self.modelVariant = modelVariant
+		self.dataDir = dataDir
+
+	def _modelPath(self, model: str) -> str:
+		"""@return: path of the selected variant of a model, see L{_modelVariants.modelPath}"""
+		return _modelVariants.modelPath(self.dataDir, model, self.modelVariant)
+
+	def getAvailableVariants(self) -> List[str]:
+		"""@return: the model variants present in the data directory"""
+		return _modelVariants.availableVariants(self.dataDir)
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		"""@return: False if a dependency of the backend is missing"""
+		return True
+
+	@property
+	@abc.abstractmethod
+	def isInitialized(self) -> bool:
+		raise NotImplementedError
+
+	@property
+	def inputSize(self) -> Tuple[int, int]:
+		"""(width, height) of the images expected by the model"""
+		return _preprocess.INPUT_SIZE
+
+	@property
+	def supportsPixelInput(self) -> bool:
+		"""True if captions can be generated directly from a pixel buffer without writing an image file.
+		Only valid once the backend has been initialized."""
+		return False
+
+	@property
+	def supportsTensorInput(self) -> bool:
+		"""True if captions can be generated from an image already preprocessed by L{_preprocess}.
+		Only valid once the backend has been initialized."""
+		return False
+
+	@property
+	def supportsBatches(self) -> bool:
+		"""True if L{getCaptionsFromPixels} runs the model on several images at once rather than one at a time.
+		Only valid once the backend has been initialized."""
+		return False
+
+	@property
+	def supportsFeatures(self) -> bool:
+		"""True if the encoder and decoder can be run separately with L{encode} and L{decodeCaptions}, so that
+		the features of an image can be decoded again without running the encoder."""
+		return False
+
+	def acceptsPixels(self) -> bool:
+		"""@return: True if L{supportsPixelInput} or L{supportsTensorInput} will be True once the backend is
+		initialized. The inference process of L{_remoteBackend} only receives pixels, so a backend that accepts
+		neither cannot run there. This implementation initializes the backend to find out, backends override it
+		with a check that does not load the model."""
+		self.initialize()
+		return self.supportsPixelInput or self.supportsTensorInput
+
+	@abc.abstractmethod
+	def initialize(self):
+		"""Loads the model. Does nothing if already initialized."""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def terminate(self):
+		"""Unloads the model. The backend can be initialized again later."""
+		raise NotImplementedError
+
+	def getCaption(self, imagePath: str) -> str:
+		"""Performs image captioning on an image file and returns the resulting caption.
+		@param imagePath: path to image to be recognized
+		@return: caption
+		"""
+		raise NotImplementedError
+
+	def getCaptionFromPixels(
+			self,
+			pixels,
+			width: int,
+			height: int,
+			stride: int = None,
+			onWords: Optional[WordsCallback] = None,
+	) -> str:
+		"""Performs image captioning on a 32 bit BGRA pixel buffer and returns the resulting caption.
+		@param pixels: ctypes array or other object exporting the buffer interface holding the pixels
+		@param width: width of the image in pixels
+		@param height: height of the image in pixels
+		@param stride: number of bytes per row, defaults to M{4 * width}
+		@param onWords: see L{getCaptionFromTensor}
+		@return: caption
+		"""
+		raise NotImplementedError
+
+	def getCaptionFromTensor(self, tensor, onWords: Optional[WordsCallback] = None) -> str:
+		"""Performs image captioning on an image preprocessed by L{_preprocess.preprocessPixels}.
+		@param tensor: C contiguous float32 NumPy array of shape (1, 3, height, width)
+		@param onWords: called on the calling thread with the next words of the caption, without special
+		tokens, as soon as they are known. Backends that generate the whole caption at once never call it.
+		@return: caption
+		"""
+		raise NotImplementedError
+
+	def encode(self, tensor):
+		"""Runs the encoder on an image preprocessed by L{_preprocess.preprocessPixels}. Must only be called if
+		L{supportsFeatures} is True.
+		@param tensor: see L{getCaptionFromTensor}
+		@return: features of the image, a NumPy array to be passed to L{decodeCaptions}
+		"""
+		raise NotImplementedError
+
+	def decodeCaptions(
+			self,
+			features,
+			beamWidth: Optional[int] = None,
+			maxLength: Optional[int] = None,
+			count: int = 1,
+			onWords: Optional[WordsCallback] = None,
+	) -> List[str]:
+		"""Runs the decoder on the features of an image returned by L{encode}. Must only be called if
+		L{supportsFeatures} is True.
+		@param features: features of the image
+		@param beamWidth: number of hypotheses kept by beam search, None for the width the backend was created
+		with. Ignored by backends that cannot decode incrementally.
+		@param maxLength: maximum number of words, None for the default of the backend
+		@param count: maximum number of captions returned
+		@param onWords: see L{getCaptionFromTensor}
+		@return: the most likely captions, best first. Backends that cannot decode incrementally only return
+		one caption.
+		"""
+		raise NotImplementedError
+
+	def getCaptionsFromPixels(self, images: Iterable[Tuple]) -> Iterator[str]:
+		"""Performs image captioning on several 32 bit BGRA pixel buffers, yielding each caption as soon as it
+		is generated. The backend is held for the whole batch so no other caption can be generated in between.
+		This implementation captions the images one at a time, backends that support batched inference
+		override it.
+		@param images: (pixels, width, height) tuples, see L{getCaptionFromPixels}
+		@return: the captions, in the same order as the images
+		"""
+		with self._lock:
+			for pixels, width, height in images:
+				yield self.getCaptionFromPixels(pixels, width, height)
+
+	@staticmethod
+	def _captionFromWords(words: List[str]) -> str:
+		"""Formats the words of a caption as a sentence.
+		@param words: the words of the caption, without special tokens
+		@return: caption
+		"""
+		if not words:
+			return "Could not generate a caption for the image."
+		return " ".join(words) + "."
+
+	@classmethod
+	def _formatCaption(cls, result) -> str:
+		"""Removes special tokens from the raw model output and formats it as a sentence.
+		@param result: raw model output, words separated by spaces
+		@return: caption
+		"""
+		if not result:
+			return cls._captionFromWords([])
+		return cls._captionFromWords([word for word in result.split() if isCaptionWord(word)])
@@ -0,0 +1,85 @@
+# Image Captioning screen capture
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import ctypes
+from typing import Optional, Tuple
+
+import api
+import screenBitmap
+from browseMode import BrowseModeTreeInterceptor
+from contentRecog import ContentRecognizer, RecogImageInfo
+from locationHelper import RectLTWH
+
+from ._captureGeometry import clipRect, findContentBounds
+
+#: Stretch mode averaging the screen pixels covered by each captured pixel, see SetStretchBltMode
+_HALFTONE = 4
+#: Content left inside trimmed borders is only captured again if it is at least this many pixels wide and high
+_minContentSize = 16
+
+
+def getViewport(container) -> Optional[RectLTWH]:
+	"""@return: the screen rectangle in which the content of a browse mode document or of an object is visible,
+	None if it is not on screen"""
+	if isinstance(container, BrowseModeTreeInterceptor):
+		return container.rootNVDAObject.location
+	return api.getDesktopObject().location
+
+
+def _captureBitmap(imgInfo: RecogImageInfo):
+	"""Captures the screen rectangle of an image at its recognition size.
+	@return: 2D array of RGBQUAD values
+	"""
+	sb = screenBitmap.ScreenBitmap(imgInfo.recogWidth, imgInfo.recogHeight)
+	memDC = getattr(sb, "_memDC", None)
+	if memDC and imgInfo.resizeFactor < 1:
+		# The default stretch mode drops rows and columns when shrinking, averaging them keeps thin lines and
+		# text visible and avoids aliasing.
+		ctypes.windll.gdi32.SetStretchBltMode(memDC, _HALFTONE)
+		ctypes.windll.gdi32.SetBrushOrgEx(memDC, 0, 0, None)
+	return sb.captureImage(imgInfo.screenLeft, imgInfo.screenTop, imgInfo.screenWidth, imgInfo.screenHeight)
+
+
+def captureImage(
+		recognizer: ContentRecognizer,
+		location: RectLTWH,
+		viewport: Optional[RectLTWH] = None,
+		trimBorders: bool = False,
+) -> Optional[Tuple[RecogImageInfo, object]]:
+	"""Captures an image at the size given by the recognizer's C{getResizeFactor}. Only the part of the image
+	inside the viewport is captured since anything outside of it is not on screen.
+	@param recognizer: the recognizer the image is captured for
+	@param location: screen rectangle of the image
+	@param viewport: screen rectangle in which the image is visible, see L{getViewport}
+	@param trimBorders: if True, uniform borders around the image are cropped and the rest of the image is
+	captured again, so that the model only sees the content of the image
+	@return: image info and 2D array of RGBQUAD values, None if the image is not visible
+	"""
+	rect = tuple(location)
+	if viewport:
+		rect = clipRect(rect, tuple(viewport))
+		if rect is None:
+			return None
+	try:
+		imgInfo = RecogImageInfo.createFromRecognizer(*rect, recognizer)
+	except ValueError:
+		return None
+	pixels = _captureBitmap(imgInfo)
+	if not trimBorders:
+		return imgInfo, pixels
+	contentLeft, contentTop, contentRight, contentBottom = findContentBounds(
+		pixels, imgInfo.recogWidth, imgInfo.recogHeight
+	)
+	if (contentRight - contentLeft, contentBottom - contentTop) == (imgInfo.recogWidth, imgInfo.recogHeight):
+		return imgInfo, pixels
+	left = imgInfo.convertXToScreen(contentLeft)
+	top = imgInfo.convertYToScreen(contentTop)
+	width = imgInfo.convertXToScreen(contentRight) - left
+	height = imgInfo.convertYToScreen(contentBottom) - top
+	if width < _minContentSize or height < _minContentSize:
+		return imgInfo, pixels
+	try:
+		contentInfo = RecogImageInfo.createFromRecognizer(left, top, width, height, recognizer)
+	except ValueError:
+		return imgInfo, pixels
+	return contentInfo, _captureBitmap(contentInfo)
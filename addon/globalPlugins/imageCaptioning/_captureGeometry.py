@@ -0,0 +1,76 @@
+# Image Captioning capture geometry
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from typing import Optional, Tuple
+
+#: Images are captured at this many times the input size of the model, so that resizing them to the input
+#: size still averages several captured pixels per input pixel
+_oversampling = 2
+
+#: (left, top, width, height) rectangle in screen coordinates
+Rect = Tuple[int, int, int, int]
+
+
+def captureResizeFactor(width: int, height: int, inputSize: Tuple[int, int]) -> float:
+	"""Calculates the factor by which an image is scaled when it is captured. The model resizes every image
+	to its input size, so capturing more pixels than L{_oversampling} times that size only makes hashing,
+	lookups and preprocessing slower.
+	@param width: width of the image on screen
+	@param height: height of the image on screen
+	@param inputSize: (width, height) of the images expected by the model
+	@return: scale factor, at most 1 since images are never enlarged
+	"""
+	inputWidth, inputHeight = inputSize
+	return min(1.0, max(inputWidth * _oversampling / width, inputHeight * _oversampling / height))
+
+
+def clipRect(rect: Rect, viewport: Rect) -> Optional[Rect]:
+	"""@return: the part of a rectangle inside the viewport, None if it is entirely outside of it"""
+	left, top, width, height = rect
+	viewLeft, viewTop, viewWidth, viewHeight = viewport
+	clippedLeft = max(left, viewLeft)
+	clippedTop = max(top, viewTop)
+	clippedRight = min(left + width, viewLeft + viewWidth)
+	clippedBottom = min(top + height, viewTop + viewHeight)
+	if clippedRight <= clippedLeft or clippedBottom <= clippedTop:
+		return None
+	return clippedLeft, clippedTop, clippedRight - clippedLeft, clippedBottom - clippedTop
+
+
+def findContentBounds(pixels, width: int, height: int) -> Tuple[int, int, int, int]:
+	"""Finds the part of an image inside its uniform borders, such as the padding around an image or the
+	letterbox bars of a video. Each side is trimmed while its outermost row or column only holds pixels of
+	exactly the color of the corner of that side. Rows and columns are compared as bytes so no pixel is looked
+	at from Python.
+	@param pixels: ctypes array or other object exporting the buffer interface holding 32 bit BGRA pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: left, top, right and bottom (exclusive) pixel coordinates of the content, the whole image if it
+	is uniform
+	"""
+	data = memoryview(pixels).cast("B").cast("I")
+
+	def isBorder(line, color: bytes) -> bool:
+		return line.tobytes() == color * len(line)
+
+	def colorAt(x: int, y: int) -> bytes:
+		return data[y * width + x:y * width + x + 1].tobytes()
+
+	top, bottom = 0, height
+	color = colorAt(0, 0)
+	while top < bottom and isBorder(data[top * width:(top + 1) * width], color):
+		top += 1
+	if top == bottom:
+		return 0, 0, width, height
+	color = colorAt(0, height - 1)
+	while bottom - 1 > top and isBorder(data[(bottom - 1) * width:bottom * width], color):
+		bottom -= 1
+	# columns only need to be uniform between the trimmed rows
+	left, right = 0, width
+	color = colorAt(0, top)
+	while left < right - 1 and isBorder(data[top * width + left:bottom * width:width], color):
+		left += 1
+	color = colorAt(width - 1, top)
+	while right - 1 > left and isBorder(data[top * width + right - 1:bottom * width:width], color):
+		right -= 1
+	return left, top, right, bottom
@@ -0,0 +1,185 @@
+# Image Captioning caption decoding
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import abc
+import time
+from collections import namedtuple
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+#: Result of decoding one caption. I{wordIds} excludes the start and end tokens, I{score} is the log
+#: probability of the caption (normalised by the length penalty for beam search) and I{stepTimes} holds the
+#: number of seconds spent running the decoder at each step.
+DecodingResult = namedtuple("DecodingResult", ["wordIds", "score", "stepTimes"])
+
+#: Maximum number of words of a caption
+MAX_LENGTH = 20
+
+#: Called with the ids of the words of a caption that are certain to be part of it, as soon as they are known
+WordsCallback = Callable[[List[int]], None]
+
+
+class IncrementalDecoder(abc.ABC):
+	"""Runs the decoder one word at a time. The state of the decoder (such as the hidden state of a recurrent
+	network) is kept between steps, so each step only processes the last generated word instead of the whole
+	caption. States hold several hypotheses at once so that beam search runs a single step for all of them.
+	"""
+	#: Id of the token starting every caption
+	startId: int = 1
+	#: Id of the token ending every caption
+	endId: int = 2
+
+	@abc.abstractmethod
+	def initialState(self, features) -> Any:
+		"""Primes the decoder with the features of an image.
+		@param features: feature vector of shape (1, featureSize) output by the encoder
+		@return: state holding a single hypothesis
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def step(self, wordIds, state) -> Tuple["numpy.ndarray", Any]:
+		"""Runs one decoding step.
+		@param wordIds: int64 array with the last word of each hypothesis
+		@param state: state of the hypotheses
+		@return: logits of the next word of each hypothesis, of shape (hypotheses, vocabularySize), and the new
+		state
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def reorderState(self, state, indices) -> Any:
+		"""Selects the hypotheses kept by beam search.
+		@param indices: for each hypothesis of the new state, the index of the hypothesis it extends
+		@return: the new state
+		"""
+		raise NotImplementedError
+
+
+def _logSoftmax(logits) -> "numpy.ndarray":
+	logits = logits - logits.max(axis=-1, keepdims=True)
+	return logits - numpy.log(numpy.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def lengthPenalty(length: int, alpha: float) -> float:
+	"""Length normalisation of Wu et al. (2016). Without it, beam search favours short captions as every
+	word lowers the log probability of a caption.
+	@param alpha: 0 disables the normalisation, higher values favour longer captions
+	"""
+	return ((5 + length) / 6) ** alpha
+
+
+def _commonPrefixLength(sequences: Sequence[Sequence[int]]) -> int:
+	"""@return: number of leading words shared by all the sequences"""
+	length = 0
+	for words in zip(*sequences):
+		if any(word != words[0] for word in words):
+			break
+		length += 1
+	return length
+
+
+def greedyDecode(
+		decoder: IncrementalDecoder,
+		features,
+		maxLength: int = MAX_LENGTH,
+		onWords: Optional[WordsCallback] = None,
+) -> DecodingResult:
+	"""Picks the most likely word at each step until the end token is generated.
+	@param decoder: the decoder
+	@param features: feature vector of shape (1, featureSize) output by the encoder
+	@param maxLength: maximum number of words
+	@param onWords: called with each word as soon as it is generated
+	"""
+	state = decoder.initialState(features)
+	wordIds: List[int] = []
+	stepTimes: List[float] = []
+	score = 0.0
+	lastWord = numpy.array([decoder.startId], dtype=numpy.int64)
+	for _step in range(maxLength):
+		startTime = time.perf_counter()
+		logits, state = decoder.step(lastWord, state)
+		stepTimes.append(time.perf_counter() - startTime)
+		logProbs = _logSoftmax(logits[0])
+		wordId = int(logProbs.argmax())
+		score += float(logProbs[wordId])
+		if wordId == decoder.endId:
+			break
+		wordIds.append(wordId)
+		if onWords:
+			onWords([wordId])
+		lastWord[0] = wordId
+	return DecodingResult(wordIds, score, stepTimes)
+
+
+def beamSearch(
+		decoder: IncrementalDecoder,
+		features,
+		beamWidth: int = 3,
+		maxLength: int = MAX_LENGTH,
+		alpha: float = 0.7,
+		onWords: Optional[WordsCallback] = None,
+) -> List[DecodingResult]:
+	"""Keeps the I{beamWidth} most likely captions at each step. A hypothesis is finished as soon as it
+	generates the end token, and the search stops once I{beamWidth} hypotheses are finished.
+	Words are only certain once all the hypotheses agree on them, so the words passed to I{onWords} are the
+	prefix shared by all the hypotheses, which may lag a few words behind the decoder.
+	@param decoder: the decoder
+	@param features: feature vector of shape (1, featureSize) output by the encoder
+	@param beamWidth: number of hypotheses kept at each step
+	@param maxLength: maximum number of words
+	@param alpha: strength of the L{lengthPenalty}
+	@param onWords: called with the words shared by all hypotheses as soon as they are known
+	@return: the finished hypotheses, best first. Their I{stepTimes} are those of the whole search.
+	"""
+	state = decoder.initialState(features)
+	# start with a single hypothesis so that the first step does not yield beamWidth copies of the same word
+	hypotheses: List[List[int]] = [[]]
+	scores = numpy.zeros(1)
+	lastWords = numpy.array([decoder.startId], dtype=numpy.int64)
+	finished: List[Tuple[float, List[int]]] = []
+	stepTimes: List[float] = []
+	# number of words already passed to onWords
+	emitted = 0
+	length = 0
+	for length in range(1, maxLength + 1):
+		startTime = time.perf_counter()
+		logits, state = decoder.step(lastWords, state)
+		stepTimes.append(time.perf_counter() - startTime)
+		candidates = (scores[:, None] + _logSoftmax(logits)).ravel()
+		# at most one candidate per hypothesis ends it, so this always leaves beamWidth unfinished candidates
+		count = min(2 * beamWidth, candidates.size)
+		best = numpy.argpartition(-candidates, count - 1)[:count]
+		best = best[numpy.argsort(-candidates[best])]
+		vocabularySize = logits.shape[1]
+		kept: List[int] = []
+		for index in best:
+			hypothesis, wordId = divmod(int(index), vocabularySize)
+			if wordId == decoder.endId:
+				score = float(candidates[index]) / lengthPenalty(length, alpha)
+				finished.append((score, hypotheses[hypothesis]))
+			elif len(kept) < beamWidth:
+				kept.append(index)
+		parents = numpy.array([index // vocabularySize for index in kept])
+		lastWords = numpy.array([index % vocabularySize for index in kept], dtype=numpy.int64)
+		hypotheses = [hypotheses[parent] + [int(wordId)] for parent, wordId in zip(parents, lastWords)]
+		scores = candidates[kept]
+		if onWords:
+			sequences = hypotheses + [wordIds for _score, wordIds in finished]
+			certain = _commonPrefixLength(sequences)
+			if certain > emitted:
+				onWords(hypotheses[0][emitted:certain])
+				emitted = certain
+		if len(finished) >= beamWidth or length == maxLength:
+			break
+		state = decoder.reorderState(state, parents)
+	if len(finished) < beamWidth:
+		# hypotheses cut at the maximum length
+		for hypothesis, score in zip(hypotheses, scores):
+			finished.append((float(score) / lengthPenalty(length, alpha), hypothesis))
+	finished.sort(key=lambda item: item[0], reverse=True)
+	return [DecodingResult(wordIds, score, stepTimes) for score, wordIds in finished]
@@ -2,9 +2,8 @@
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
 import os
-import threading
 import tempfile
-from typing import Any
+from typing import Any, Optional
 from collections import namedtuple
 
 import wx
@@ -14,11 +13,177 @@ from logHandler import log
 from controlTypes import ROLE_GRAPHIC
 from locationHelper import RectLTWH
 
-from ._sayLookTell import SayLookTellCaptioning
+from visionEnhancementProviders.imageCaptioning import ImageCaptioning
+from ._sayLookTell import configureResources, getLoadedEngine, setBackend
+from . import _instrumentation, _preprocess
+from ._captureGeometry import captureResizeFactor
+from ._featureCache import FeatureCache
+from ._scheduler import getScheduler, RecognitionJob, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
 
 #: Elements with width or height small than this value will not be processed
 _sizeThreshold = 128
 
+#: Maximum total size of the encoder features kept by L{_featureCache}
+_featureCacheBytes = 4 * 1024 * 1024
+#: Encoder features of the last captioned images, so that a request for more detail only runs the decoder
+_featureCache = FeatureCache(_featureCacheBytes)
+#: Number of hypotheses kept by beam search, maximum number of words and number of captions generated when
+#: more detail is requested, see L{DoImageCaptioning.recognizeDetails}
+_detailBeamWidth = 5
+_detailMaxLength = 30
+_detailCaptionCount = 3
+
+#: Scheduler group of the recognitions of a single image, which supersede each other. Batches requested by
+#: the user, such as captioning all the images of a document, have no group and are never superseded.
+_singleImageGroup = "singleImage"
+
+#: Image captioning result. perceptualHash is None unless near-duplicate lookups are enabled. identity is the
+#: identity of the recognized object (see L{_objectIdentity}), None if it has none. alternatives is None
+#: unless more detail was requested, then it holds the other likely captions, best first.
+Detection = namedtuple(
+	'Detection',
+	['imageHash', 'caption', 'perceptualHash', 'identity', 'alternatives'],
+	defaults=(None, None, None)
+)
+
+
+def _saveTemporaryImage(pixels, width: int, height: int) -> str:
+	"""Saves a 32 bit BGRA pixel buffer as a temporary jpeg image. Used when the captioning engine cannot
+	accept pixel buffers directly.
+	@param pixels: 2D array of RGBAQUAD values that store image pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: file system path to the saved image
+	"""
+	bgra = memoryview(pixels).cast("B")
+	rgb = bytearray(width * height * 3)
+	rgb[0::3] = bgra[2::4]
+	rgb[1::3] = bgra[1::4]
+	rgb[2::3] = bgra[0::4]
+	# Unlike wx.Bitmap, wx.Image does not use any GUI resources so it is safe to use from this thread.
+	image = wx.Image(width, height, rgb)
+	imagePath = tempfile.mktemp(prefix="nvda_ImageCaption_", suffix=".jpg")
+	image.SaveFile(imagePath, wx.BITMAP_TYPE_JPEG)
+	return imagePath
+
+
+def isLargeEnough(location: RectLTWH) -> bool:
+	"""@return: True if the object is large enough to produce good results"""
+	return location.width >= _sizeThreshold and location.height >= _sizeThreshold
+
+
+def _configureEngine():
+	"""Selects the captioning backend and its options according to the add-on settings."""
+	settings = ImageCaptioning.getSettings()
+	configureResources(settings.unloadIdleMinutes * 60)
+	if settings.backend == "onnxruntime":
+		setBackend(
+			settings.backend,
+			isolated=settings.isolateInference,
+			intraOpThreads=settings.intraOpThreads,
+			interOpThreads=settings.interOpThreads,
+			optimizationLevel=settings.optimizationLevel,
+			parallelExecution=settings.parallelExecution,
+			beamWidth=settings.beamWidth,
+			modelVariant=settings.modelVariant,
+		)
+	else:
+		setBackend(settings.backend, isolated=settings.isolateInference, modelVariant=settings.modelVariant)
+
+
+def _canUseTensors(engine) -> bool:
+	"""@return: True if images can be preprocessed in Python and handed to the engine as tensors"""
+	return engine.supportsTensorInput and _preprocess.isAvailable()
+
+
+def _getCaption(engine, pixels, width: int, height: int, onWords=None) -> str:
+	"""Performs image captioning on pixels using the most efficient input supported by the engine: an image
+	preprocessed in Python, the pixel buffer itself or, as a last resort, a temporary jpeg image.
+	@param engine: the captioning engine
+	@param pixels: 2D array of RGBAQUAD values that store image pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@param onWords: called with the next words of the caption while it is generated, if the engine supports it
+	@return: caption
+	"""
+	if _canUseTensors(engine):
+		with _instrumentation.stage("handoff"):
+			tensor = _preprocess.preprocessPixels(pixels, width, height, inputSize=engine.inputSize)
+		return engine.getCaptionFromTensor(tensor, onWords=onWords)
+	if engine.supportsPixelInput:
+		return engine.getCaptionFromPixels(pixels, width, height, onWords=onWords)
+	return _getCaptionFromFile(engine, pixels, width, height)
+
+
+def _canUseFeatures(engine) -> bool:
+	"""@return: True if the encoder and decoder of the engine can be run separately, see L{_getFeatures}"""
+	return _canUseTensors(engine) and engine.supportsFeatures
+
+
+def _featureKey(engine, imageHash: str) -> tuple:
+	# features depend on the model they were computed with
+	return engine.name, engine.modelVariant, imageHash
+
+
+def _getFeatures(engine, imageHash: str, pixels, width: int, height: int):
+	"""Returns the encoder features of an image, running the encoder only if they are not cached. Must only be
+	called if L{_canUseFeatures} is True.
+	@param engine: the captioning engine
+	@param imageHash: hash of the image
+	@param pixels: 2D array of RGBAQUAD values that store image pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: the features
+	"""
+	key = _featureKey(engine, imageHash)
+	features = _featureCache.get(key)
+	if features is None:
+		with _instrumentation.stage("handoff"):
+			tensor = _preprocess.preprocessPixels(pixels, width, height, inputSize=engine.inputSize)
+		features = engine.encode(tensor)
+		_featureCache.put(key, features)
+	return features
+
+
+def _getCaptionFromFile(engine, pixels, width: int, height: int) -> str:
+	"""Performs image captioning on pixels by saving them as a temporary jpeg image, for DLLs that can only
+	read image files.
+	@param engine: the captioning engine
+	@param pixels: 2D array of RGBAQUAD values that store image pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: caption
+	"""
+	with _instrumentation.stage("handoff"):
+		imagePath = _saveTemporaryImage(pixels, width, height)
+	try:
+		return engine.getCaption(imagePath)
+	finally:
+		# Delete temporary image file since we don't need it anymore
+		os.remove(imagePath)
+
+
+def _warmUpEngine():
+	"""Loads the model and captions a blank image, so that buffers allocated by the first inference are
+	already in place when the user requests a caption."""
+	engine = getLoadedEngine()
+	width, height = engine.inputSize
+	_getCaption(engine, bytearray(width * height * 4), width, height)
+
+def _onWarmUpResult(result):
+	if isinstance(result, Exception):
+		log.error("imageCaptioning: Could not warm up the captioning model", exc_info=result)
+	else:
+		log.debug("(imageCaptioning) Captioning model warmed up")
+
+def warmUp():
+	"""Warms up the captioning engine on the recognition worker thread, at background priority so that
+	recognitions requested by the user run first. Must be called on the main thread."""
+	_configureEngine()
+	getScheduler().submit(
+		RecognitionJob("warmUp", _warmUpEngine, _onWarmUpResult, priority=PRIORITY_BACKGROUND)
+	)
+
 
 class DoImageCaptioning(contentRecog.ContentRecognizer):
 	"""Recognizer class that is responsible for calling the ImageCaptioning DLL that performs
@@ -32,54 +197,169 @@ class DoImageCaptioning(contentRecog.ContentRecognizer):
 		self.timeCreated = timeCreated
 		# Set to True only if Focus mode is enabled
 		self.checkChildren = False
+		# Perceptual hash of the recognized image, only set if near-duplicate lookups are enabled
+		self.perceptualHash = None
+		self.imageHash = None
+		# Identity of the recognized object, if it has one, see L{_objectIdentity.getImageIdentity}
+		self.identity = None
+		# Job running the recognition on the scheduler's worker thread
+		self._job = None
+		# Settings can only change on the main thread, which is where recognizers are created
+		_configureEngine()
+		#: Whether images are captured at a size derived from the model input size, see L{getResizeFactor}
+		self.captureAtModelSize = ImageCaptioning.getSettings().captureAtModelSize
+
+	def getResizeFactor(self, width: int, height: int) -> float:
+		"""Images are scaled down when captured if they are much larger than the input of the model, which
+		makes every later stage cheaper since the model would resize them anyway.
+		@param width: width of the image on screen
+		@param height: height of the image on screen
+		@return: scale factor of the captured image
+		"""
+		if not self.captureAtModelSize:
+			return 1
+		return captureResizeFactor(width, height, _preprocess.INPUT_SIZE)
 
-	def recognize(self, imageHash, pixels, imgInfo, onResult):
-		""" Starts the image detection process on a new thread and sets the I{onResult} method
+	def recognize(self, imageHash, pixels, imgInfo, onResult, onDiscardedResult=None,
+				priority=PRIORITY_INTERACTIVE, onWords=None):
+		""" Queues the image detection process on the recognition worker thread and sets the I{onResult} method
 		@param imageHash: hash used to uniquely identify the recognized image
 		@param pixels: 2D array of RGBAQUAD values that store image pixels
 		@param imgInfo: stores details of the image to be recognized
 		@param onResult: Function that defines logic for what to do when result is obtained
+		@param onDiscardedResult: Function called with the result if the recognition is cancelled after the
+		image was handed to the model
+		@param priority: scheduling priority, one of the L{_scheduler}.PRIORITY_* constants
+		@param onWords: Function called on the worker thread with the next words of the caption while it is
+		generated, if the captioning backend supports it
 		"""
 		self.imageHash = imageHash
 		self.imgInfo = imgInfo
-		# Copy pixels to empty bitmap and save it as a temporary jpeg image
-		bmp = wx.EmptyBitmap(imgInfo.recogWidth, imgInfo.recogHeight, 32)
-		bmp.CopyFromBuffer(pixels, wx.BitmapBufferFormat_RGB32)
-		self._imagePath = tempfile.mktemp(prefix="nvda_ImageCaption_", suffix=".jpg")
-		bmp.SaveFile(self._imagePath, wx.BITMAP_TYPE_JPEG)
-		# Set L{onResult} method
-		self._onResult = onResult
-		# Start image captioning on separate thread
-		t = threading.Thread(target=self._bgRecog)
-		t.daemon = True
-		t.start()
-
-	def _bgRecog(self):
-		"""Handles the image captioning process thread and calls L{onResult} when the result is ready."""
-		try:
-			result = self.detect(self._imagePath)
-		except Exception as e:
-			result = e
-		finally:
-			# Delete temporary image file since we don't need it anymore
-			os.remove(self._imagePath)
-		if self._onResult:
-			self._onResult(result)
+		# The pixels are handed to the captioning engine as is, no copy is made.
+		job = RecognitionJob(
+			imageHash,
+			lambda: self.detect(pixels, onWords),
+			onResult,
+			priority=priority,
+			onDiscardedResult=onDiscardedResult,
+			group=_singleImageGroup,
+		)
+		# assigned before submitting so that callbacks of a job that completes right away find it
+		self._job = job
+		# A newer interactive recognition supersedes all older ones that have not completed yet
+		self._job = getScheduler().submit(job, latestWins=priority == PRIORITY_INTERACTIVE)
+
+	@property
+	def isCancelled(self) -> bool:
+		"""True if the recognition was cancelled, or dropped by the scheduler before it could run."""
+		return bool(self._job and self._job.cancelled)
+
+	@property
+	def runTime(self) -> Optional[float]:
+		"""Number of seconds the recognition ran on the worker thread, not counting the time it was queued.
+		None if it has not run."""
+		return self._job.runTime if self._job else None
 
 	def cancel(self):
 		"""Cancels image captioning process
-		@note: process runs but nothing is done on completion."""
-		self._onResult = None
+		@note: If the image was already handed to the model, the process runs to completion but the result
+		is only passed to the I{onDiscardedResult} method."""
+		if self._job:
+			self._job.cancel()
 
-	def detect(self, imagePath):
+	def detect(self, pixels, onWords=None):
 		""" Gets the object detection results and returns it
-		@param imagePath: file system path to input image
+		@param pixels: 2D array of RGBAQUAD values that store image pixels
+		@param onWords: Function called with the next words of the caption while it is generated
 		@return: named tuple with attributes: imageHash and caption
 		"""
-		caption = SayLookTellCaptioning(imagePath).getCaption()
-		detectionResult = namedtuple('Detection', ['imageHash', 'caption'])
-		result = detectionResult(self.imageHash, caption)
-		return result
+		engine = getLoadedEngine()
+		width, height = self.imgInfo.recogWidth, self.imgInfo.recogHeight
+		if _canUseFeatures(engine):
+			# the features are kept so that a request for more detail does not run the encoder again
+			features = _getFeatures(engine, self.imageHash, pixels, width, height)
+			caption = engine.decodeCaptions(features, onWords=onWords)[0]
+		else:
+			caption = _getCaption(engine, pixels, width, height, onWords)
+		return Detection(self.imageHash, caption, self.perceptualHash, self.identity)
+
+	def recognizeDetails(self, imageHash, caption, pixels, imgInfo, onResult):
+		""" Queues the generation of a more detailed caption of an image and of alternative captions, with a
+		wider beam search and a longer maximum length, on the recognition worker thread. If the encoder
+		features of the image are cached, only the decoder is run.
+		@param imageHash: hash used to uniquely identify the recognized image
+		@param caption: caption already known for the image, presented as is if the backend cannot generate
+		alternatives
+		@param pixels: 2D array of RGBAQUAD values that store image pixels
+		@param imgInfo: stores details of the image to be recognized
+		@param onResult: Function that defines logic for what to do when result is obtained
+		"""
+		self.imageHash = imageHash
+		self.imgInfo = imgInfo
+		job = RecognitionJob(
+			("details", imageHash),
+			lambda: self.detectDetails(caption, pixels),
+			onResult,
+			group=_singleImageGroup,
+		)
+		self._job = getScheduler().submit(job, latestWins=True)
+
+	def detectDetails(self, caption, pixels):
+		""" Gets a more detailed caption and alternative captions of an image
+		@param caption: caption already known for the image
+		@param pixels: 2D array of RGBAQUAD values that store image pixels
+		@return: named tuple with attributes: imageHash, caption and alternatives
+		"""
+		engine = getLoadedEngine()
+		if not _canUseFeatures(engine):
+			return Detection(self.imageHash, caption, self.perceptualHash, self.identity, [])
+		width, height = self.imgInfo.recogWidth, self.imgInfo.recogHeight
+		features = _getFeatures(engine, self.imageHash, pixels, width, height)
+		captions = engine.decodeCaptions(
+			features, beamWidth=_detailBeamWidth, maxLength=_detailMaxLength, count=_detailCaptionCount
+		)
+		alternatives = [alternative for alternative in captions[1:] if alternative != captions[0]]
+		return Detection(self.imageHash, captions[0], self.perceptualHash, self.identity, alternatives)
+
+	def recognizeBatch(self, images, onImageResult, onResult):
+		""" Queues the image detection process of several images as a single job on the recognition worker
+		thread.
+		@param images: list of (imageHash, pixels, imgInfo, perceptualHash) tuples
+		@param onImageResult: Function called with the index of the image and its result as soon as each
+		image has been recognized
+		@param onResult: Function called with the list of all results, or the exception that ended the process
+		"""
+		key = tuple(image[0] for image in images)
+		job = RecognitionJob(key, lambda: self.detectBatch(images, onImageResult), onResult)
+		self._job = getScheduler().submit(job)
+
+	def detectBatch(self, images, onImageResult=None):
+		""" Gets the object detection results of several images
+		@param images: list of (imageHash, pixels, imgInfo, perceptualHash) tuples
+		@param onImageResult: Function called with the index of the image and its result as soon as each
+		image has been recognized
+		@return: list of named tuples with attributes: imageHash and caption
+		"""
+		engine = getLoadedEngine()
+		# Batched inference encodes all the images in a single run of the model, which is worth skipping the
+		# preprocessing of each image on this side.
+		if engine.supportsBatches or (engine.supportsPixelInput and not _canUseTensors(engine)):
+			captions = engine.getCaptionsFromPixels(
+				(pixels, imgInfo.recogWidth, imgInfo.recogHeight) for _hash, pixels, imgInfo, _pHash in images
+			)
+		else:
+			captions = (
+				_getCaption(engine, pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+				for _hash, pixels, imgInfo, _pHash in images
+			)
+		results = []
+		for index, caption in enumerate(captions):
+			imageHash, _pixels, _imgInfo, perceptualHash = images[index]
+			result = Detection(imageHash, caption, perceptualHash)
+			results.append(result)
+			if onImageResult:
+				onImageResult(index, result)
+		return results
 
 	def validateObject(self, obj) -> bool:
 		"""Checks if the focus or navigator object or any of its children (only in case of focus objects)
@@ -111,7 +391,7 @@ class DoImageCaptioning(contentRecog.ContentRecognizer):
 		@return: True is object size is greater than the minimum value, false otherwise
 		"""
 		# object must be greater than the size threshold in at least one dimension
-		if location.width < _sizeThreshold or location.height < _sizeThreshold:
+		if not isLargeEnough(location):
 			# Translators: Reported when the size focused element is too small to produce good results.
 			ui.message(_("Image too small to produce good results. Please try again with a larger image."))
 			log.debug(f"(imageCaptioning) Capture bounds: width={location.width}, height={location.height}.")
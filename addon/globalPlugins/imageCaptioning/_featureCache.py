@@ -0,0 +1,66 @@
+# Image Captioning encoder feature cache
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class FeatureCache():
+	"""Least recently used cache of the encoder output of images, bounded by the number of bytes of the
+	cached arrays. Features are only kept in memory: they depend on the model variant and are cheap to
+	compute again compared to what they save, a run of the encoder when the same image is decoded again.
+	"""
+	def __init__(self, maxBytes: int):
+		"""
+		@param maxBytes: maximum total size of the cached arrays
+		"""
+		self.maxBytes = maxBytes
+		# Maps key to features, least recently used entries first
+		self._entries = OrderedDict()
+		self._bytes = 0
+		# Features are cached on the recognition thread, the cache may be cleared from the main thread
+		self._lock = threading.Lock()
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	@property
+	def sizeInBytes(self) -> int:
+		return self._bytes
+
+	def get(self, key: Hashable) -> Optional[Any]:
+		"""Returns the features of an image and marks them as most recently used.
+		@param key: identifies the image and the model, see L{_doImageCaptioning._featureKey}
+		@return: the features, None if they are not cached
+		"""
+		with self._lock:
+			features = self._entries.get(key)
+			if features is not None:
+				self._entries.move_to_end(key)
+			return features
+
+	def put(self, key: Hashable, features):
+		"""Caches the features of an image, evicting the least recently used features if required. Features
+		larger than the whole cache are not cached.
+		@param key: identifies the image and the model
+		@param features: NumPy array output by the encoder
+		"""
+		with self._lock:
+			self._remove(key)
+			if features.nbytes > self.maxBytes:
+				return
+			self._entries[key] = features
+			self._bytes += features.nbytes
+			while self._bytes > self.maxBytes:
+				self._remove(next(iter(self._entries)))
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+
+	def _remove(self, key: Hashable):
+		features = self._entries.pop(key, None)
+		if features is not None:
+			self._bytes -= features.nbytes
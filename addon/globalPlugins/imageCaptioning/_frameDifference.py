@@ -0,0 +1,44 @@
+# Image Captioning difference between successive frames of a watched object
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from ._tiling import findDuplicateCaptions
+
+#: Number of columns and rows of the grayscale thumbnails compared by L{frameDifference}
+_thumbnailSize = 16
+
+
+def thumbnail(pixels, width: int, height: int) -> bytes:
+	"""Downsamples a captured image to a small grayscale thumbnail by sampling the centre of each cell of a
+	grid. Sampling a few hundred pixels is cheap enough to be done for every frame of a watched object.
+	@param pixels: ctypes array or other object exporting the buffer interface holding 32 bit BGRA pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: luma of each cell, row by row
+	"""
+	data = memoryview(pixels).cast("B")
+	xs = [min(width - 1, int(width * (i + 0.5) / _thumbnailSize)) for i in range(_thumbnailSize)]
+	ys = [min(height - 1, int(height * (i + 0.5) / _thumbnailSize)) for i in range(_thumbnailSize)]
+	luma = bytearray()
+	for y in ys:
+		rowStart = y * width
+		for x in xs:
+			index = (rowStart + x) * 4
+			# ITU-R 601 luma, pixels are stored in BGRA order
+			luma.append((data[index] * 114 + data[index + 1] * 587 + data[index + 2] * 299) // 1000)
+	return bytes(luma)
+
+
+def frameDifference(first: bytes, second: bytes) -> float:
+	"""@return: mean luma difference between two thumbnails (see L{thumbnail}) in percent, 100 if they were
+	taken from images of different shapes"""
+	if len(first) != len(second) or not first:
+		return 100.0
+	return sum(abs(a - b) for a, b in zip(first, second)) * 100 / (255 * len(first))
+
+
+def captionsDiffer(previous: str, caption: str) -> bool:
+	"""@return: True if a caption is worth presenting after the previous caption of the same object, that
+	is if it does not mostly repeat its words"""
+	if not previous:
+		return True
+	return not findDuplicateCaptions([previous, caption])[1]
@@ -0,0 +1,86 @@
+# Image Captioning shared memory frame transport
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import itertools
+import mmap
+import os
+import tempfile
+import uuid
+
+#: Distinguishes the rings created by this process
+_ringCounter = itertools.count()
+
+
+class FrameRing():
+	"""Shared memory divided into a fixed number of equally sized slots, each holding one captured image on
+	its way to the inference worker (see L{_remoteBackend}). Images are copied into a slot once and read in
+	place by the worker, the pipe between both processes only carries the slot number and image size.
+	On Windows the memory is a named mapping backed by the page file, elsewhere it is a file in the temporary
+	directory.
+	"""
+	def __init__(self, name: str, slots: int, slotSize: int, create: bool):
+		"""Use L{create} or L{open} instead.
+		@param name: name shared by both processes
+		@param slots: number of slots
+		@param slotSize: size of each slot in bytes
+		@param create: True in the process that owns the ring and deletes it once closed
+		"""
+		self.name = name
+		self.slots = slots
+		self.slotSize = slotSize
+		self._created = create
+		self._file = None
+		size = slots * slotSize
+		if os.name == "nt":
+			self._path = None
+			self._mmap = mmap.mmap(-1, size, tagname=name)
+		else:
+			self._path = os.path.join(tempfile.gettempdir(), name)
+			self._file = open(self._path, "w+b" if create else "r+b")
+			if create:
+				self._file.truncate(size)
+			self._mmap = mmap.mmap(self._file.fileno(), size)
+
+	@classmethod
+	def create(cls, slots: int, slotSize: int) -> "FrameRing":
+		"""Creates a ring with a unique name."""
+		name = f"nvda_imageCaptioning_{os.getpid()}_{next(_ringCounter)}_{uuid.uuid4().hex[:8]}"
+		return cls(name, slots, slotSize, create=True)
+
+	@classmethod
+	def open(cls, name: str, slots: int, slotSize: int) -> "FrameRing":
+		"""Opens a ring created by another process."""
+		return cls(name, slots, slotSize, create=False)
+
+	def describe(self) -> dict:
+		"""@return: the arguments of L{open}, to be sent to the other process"""
+		return {"name": self.name, "slots": self.slots, "slotSize": self.slotSize}
+
+	def write(self, slot: int, data) -> int:
+		"""Copies an image into a slot.
+		@param slot: index of the slot
+		@param data: object exporting the buffer interface, such as a captured RGBQUAD array
+		@return: number of bytes written
+		"""
+		view = memoryview(data).cast("B")
+		if view.nbytes > self.slotSize:
+			raise ValueError(f"imageCaptioning: {view.nbytes} bytes do not fit in a frame slot")
+		offset = slot * self.slotSize
+		self._mmap[offset:offset + view.nbytes] = view
+		return view.nbytes
+
+	def read(self, slot: int, length: int) -> memoryview:
+		"""@return: a writable view of the first I{length} bytes of a slot, without copying them. The view must
+		be released before the ring is closed."""
+		offset = slot * self.slotSize
+		return memoryview(self._mmap)[offset:offset + length]
+
+	def close(self):
+		self._mmap.close()
+		if self._file:
+			self._file.close()
+		if self._created and self._path:
+			try:
+				os.remove(self._path)
+			except OSError:
+				pass
@@ -0,0 +1,24 @@
+# Image Captioning user idleness detection
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from ctypes import Structure, sizeof, byref, windll, c_uint
+
+#: Number of seconds without keyboard or mouse input after which the user is considered idle
+IDLE_DELAY = 1.5
+
+
+class LASTINPUTINFO(Structure):
+	_fields_ = [
+		("cbSize", c_uint),
+		("dwTime", c_uint),
+	]
+
+
+def secondsSinceLastInput() -> float:
+	"""@return: number of seconds since the last keyboard or mouse input of the user"""
+	info = LASTINPUTINFO()
+	info.cbSize = sizeof(LASTINPUTINFO)
+	if not windll.user32.GetLastInputInfo(byref(info)):
+		return 0
+	# both tick counts wrap around after 49.7 days
+	return ((windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000
@@ -0,0 +1,65 @@
+# Image Captioning image hashing
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import hashlib
+from typing import Callable, Dict
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
+#: A hash function is a callable taking no arguments and returning a new hash object with the same
+#: C{update} and C{hexdigest} methods as the objects returned by L{hashlib}.
+HashFunction = Callable[[], "hashlib._Hash"]
+
+#: Available hash functions by name
+_hashFunctions: Dict[str, HashFunction] = {
+	"blake2b": lambda: hashlib.blake2b(digest_size=16),
+	"sha1": hashlib.sha1,
+}
+if xxhash:
+	_hashFunctions["xxh3"] = xxhash.xxh3_128
+
+#: Name of the hash function used by L{hashPixels}. xxh3 is the fastest but is an optional dependency,
+#: sha1 is the fastest of the hashlib functions (see benchmarks/benchImageHash.py).
+_activeHashFunction = "xxh3" if xxhash else "sha1"
+
+
+def registerHashFunction(name: str, hashFunction: HashFunction):
+	"""Makes a hash function available to L{setHashFunction}.
+	@param name: name used to select the hash function, also used as prefix of the image hashes
+	@param hashFunction: callable returning a new hashlib style hash object
+	"""
+	_hashFunctions[name] = hashFunction
+
+
+def setHashFunction(name: str):
+	"""Selects the hash function used by L{hashPixels}. Raises a L{KeyError} if no hash function with that
+	name was registered."""
+	global _activeHashFunction
+	if name not in _hashFunctions:
+		raise KeyError(f"imageCaptioning: Unknown hash function {name}")
+	_activeHashFunction = name
+
+
+def getHashFunction() -> str:
+	"""@return: name of the hash function used by L{hashPixels}"""
+	return _activeHashFunction
+
+
+def hashPixels(pixels, width: int, height: int) -> str:
+	"""Calculates a stable hash of a captured image. All channels of all pixels are hashed in a single pass
+	directly over the pixel memory, no copy of the pixels is made.
+	@param pixels: ctypes array or other object exporting the buffer interface holding the pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: hash of the image, prefixed with the name of the hash function used to calculate it so that
+	hashes calculated by different functions never match.
+	"""
+	name = _activeHashFunction
+	hashObj = _hashFunctions[name]()
+	# images with the same pixels but different dimensions must not have the same hash
+	hashObj.update(f"{width}x{height}".encode("ascii"))
+	hashObj.update(memoryview(pixels).cast("B"))
+	return f"{name}:{hashObj.hexdigest()}"
@@ -0,0 +1,96 @@
+# Image Captioning out of process inference server
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Runs a captioning backend in a separate Python process on behalf of L{_remoteBackend.RemoteCaptioning}.
+Requests and responses are JSON objects, one per line, read from the standard input and written to the
+standard output. Images are read in place from a L{_frameRing.FrameRing}.
+Run as: python _inferenceServer.py
+"""
+
+import json
+import os
+import sys
+import types
+
+
+def _writeMessage(output, message: dict):
+	output.write(json.dumps(message).encode("utf-8") + b"\n")
+	output.flush()
+
+
+def serve(requests, output):
+	"""Handles requests until the quit request is received or the input is closed.
+	@param requests: binary stream the requests are read from
+	@param output: binary stream the responses are written to
+	"""
+	from imageCaptioning import _preprocess
+	from imageCaptioning._frameRing import FrameRing
+	from imageCaptioning._sayLookTell import _createEngine
+
+	backend = None
+	ring = None
+	try:
+		for line in requests:
+			if not line.strip():
+				continue
+			request = json.loads(line)
+			op = request["op"]
+			requestId = request.get("id")
+			if op == "quit":
+				break
+			try:
+				if op == "ping":
+					_writeMessage(output, {"id": requestId, "op": "pong"})
+				elif op == "init":
+					backend = _createEngine(request["backend"], request["options"])
+					backend.initialize()
+					_writeMessage(output, {
+						"id": requestId,
+						"op": "ready",
+						"pid": os.getpid(),
+						"modelVariant": backend.modelVariant,
+						"inputSize": list(backend.inputSize),
+						"pixelInput": backend.supportsPixelInput or backend.supportsTensorInput,
+					})
+				elif op == "map":
+					if ring:
+						ring.close()
+					ring = FrameRing.open(**request["ring"])
+					_writeMessage(output, {"id": requestId, "op": "mapped"})
+				elif op == "caption":
+					width, height = request["width"], request["height"]
+					pixels = ring.read(request["slot"], width * height * 4)
+					onWords = lambda words: _writeMessage(output, {"id": requestId, "words": words})
+					try:
+						if backend.supportsTensorInput and _preprocess.isAvailable():
+							tensor = _preprocess.preprocessPixels(pixels, width, height, inputSize=backend.inputSize)
+							caption = backend.getCaptionFromTensor(tensor, onWords=onWords)
+						else:
+							caption = backend.getCaptionFromPixels(pixels, width, height, onWords=onWords)
+					finally:
+						pixels.release()
+					_writeMessage(output, {"id": requestId, "caption": caption})
+				else:
+					raise ValueError(f"imageCaptioning: Unknown request {op}")
+			except Exception as e:
+				_writeMessage(output, {"id": requestId, "error": f"{type(e).__name__}: {e}"})
+	finally:
+		if backend:
+			backend.terminate()
+		if ring:
+			ring.close()
+
+
+def main():
+	# Register the add-on package without running its __init__ module, which needs NVDA
+	package = types.ModuleType("imageCaptioning")
+	package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+	sys.modules["imageCaptioning"] = package
+	output = sys.stdout.buffer
+	# anything printed by the backends must not corrupt the responses
+	sys.stdout = sys.stderr
+	serve(sys.stdin.buffer, output)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,208 @@
+# Image Captioning latency instrumentation
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+#: Stages of a recognition, in pipeline order
+STAGES = (
+	# checking the object is a large enough graphic
+	"validation",
+	# looking up the caption by object identity, before anything is captured
+	"identityLookup",
+	"capture",
+	"hashing",
+	"cacheLookup",
+	# waiting for the recognition worker, only measured for interactive recognitions
+	"queued",
+	# preprocessing the image or saving it to a temporary file for the backend
+	"handoff",
+	"encoder",
+	"decoder",
+	# encoder and decoder, for backends that run both in a single call
+	"model",
+	"postprocessing",
+	"presentation",
+	# from the gesture to the presentation of the caption
+	"total",
+)
+
+#: Number of measurements kept per stage
+_historySize = 500
+
+
+class Histogram():
+	"""Keeps the last measurements of a stage to calculate percentiles."""
+	def __init__(self, size: Optional[int] = _historySize):
+		"""
+		@param size: number of measurements kept, None to keep them all
+		"""
+		self._durations: Deque[float] = deque(maxlen=size)
+		#: Number of measurements since the histogram was created, including discarded ones
+		self.count = 0
+
+	def add(self, seconds: float):
+		self._durations.append(seconds)
+		self.count += 1
+
+	def percentiles(self, percents: Iterable[float] = (50, 95, 99)) -> List[float]:
+		"""@return: the percentiles of the kept measurements (nearest rank), in seconds"""
+		durations = sorted(self._durations)
+		if not durations:
+			return [0.0 for _percent in percents]
+		last = len(durations) - 1
+		return [durations[min(last, int(len(durations) * percent / 100))] for percent in percents]
+
+	@property
+	def maximum(self) -> float:
+		return max(self._durations, default=0.0)
+
+
+class _StageTimer():
+	"""Context manager measuring one stage."""
+	__slots__ = ("stage", "startTime")
+
+	def __init__(self, stage: str):
+		self.stage = stage
+
+	def __enter__(self):
+		self.startTime = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		record(self.stage, time.perf_counter() - self.startTime)
+		return False
+
+
+class _NoopTimer():
+	"""Context manager returned by L{stage} when instrumentation is disabled."""
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+
+_noopTimer = _NoopTimer()
+
+#: Set by L{configure}. When False, L{stage} and L{record} return immediately.
+enabled = False
+_histograms: Dict[str, Histogram] = OrderedDict((name, Histogram()) for name in STAGES)
+_lock = threading.Lock()
+#: File measurements are exported to as JSON lines, if any
+_exportFile = None
+_exportPath: Optional[str] = None
+
+
+def configure(enable: bool, exportPath: Optional[str] = None):
+	"""Enables or disables instrumentation.
+	@param enable: whether measurements are collected
+	@param exportPath: if set, every measurement is also appended to this file as a JSON object
+	"""
+	global enabled, _exportFile, _exportPath
+	with _lock:
+		enabled = enable
+		if not enable:
+			exportPath = None
+		if exportPath == _exportPath:
+			return
+		if _exportFile:
+			_exportFile.close()
+			_exportFile = None
+		_exportPath = exportPath
+		if exportPath:
+			_exportFile = open(exportPath, "a", encoding="utf-8")
+
+
+def stage(name: str):
+	"""Measures the duration of a stage, to be used as a context manager:
+	C{with stage("encoder"): ...}. Costs a global lookup and a function call when disabled.
+	@param name: one of L{STAGES}
+	"""
+	if not enabled:
+		return _noopTimer
+	return _StageTimer(name)
+
+
+def record(name: str, seconds: float):
+	"""Adds the duration of a stage measured by the caller.
+	@param name: one of L{STAGES}
+	@param seconds: duration of the stage
+	"""
+	if not enabled:
+		return
+	with _lock:
+		_histograms.setdefault(name, Histogram()).add(seconds)
+		if _exportFile:
+			_exportFile.write(json.dumps({"time": time.time(), "stage": name, "seconds": seconds}) + "\n")
+
+
+def timed(name: str):
+	"""Decorator measuring every call of a function as a stage.
+	@param name: one of L{STAGES}
+	"""
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with stage(name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def flush():
+	"""Writes the exported measurements to disk."""
+	with _lock:
+		if _exportFile:
+			_exportFile.flush()
+
+
+def summarize(histograms: Dict[str, Histogram]) -> Dict[str, Dict[str, float]]:
+	"""@return: the count, percentiles and maximum, in seconds, of each stage that was measured"""
+	summaries = OrderedDict()
+	for name, histogram in histograms.items():
+		if histogram.count:
+			p50, p95, p99 = histogram.percentiles()
+			summaries[name] = {"count": histogram.count, "p50": p50, "p95": p95, "p99": p99, "max": histogram.maximum}
+	return summaries
+
+
+def formatReport(histograms: Dict[str, Histogram]) -> str:
+	"""@return: a table with the count and percentiles of each stage that was measured, in milliseconds"""
+	lines = ["stage".ljust(16) + "count".rjust(8) + "".join(title.rjust(10) for title in ("p50", "p95", "p99", "max"))]
+	for name, histogram in histograms.items():
+		if not histogram.count:
+			continue
+		p50, p95, p99 = histogram.percentiles()
+		lines.append(
+			name.ljust(16) + f"{histogram.count:8d}"
+			+ "".join(f"{seconds * 1000:10.1f}" for seconds in (p50, p95, p99, histogram.maximum))
+		)
+	return "\n".join(lines)
+
+
+def report() -> str:
+	"""@return: the percentiles of the last measurements of each stage, see L{formatReport}"""
+	with _lock:
+		return formatReport(_histograms)
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+	"""@return: the percentiles of the last measurements of each stage, see L{summarize}"""
+	with _lock:
+		return summarize(_histograms)
+
+
+def reset(historySize: Optional[int] = _historySize):
+	"""Discards all measurements.
+	@param historySize: number of measurements kept per stage from now on, None to keep them all
+	"""
+	with _lock:
+		for name in _histograms:
+			_histograms[name] = Histogram(historySize)
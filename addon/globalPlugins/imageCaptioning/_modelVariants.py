@@ -0,0 +1,142 @@
+# Image Captioning model variants
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import hashlib
+import os
+import statistics
+import time
+from typing import Callable, Dict, List, Sequence
+
+try:
+	from logHandler import log
+except ImportError:
+	# running outside of NVDA, for example in the benchmarks
+	import logging
+	log = logging.getLogger(__name__)
+
+#: Variants of the models, from the most to the least accurate. fp16 variants store their weights as 16 bit
+#: floats, which halves their download size but not their run time, and int8 variants are dynamically
+#: quantised, both are produced by tools/convertModels.py.
+VARIANTS = ("fp32", "fp16", "int8")
+#: Model variant setting value that selects the fastest available variant with L{selectFastestVariant}
+AUTO = "auto"
+
+
+def modelPath(dataDir: str, model: str, variant: str) -> str:
+	"""@param model: name of the model, such as "encoder"
+	@return: path of the file of a model variant, for example encoder.int8.onnx. fp32 models keep their
+	original name.
+	"""
+	if variant == "fp32":
+		return os.path.join(dataDir, f"{model}.onnx")
+	return os.path.join(dataDir, f"{model}.{variant}.onnx")
+
+
+#: Number of bytes read from the start and from the end of each model file by L{modelVersion}
+_fingerprintSize = 1024 * 1024
+#: Results of L{modelVersion} by the path, size and modification time of the model files
+_modelVersions: Dict[tuple, str] = {}
+
+def modelVersion(dataDir: str, variant: str) -> str:
+	"""Identifies the models of a variant by a digest of the size and of the first and last megabyte of their
+	files, so that machines with the same models agree on it without reading whole models. Captions generated
+	by another model version are not reused, see L{_cacheBundle}.
+	@return: 16 hexadecimal digits
+	"""
+	files = []
+	for model in ("encoder", "decoder", "decoder_step"):
+		path = modelPath(dataDir, model, variant)
+		try:
+			stat = os.stat(path)
+		except OSError:
+			continue
+		files.append((model, path, stat.st_size, stat.st_mtime))
+	key = tuple(files)
+	version = _modelVersions.get(key)
+	if version is None:
+		digest = hashlib.blake2b(digest_size=8)
+		for model, path, size, _mtime in files:
+			digest.update(f"{model}:{size}:".encode("ascii"))
+			with open(path, "rb") as f:
+				digest.update(f.read(_fingerprintSize))
+				if size > _fingerprintSize:
+					f.seek(max(_fingerprintSize, size - _fingerprintSize))
+					digest.update(f.read())
+		version = _modelVersions[key] = digest.hexdigest()
+	return version
+
+
+def availableVariants(dataDir: str) -> List[str]:
+	"""@return: the variants for which both an encoder and a decoder (either a complete or a step decoder) are
+	present in the data directory"""
+	return [
+		variant for variant in VARIANTS
+		if os.path.exists(modelPath(dataDir, "encoder", variant)) and (
+			os.path.exists(modelPath(dataDir, "decoder", variant))
+			or os.path.exists(modelPath(dataDir, "decoder_step", variant))
+		)
+	]
+
+
+def _benchmarkPixels(width: int, height: int) -> bytearray:
+	"""@return: a 32 bit BGRA gradient image, so that the benchmark does not depend on the screen"""
+	return bytearray(
+		(x * 255 // width if channel != 1 else y * 255 // height) if channel != 3 else 255
+		for y in range(height) for x in range(width) for channel in range(4)
+	)
+
+
+#: Results of L{selectFastestVariant}, so that the benchmark only runs once per NVDA session
+_fastestVariants: Dict[tuple, str] = {}
+
+def selectFastestVariant(
+		createBackend: Callable[[str], "CaptioningBackend"],
+		variants: Sequence[str],
+		key: tuple = (),
+		repeat: int = 3,
+) -> str:
+	"""Captions a synthetic image with each variant and returns the variant with the lowest median caption
+	time. Variants are loaded one at a time and unloaded once measured, so that the benchmark never holds
+	more than one model in memory.
+	@param createBackend: creates a backend using the given variant
+	@param variants: the variants to compare
+	@param key: identifies the backend and its options, the result is remembered for this key
+	@param repeat: number of captions timed per variant
+	@return: the fastest variant, or the first one if they cannot be compared
+	"""
+	if len(variants) < 2:
+		return variants[0] if variants else VARIANTS[0]
+	key = (key, tuple(variants))
+	if key in _fastestVariants:
+		return _fastestVariants[key]
+	width = height = 224
+	pixels = _benchmarkPixels(width, height)
+	timings = {}
+	for variant in variants:
+		backend = createBackend(variant)
+		try:
+			backend.initialize()
+			if not backend.supportsPixelInput:
+				_fastestVariants[key] = variants[0]
+				return variants[0]
+			# the first caption includes one-off allocations
+			backend.getCaptionFromPixels(pixels, width, height)
+			times = []
+			for _repeat in range(repeat):
+				startTime = time.perf_counter()
+				backend.getCaptionFromPixels(pixels, width, height)
+				times.append(time.perf_counter() - startTime)
+			timings[variant] = statistics.median(times)
+		except Exception:
+			log.warning(f"(imageCaptioning) Could not benchmark {variant} model variant", exc_info=True)
+		finally:
+			backend.terminate()
+	if not timings:
+		return variants[0]
+	fastest = min(timings, key=timings.get)
+	log.info(
+		f"(imageCaptioning) Selected {fastest} model variant, median caption times: "
+		+ ", ".join(f"{variant} {seconds * 1000:.0f} ms" for variant, seconds in timings.items())
+	)
+	_fastestVariants[key] = fastest
+	return fastest
@@ -0,0 +1,55 @@
+# Image Captioning identity of graphic objects
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import hashlib
+from typing import Optional
+
+#: Number of seconds the image recorded for an identity is trusted without capturing the object again. Images
+#: may be replaced in place (carousels, charts refreshed under the same URL, canvases), so an identity only
+#: saves captures for a while after the object was last captured.
+IDENTITY_MAX_AGE = 5 * 60
+
+
+def _getIA2Attribute(obj, name: str) -> Optional[str]:
+	try:
+		attributes = getattr(obj, "IA2Attributes", None)
+	except Exception:
+		# the object may have died, or its IAccessible2 implementation may fail
+		return None
+	return (attributes.get(name) or None) if attributes else None
+
+
+def _getDocumentIdentifier(obj) -> Optional[str]:
+	"""@return: an identifier of the document holding an object, usually its URL"""
+	try:
+		treeInterceptor = obj.treeInterceptor
+		return getattr(treeInterceptor, "documentConstantIdentifier", None) if treeInterceptor else None
+	except Exception:
+		return None
+
+
+def getImageIdentity(obj, width: int, height: int) -> Optional[str]:
+	"""Builds a key identifying the image shown by a graphic object without capturing it, so that its cached
+	caption can be found with a dictionary lookup. Images are identified by their source URL, or else by the
+	document URL and their element ID. Names are not used: images sharing alternative text, such as the
+	avatars or icons of a list, would share the caption of the first one captioned. The size of the image on
+	screen is part of the key since the same image shown at another size is captured differently.
+	@param obj: the graphic NVDAObject
+	@param width: width of the image on screen
+	@param height: height of the image on screen
+	@return: the identity, None if the object has no stable identity and must be captured to be identified
+	"""
+	source = _getIA2Attribute(obj, "src")
+	if source:
+		identity = f"src\0{source}"
+	else:
+		document = _getDocumentIdentifier(obj)
+		if not document:
+			return None
+		elementId = _getIA2Attribute(obj, "id")
+		if not elementId:
+			return None
+		identity = f"id\0{document}\0{elementId}"
+	identity = f"{identity}\0{width}x{height}"
+	# sources may be long data URLs, hashing keeps the keys of the caption cache short
+	return "id:" + hashlib.blake2b(identity.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
@@ -0,0 +1,336 @@
+# Image Captioning ONNX Runtime backend
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import importlib
+import importlib.util
+import os
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from ._captioningBackend import CaptioningBackend, DATA_DIR, WordsCallback
+from ._decoding import MAX_LENGTH, DecodingResult, IncrementalDecoder, beamSearch, greedyDecode
+from ._vocabulary import Vocabulary, getVocabulary
+from . import _instrumentation, _preprocess
+
+#: The onnxruntime module. Importing it takes longer than loading the rest of the add-on, so it is only
+#: imported when a backend is initialized, see L{_importOnnxRuntime}.
+onnxruntime = None
+
+def _importOnnxRuntime():
+	global onnxruntime
+	if onnxruntime is None:
+		onnxruntime = importlib.import_module("onnxruntime")
+
+#: Graph optimization levels of the L{OnnxRuntimeCaptioning} backend, from none to all
+_optimizationLevels = (
+	"ORT_DISABLE_ALL",
+	"ORT_ENABLE_BASIC",
+	"ORT_ENABLE_EXTENDED",
+	"ORT_ENABLE_ALL",
+)
+
+
+class OnnxStepDecoder(IncrementalDecoder):
+	"""Runs a decoder exported as a single recurrent step. The first input of the step model is the embedding
+	of the last word, its other inputs are the state carried between steps (such as the hidden and cell
+	states of an LSTM). Its first output are the logits of the next word, the other outputs are the new
+	state, in the same order as the inputs. The first dynamic dimension of each state input is the
+	hypothesis dimension, all other dimensions must be fixed.
+	Word embeddings are looked up in NumPy, the image features are fed as the embedding of the first step.
+	"""
+	def __init__(self, session: "onnxruntime.InferenceSession", embeddings: "numpy.ndarray"):
+		"""
+		@param session: session of the step model
+		@param embeddings: word embeddings of shape (vocabularySize, embeddingSize)
+		"""
+		self._session = session
+		self._embeddings = embeddings
+		inputs = session.get_inputs()
+		self._inputName = inputs[0].name
+		self._stateNames = [state.name for state in inputs[1:]]
+		self._stateShapes = [state.shape for state in inputs[1:]]
+		self._batchAxes = [
+			next(axis for axis, dim in enumerate(shape) if not isinstance(dim, int))
+			for shape in self._stateShapes
+		]
+
+	def _run(self, inputs, state):
+		feed = {self._inputName: inputs.astype(numpy.float32, copy=False)}
+		feed.update(zip(self._stateNames, state))
+		outputs = self._session.run(None, feed)
+		return outputs[0], outputs[1:]
+
+	def initialState(self, features):
+		state = [
+			numpy.zeros([1 if axis == batchAxis else dim for axis, dim in enumerate(shape)], "float32")
+			for shape, batchAxis in zip(self._stateShapes, self._batchAxes)
+		]
+		_logits, state = self._run(features, state)
+		return state
+
+	def step(self, wordIds, state):
+		return self._run(self._embeddings[wordIds], state)
+
+	def reorderState(self, state, indices):
+		return [tensor.take(indices, axis=batchAxis) for tensor, batchAxis in zip(state, self._batchAxes)]
+
+
+class OnnxRuntimeCaptioning(CaptioningBackend):
+	"""Backend that runs the encoder and decoder models with the onnxruntime Python package. Unlike the
+	DLL, it works on any platform supported by onnxruntime and its sessions can be tuned.
+	The encoder receives images preprocessed by L{_preprocess} and outputs a feature vector, which the decoder
+	turns into a sequence of word ids. If the data directory holds a decoder exported as a single step
+	(decoder_step.onnx and embeddings.npy, see L{OnnxStepDecoder}), captions are decoded incrementally with
+	greedy decoding or beam search, otherwise the whole caption is generated by one run of decoder.onnx.
+	"""
+	#: Strength of the length penalty of beam search, see L{_decoding.lengthPenalty}
+	lengthPenaltyAlpha = 0.7
+
+	name = "onnxruntime"
+
+	def __init__(
+			self,
+			intraOpThreads: int = 0,
+			interOpThreads: int = 0,
+			optimizationLevel: int = 3,
+			parallelExecution: bool = False,
+			beamWidth: int = 1,
+			modelVariant: str = "fp32",
+			dataDir: str = DATA_DIR,
+	):
+		"""
+		@param intraOpThreads: number of threads used to run an operator, 0 lets onnxruntime decide
+		@param interOpThreads: number of threads used to run independent operators in parallel execution
+		mode, 0 lets onnxruntime decide
+		@param optimizationLevel: graph optimization level, from 0 (disabled) to 3 (all optimizations)
+		@param parallelExecution: run independent operators in parallel instead of sequentially
+		@param beamWidth: number of hypotheses kept by beam search, 1 for greedy decoding. Only used with an
+		incremental decoder.
+		@param modelVariant: variant of the models to load, one of L{_modelVariants.VARIANTS}
+		@param dataDir: directory holding the model and vocabulary files
+		"""
+		super().__init__(modelVariant, dataDir)
+		self.intraOpThreads = intraOpThreads
+		self.interOpThreads = interOpThreads
+		self.optimizationLevel = optimizationLevel
+		self.parallelExecution = parallelExecution
+		self.beamWidth = beamWidth
+		self.encoderPath = self._modelPath("encoder")
+		self.decoderPath = self._modelPath("decoder")
+		self.stepDecoderPath = self._modelPath("decoder_step")
+		self.embeddingsPath = os.path.join(dataDir, "embeddings.npy")
+		self.vocabPath = os.path.join(dataDir, "vocab.txt")
+		self._encoder = None
+		self._decoder = None
+		self._stepDecoder: Optional[OnnxStepDecoder] = None
+		self._vocabulary: Optional[Vocabulary] = None
+		#: Decoding of the last caption generated by the incremental decoder, holds the time of each step
+		self.lastDecoding: Optional[DecodingResult] = None
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		return importlib.util.find_spec("onnxruntime") is not None and _preprocess.isAvailable()
+
+	@property
+	def isInitialized(self) -> bool:
+		return self._encoder is not None
+
+	@property
+	def supportsPixelInput(self) -> bool:
+		return True
+
+	@property
+	def supportsTensorInput(self) -> bool:
+		return True
+
+	def acceptsPixels(self) -> bool:
+		return True
+
+	@property
+	def inputSize(self) -> Tuple[int, int]:
+		"""(width, height) of the images expected by the encoder"""
+		if self._encoder:
+			shape = self._encoder.get_inputs()[0].shape
+			if isinstance(shape[2], int) and isinstance(shape[3], int):
+				return shape[3], shape[2]
+		return super().inputSize
+
+	@property
+	def supportsBatches(self) -> bool:
+		"""True if the encoder accepts more than one image per run (its batch dimension is dynamic)."""
+		return bool(self._encoder) and not isinstance(self._encoder.get_inputs()[0].shape[0], int)
+
+	@property
+	def supportsFeatures(self) -> bool:
+		return True
+
+	@property
+	def hasIncrementalDecoder(self) -> bool:
+		"""True if the data directory holds a decoder exported as a single step"""
+		return os.path.exists(self.stepDecoderPath) and os.path.exists(self.embeddingsPath)
+
+	def _checkFiles(self):
+		"""Checks if all the required files are present. Raises a L{FileNotFoundError} if any file is
+		missing"""
+		decoderPath = self.stepDecoderPath if self.hasIncrementalDecoder else self.decoderPath
+		notFound = [
+			f'imageCaptioning: Model file not found at {path}'
+			for path in (self.encoderPath, decoderPath, self.vocabPath)
+			if not os.path.exists(path)
+		]
+		if notFound:
+			raise FileNotFoundError("\n".join(notFound))
+
+	def _createSessionOptions(self) -> "onnxruntime.SessionOptions":
+		options = onnxruntime.SessionOptions()
+		options.intra_op_num_threads = self.intraOpThreads
+		options.inter_op_num_threads = self.interOpThreads
+		level = _optimizationLevels[max(0, min(self.optimizationLevel, len(_optimizationLevels) - 1))]
+		options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, level)
+		if self.parallelExecution:
+			options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+		else:
+			options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+		return options
+
+	def initialize(self):
+		"""Creates the encoder and decoder sessions and reads the vocabulary. Does nothing if already
+		initialized. Raises a L{FileNotFoundError} if any required file is missing."""
+		with self._lock:
+			if self.isInitialized:
+				return
+			self._checkFiles()
+			_importOnnxRuntime()
+			options = self._createSessionOptions()
+			providers = ["CPUExecutionProvider"]
+			self._vocabulary = getVocabulary(self.vocabPath)
+			if self.hasIncrementalDecoder:
+				stepSession = onnxruntime.InferenceSession(self.stepDecoderPath, options, providers=providers)
+				embeddings = numpy.load(self.embeddingsPath, mmap_mode="r")
+				self._stepDecoder = OnnxStepDecoder(stepSession, embeddings)
+				self._stepDecoder.startId = self._vocabulary.startId
+				self._stepDecoder.endId = self._vocabulary.endId
+			else:
+				self._decoder = onnxruntime.InferenceSession(self.decoderPath, options, providers=providers)
+			self._encoder = onnxruntime.InferenceSession(self.encoderPath, options, providers=providers)
+
+	def terminate(self):
+		"""Releases the sessions."""
+		with self._lock:
+			self._encoder = None
+			self._decoder = None
+			self._stepDecoder = None
+			# the vocabulary itself is shared, see L{_vocabulary.getVocabulary}
+			self._vocabulary = None
+
+	def _encode(self, tensor) -> "numpy.ndarray":
+		"""Runs the encoder on a batch of preprocessed images.
+		@return: feature vectors, one per image
+		"""
+		inputName = self._encoder.get_inputs()[0].name
+		return self._encoder.run(None, {inputName: tensor})[0]
+
+	def _decode(self, features, onWords: Optional[WordsCallback] = None) -> List[str]:
+		"""Runs the decoder on the feature vector of one image.
+		@param features: feature vector of shape (1, featureSize)
+		@param onWords: see L{getCaptionFromTensor}, only called by the incremental decoder
+		@return: the words of the caption
+		"""
+		if self._stepDecoder:
+			return self._decodeIncrementally(features, onWords)[0]
+		inputName = self._decoder.get_inputs()[0].name
+		sampleIds = self._decoder.run(None, {inputName: features})[0]
+		return self._vocabulary.detokenize(sampleIds.reshape(-1))
+
+	def _decodeIncrementally(
+			self,
+			features,
+			onWords: Optional[WordsCallback] = None,
+			beamWidth: Optional[int] = None,
+			maxLength: int = MAX_LENGTH,
+			count: int = 1,
+	) -> List[List[str]]:
+		"""Decodes the feature vector of one image with the step decoder.
+		@param beamWidth: number of hypotheses kept by beam search, None for L{beamWidth}. Beam search keeps at
+		least I{count} hypotheses.
+		@return: the words of the most likely captions, best first, at most I{count} of them
+		"""
+		beamWidth = max(beamWidth or self.beamWidth, count)
+		onWordIds = None
+		if onWords:
+			def onWordIds(wordIds):
+				words = self._vocabulary.detokenize(wordIds)
+				if words:
+					onWords(words)
+		if beamWidth > 1:
+			decodings = beamSearch(
+				self._stepDecoder, features, beamWidth, maxLength, self.lengthPenaltyAlpha, onWords=onWordIds
+			)[:count]
+		else:
+			decodings = [greedyDecode(self._stepDecoder, features, maxLength, onWords=onWordIds)]
+		self.lastDecoding = decodings[0]
+		return [self._vocabulary.detokenize(decoding.wordIds) for decoding in decodings]
+
+	def getCaptionFromTensor(self, tensor, onWords=None) -> str:
+		with self._lock:
+			self.initialize()
+			with _instrumentation.stage("encoder"):
+				features = self._encode(tensor)
+			with _instrumentation.stage("decoder"):
+				words = self._decode(features, onWords)
+			with _instrumentation.stage("postprocessing"):
+				return self._captionFromWords(words)
+
+	def encode(self, tensor):
+		with self._lock:
+			self.initialize()
+			with _instrumentation.stage("encoder"):
+				return self._encode(tensor)
+
+	def decodeCaptions(self, features, beamWidth=None, maxLength=None, count=1, onWords=None) -> List[str]:
+		with self._lock:
+			self.initialize()
+			with _instrumentation.stage("decoder"):
+				if self._stepDecoder:
+					captions = self._decodeIncrementally(
+						features, onWords, beamWidth, maxLength or MAX_LENGTH, count
+					)
+				else:
+					# the whole caption is generated by a single run, there are no alternatives to choose from
+					captions = [self._decode(features)]
+			with _instrumentation.stage("postprocessing"):
+				return [self._captionFromWords(words) for words in captions]
+
+	def getCaptionFromPixels(self, pixels, width, height, stride=None, onWords=None) -> str:
+		with self._lock:
+			self.initialize()
+			tensor = _preprocess.preprocessPixels(pixels, width, height, stride, self.inputSize)
+			return self.getCaptionFromTensor(tensor, onWords)
+
+	def getCaptionsFromPixels(self, images: Iterable[Tuple]) -> Iterator[str]:
+		"""Performs image captioning on several pixel buffers. If the encoder has a dynamic batch dimension, all
+		images are encoded in a single run, then decoded one at a time so that each caption is yielded as soon
+		as it is generated.
+		"""
+		with self._lock:
+			self.initialize()
+			if not self.supportsBatches:
+				yield from super().getCaptionsFromPixels(images)
+				return
+			inputSize = self.inputSize
+			tensors = [
+				_preprocess.preprocessPixels(pixels, width, height, None, inputSize)
+				for pixels, width, height in images
+			]
+			if not tensors:
+				return
+			with _instrumentation.stage("encoder"):
+				features = self._encode(numpy.concatenate(tensors))
+			for index in range(len(tensors)):
+				with _instrumentation.stage("decoder"):
+					words = self._decode(features[index:index + 1])
+				yield self._captionFromWords(words)
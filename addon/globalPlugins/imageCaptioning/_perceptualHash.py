@@ -0,0 +1,218 @@
+# Image Captioning perceptual hashing and near-duplicate lookup
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+#: Number of columns and rows of the downscaled image compared by L{dHash}. Produces 64 bit hashes.
+_hashSize = 8
+#: Mask of the difference hash bits of a perceptual hash, the higher bits describe the whole image
+_differenceMask = (1 << (_hashSize * _hashSize)) - 1
+#: Images whose cells differ by less than this many levels of brightness are too uniform to be matched
+_minContrast = 3
+#: Images with fewer than this many set or cleared bits in their difference hash, such as gradients, are too
+#: plain to be matched
+_minDetailBits = 4
+#: Similar images must not differ by more than this many levels of mean brightness (out of 255)
+_maxBrightnessDifference = 16
+#: Similar images must not differ by more than this many steps of aspect ratio, see L{_aspectCode}
+_maxAspectDifference = 1
+
+
+def _aspectCode(width: int, height: int) -> int:
+	"""@return: the aspect ratio of an image quantized on a logarithmic scale to one of 255 codes, each step
+	is a change of about 4%"""
+	code = round(math.log2(width / height) * 16)
+	return max(-127, min(127, code)) + 128
+
+
+def dHash(pixels, width: int, height: int) -> Optional[int]:
+	"""Calculates the perceptual hash of a captured image. The image is downscaled to a 9x8 grayscale
+	image by averaging all the pixels of each cell, and each of the 64 low bits of the hash (the difference
+	hash) records whether a cell is brighter than its right neighbour. Small changes such as a blinking caret
+	or anti-aliasing only flip a few bits, so visually identical images have hashes with a small
+	L{hammingDistance}. The mean brightness and the aspect ratio of the image are stored above the difference
+	hash so that L{isCompatible} can tell apart images whose difference hashes match by chance.
+	@param pixels: ctypes array or other object exporting the buffer interface holding 32 bit BGRA pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@return: the hash, None if the image is too small or too plain (solid colors, gradients) for similar
+	images to be told apart reliably
+	"""
+	columns = _hashSize + 1
+	rows = _hashSize
+	if width < columns or height < rows:
+		return None
+	data = memoryview(pixels).cast("B")
+	rowSize = width * 4
+	xEdges = [round(column * width / columns) * 4 for column in range(columns + 1)]
+	yEdges = [round(row * height / rows) for row in range(rows + 1)]
+	gray = []
+	for row in range(rows):
+		# sums of the blue, green and red channels of each cell of this row of cells
+		sums = [[0, 0, 0] for _column in range(columns)]
+		for y in range(yEdges[row], yEdges[row + 1]):
+			rowStart = y * rowSize
+			for column in range(columns):
+				start = rowStart + xEdges[column]
+				end = rowStart + xEdges[column + 1]
+				cellSums = sums[column]
+				cellSums[0] += sum(data[start:end:4])
+				cellSums[1] += sum(data[start + 1:end:4])
+				cellSums[2] += sum(data[start + 2:end:4])
+		rowHeight = yEdges[row + 1] - yEdges[row]
+		for column in range(columns):
+			count = (xEdges[column + 1] - xEdges[column]) // 4 * rowHeight
+			blue, green, red = sums[column]
+			# ITU-R 601 luma, pixels are stored in BGRA order
+			gray.append((blue * 0.114 + green * 0.587 + red * 0.299) / count)
+	if max(gray) - min(gray) < _minContrast:
+		return None
+	differenceHash = 0
+	for row in range(rows):
+		for column in range(_hashSize):
+			index = row * columns + column
+			differenceHash = (differenceHash << 1) | (gray[index] > gray[index + 1])
+	setBits = bin(differenceHash).count("1")
+	if setBits < _minDetailBits or setBits > _hashSize * _hashSize - _minDetailBits:
+		return None
+	brightness = min(255, round(sum(gray) / len(gray)))
+	return (_aspectCode(width, height) << 72) | (brightness << 64) | differenceHash
+
+
+def isCompatible(first: int, second: int) -> bool:
+	"""@return: True if two perceptual hashes are of images with about the same mean brightness and aspect
+	ratio, which is required for them to be similar whatever the distance of their difference hashes"""
+	brightnessDifference = abs((first >> 64 & 0xFF) - (second >> 64 & 0xFF))
+	aspectDifference = abs((first >> 72 & 0xFF) - (second >> 72 & 0xFF))
+	return brightnessDifference <= _maxBrightnessDifference and aspectDifference <= _maxAspectDifference
+
+
+def hammingDistance(first: int, second: int) -> int:
+	"""@return: number of bits that differ between the difference hashes of two perceptual hashes"""
+	return bin((first ^ second) & _differenceMask).count("1")
+
+
+class BKTree():
+	"""Burkhard-Keller tree of hashes under the Hamming distance. Finding all hashes within a small distance
+	of a hash only visits a small part of the tree, so lookups stay fast as the number of hashes grows.
+	Several values may share the same hash.
+	"""
+	def __init__(self):
+		# Nodes are lists of [hash, values, children] where children maps distance to child node
+		self._root = None
+		self._size = 0
+
+	def __len__(self) -> int:
+		"""@return: number of values in the tree"""
+		return self._size
+
+	def add(self, hashValue: int, value: Any):
+		"""Adds a value with the given hash to the tree."""
+		self._size += 1
+		if self._root is None:
+			self._root = [hashValue, {value}, {}]
+			return
+		node = self._root
+		while True:
+			distance = hammingDistance(hashValue, node[0])
+			if distance == 0:
+				node[1].add(value)
+				return
+			child = node[2].get(distance)
+			if child is None:
+				node[2][distance] = [hashValue, {value}, {}]
+				return
+			node = child
+
+	def remove(self, hashValue: int, value: Any):
+		"""Removes a value from the tree. The node holding the hash is kept even if it no longer holds any
+		value since removing it would require rebuilding its subtree."""
+		node = self._root
+		while node is not None:
+			distance = hammingDistance(hashValue, node[0])
+			if distance == 0:
+				if value in node[1]:
+					node[1].discard(value)
+					self._size -= 1
+				return
+			node = node[2].get(distance)
+
+	def search(self, hashValue: int, maxDistance: int) -> List[Tuple[int, Any]]:
+		"""Finds all values whose hash is within I{maxDistance} of the given hash.
+		@return: list of (distance, value) tuples sorted by distance
+		"""
+		results = []
+		if self._root is None:
+			return results
+		candidates = [self._root]
+		while candidates:
+			node = candidates.pop()
+			distance = hammingDistance(hashValue, node[0])
+			if distance <= maxDistance:
+				results.extend((distance, value) for value in node[1])
+			# By the triangle inequality, matches can only be in children whose distance to this node is
+			# within maxDistance of the distance between this node and the searched hash.
+			for childDistance, child in node[2].items():
+				if distance - maxDistance <= childDistance <= distance + maxDistance:
+					candidates.append(child)
+		results.sort(key=lambda result: result[0])
+		return results
+
+
+class PerceptualIndex():
+	"""Maps image hashes to perceptual hashes and finds the image hash of the most similar image."""
+	def __init__(self):
+		self._tree = BKTree()
+		self._hashes: Dict[str, int] = {}
+		# Number of emptied tree nodes, the tree is rebuilt once there are as many as live values
+		self._removed = 0
+
+	def __len__(self) -> int:
+		return len(self._hashes)
+
+	def getHash(self, key: str) -> Optional[int]:
+		"""@return: the perceptual hash of the image with the given image hash, if indexed"""
+		return self._hashes.get(key)
+
+	def add(self, key: str, perceptualHash: int):
+		"""Indexes an image.
+		@param key: image hash
+		@param perceptualHash: perceptual hash of the image
+		"""
+		self.remove(key)
+		self._hashes[key] = perceptualHash
+		self._tree.add(perceptualHash, key)
+
+	def remove(self, key: str):
+		"""Removes an image from the index, if indexed."""
+		perceptualHash = self._hashes.pop(key, None)
+		if perceptualHash is None:
+			return
+		self._tree.remove(perceptualHash, key)
+		self._removed += 1
+		if self._removed > len(self._hashes):
+			self._rebuild()
+
+	def clear(self):
+		self._tree = BKTree()
+		self._hashes.clear()
+		self._removed = 0
+
+	def _rebuild(self):
+		self._tree = BKTree()
+		for key, perceptualHash in self._hashes.items():
+			self._tree.add(perceptualHash, key)
+		self._removed = 0
+
+	def findSimilar(self, perceptualHash: int, maxDistance: int) -> Optional[str]:
+		"""Finds the indexed image most similar to an image.
+		@param perceptualHash: perceptual hash of the image
+		@param maxDistance: maximum number of differing bits of similar images
+		@return: image hash of the most similar image of about the same brightness and aspect ratio, None if no
+		image is similar enough
+		"""
+		for _distance, key in self._tree.search(perceptualHash, maxDistance):
+			if isCompatible(perceptualHash, self._hashes[key]):
+				return key
+		return None
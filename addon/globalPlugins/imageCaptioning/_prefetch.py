@@ -0,0 +1,159 @@
+# Image Captioning background captioning of the images in browse mode documents
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import time
+import weakref
+from concurrent.futures import CancelledError
+from typing import List
+
+import wx
+import core
+from logHandler import log
+from browseMode import BrowseModeTreeInterceptor
+
+from visionEnhancementProviders.imageCaptioning import ImageCaptioning
+from ._capture import captureImage, getViewport
+from ._doImageCaptioning import DoImageCaptioning, isLargeEnough
+from ._idle import IDLE_DELAY, secondsSinceLastInput
+from ._imageHash import hashPixels
+from ._objectIdentity import IDENTITY_MAX_AGE, getImageIdentity
+from ._resultUI import findCachedResult, findVisibleGraphics, cacheResult, getCaptionCache
+from ._scheduler import PRIORITY_BACKGROUND
+
+#: Seconds after which the next image is prefetched even if the result of the previous one was not delivered,
+#: longer than a recognition can take (see L{_remoteBackend._requestTimeout})
+_resultTimeout = 180
+
+
+class Prefetcher():
+	"""Captions the visible images of browse mode documents in the background so that a later request for
+	their caption is a cache hit. Images are captured on the main thread one at a time, only while the user
+	is idle, and captioned at background priority so that requests of the user always come first.
+	"""
+	def __init__(self):
+		# Documents that were already prefetched
+		self._documents = weakref.WeakSet()
+		# Graphic objects still to be prefetched for the current document
+		self._pending: List = []
+		# Screen rectangle of the current document
+		self._viewport = None
+		self._timer = None
+		# Incremented whenever the pending images are replaced, so that images dropped by the scheduler are
+		# only queued again if they still belong to the current document
+		self._generation = 0
+
+	def onDocumentFocused(self, treeInterceptor):
+		"""Starts prefetching the visible images of a browse mode document, unless prefetching is disabled or
+		the document was already prefetched.
+		@param treeInterceptor: the document
+		"""
+		settings = ImageCaptioning.getSettings()
+		if (
+			not settings.prefetchImages
+			or not isinstance(treeInterceptor, BrowseModeTreeInterceptor)
+			or not treeInterceptor.isReady
+			or treeInterceptor in self._documents
+		):
+			return
+		self._documents.add(treeInterceptor)
+		self._generation += 1
+		try:
+			self._pending = list(findVisibleGraphics(treeInterceptor, settings.prefetchMaxImages))
+			self._viewport = getViewport(treeInterceptor)
+		except Exception:
+			log.debugWarning("(imageCaptioning) Could not find the images of the document", exc_info=True)
+			return
+		log.debug(f"(imageCaptioning) Prefetching captions of {len(self._pending)} images")
+		self._schedule(IDLE_DELAY)
+
+	def cancel(self):
+		"""Stops prefetching. Images already handed to the model are still cached."""
+		self._pending = []
+		self._generation += 1
+		if self._timer:
+			self._timer.Stop()
+			self._timer = None
+
+	def _schedule(self, delay: float):
+		if self._timer:
+			self._timer.Stop()
+		self._timer = core.callLater(int(delay * 1000), self._step)
+
+	def _step(self):
+		"""Captures the next pending image and submits it for captioning. Runs on the main thread."""
+		self._timer = None
+		if not self._pending:
+			return
+		idleTime = secondsSinceLastInput()
+		if idleTime < IDLE_DELAY:
+			# the user is interacting, try again once they have been idle for long enough
+			self._schedule(IDLE_DELAY - idleTime)
+			return
+		obj = self._pending.pop(0)
+		try:
+			recognizer, imageHash, pixels, imgInfo = self._capture(obj)
+		except Exception:
+			log.debugWarning("(imageCaptioning) Could not capture image for prefetching", exc_info=True)
+			self._schedule(0)
+			return
+		if recognizer is None:
+			self._schedule(0)
+			return
+		generation = self._generation
+		onResult = lambda result: self._onResult(recognizer, obj, generation, result)
+		# moves on even if the result is never delivered, the next result replaces this timer
+		self._schedule(_resultTimeout)
+		recognizer.recognize(
+			imageHash, pixels, imgInfo, onResult, onDiscardedResult=onResult, priority=PRIORITY_BACKGROUND
+		)
+
+	def _capture(self, obj):
+		"""Captures a graphic object, unless it is no longer large enough or its caption is already cached. The
+		cache is looked up by object identity first so that known objects are not captured at all.
+		@return: recognizer, image hash, pixels and image info, or a tuple of None values
+		"""
+		recognizer = DoImageCaptioning(None, time.time())
+		location = obj.location
+		if not location or not isLargeEnough(location):
+			return None, None, None, None
+		cache = getCaptionCache()
+		recognizer.identity = getImageIdentity(obj, location.width, location.height)
+		if recognizer.identity and cache.getByIdentity(recognizer.identity, IDENTITY_MAX_AGE):
+			return None, None, None, None
+		capture = captureImage(recognizer, location, self._viewport, recognizer.captureAtModelSize)
+		if capture is None:
+			return None, None, None, None
+		imgInfo, pixels = capture
+		imageHash = hashPixels(pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+		cachedResult = findCachedResult(imageHash, pixels, imgInfo)
+		if cachedResult.caption is not None:
+			if recognizer.identity:
+				cache.putIdentity(recognizer.identity, imageHash)
+			return None, None, None, None
+		recognizer.perceptualHash = cachedResult.perceptualHash
+		return recognizer, imageHash, pixels, imgInfo
+
+	def _onResult(self, recognizer: DoImageCaptioning, obj, generation: int, result):
+		"""Caches the result and schedules the next image so that prefetching uses at most the configured share
+		of the time the model runs. Runs on the recognition worker thread, or on the main thread if the
+		recognition was dropped by the scheduler.
+		@param obj: the prefetched graphic object
+		@param generation: value of L{_generation} when the object was prefetched
+		"""
+		if isinstance(result, CancelledError):
+			# the recognition queue is full of more urgent recognitions, or the recognition was superseded
+			log.debug("(imageCaptioning) Prefetch recognition dropped by the scheduler, retrying later")
+			wx.CallAfter(self._retry, obj, generation)
+			return
+		cacheResult(result)
+		duration = recognizer.runTime or 0
+		cpuShare = ImageCaptioning.getSettings().prefetchCpuShare / 100
+		wx.CallAfter(self._schedule, duration * (1 - cpuShare) / cpuShare)
+
+	def _retry(self, obj, generation: int):
+		"""Queues an image dropped by the scheduler again, unless prefetching was cancelled or moved on to
+		another document since."""
+		if generation != self._generation:
+			return
+		self._pending.insert(0, obj)
+		self._schedule(IDLE_DELAY)
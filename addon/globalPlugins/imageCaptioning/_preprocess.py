@@ -0,0 +1,96 @@
+# Image Captioning image preprocessing
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import importlib
+import importlib.util
+from functools import lru_cache
+from typing import Optional, Tuple
+
+#: The numpy module. Importing it takes longer than loading the rest of the add-on and the DLL backend does
+#: not need it, so it is only imported by the first preprocessing, see L{_importNumpy}.
+numpy = None
+
+#: (width, height) of the images expected by the encoder
+INPUT_SIZE = (224, 224)
+#: Per channel (RGB) mean and standard deviation used to normalise the images the encoder was trained on
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def _importNumpy():
+	global numpy
+	if numpy is None:
+		numpy = importlib.import_module("numpy")
+
+
+def isAvailable() -> bool:
+	"""@return: True if NumPy, which is required by L{preprocessPixels}, is installed"""
+	return numpy is not None or importlib.util.find_spec("numpy") is not None
+
+
+@lru_cache(maxsize=32)
+def _areaWeights(sourceSize: int, targetSize: int) -> "numpy.ndarray":
+	"""Calculates the matrix that resizes one axis of an image by area averaging. Each target pixel is the
+	average of the source pixels it covers, weighted by how much of each source pixel it covers.
+	The matrices only depend on the image size so they are cached.
+	@return: float32 matrix of shape (targetSize, sourceSize) whose rows sum to 1
+	"""
+	scale = sourceSize / targetSize
+	starts = numpy.arange(targetSize) * scale
+	ends = starts + scale
+	edges = numpy.arange(sourceSize + 1)
+	# overlap between target pixel i, covering [starts[i], ends[i]), and source pixel j, covering [j, j + 1)
+	overlap = (
+		numpy.minimum(ends[:, None], edges[None, 1:]) - numpy.maximum(starts[:, None], edges[None, :-1])
+	)
+	weights = numpy.clip(overlap, 0, None) / scale
+	return weights.astype(numpy.float32)
+
+
+def pixelsToArray(pixels, width: int, height: int, stride: Optional[int] = None) -> "numpy.ndarray":
+	"""Wraps a 32 bit BGRA pixel buffer in a NumPy array without copying it.
+	@param pixels: ctypes array or other object exporting the buffer interface holding the pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@param stride: number of bytes per row, defaults to M{4 * width}
+	@return: uint8 array of shape (height, width, 4)
+	"""
+	_importNumpy()
+	if stride is None:
+		stride = width * 4
+	data = numpy.frombuffer(memoryview(pixels).cast("B"), dtype=numpy.uint8)
+	return numpy.lib.stride_tricks.as_strided(
+		data, shape=(height, width, 4), strides=(stride, 4, 1), writeable=False
+	)
+
+
+def preprocessPixels(
+		pixels,
+		width: int,
+		height: int,
+		stride: Optional[int] = None,
+		inputSize: Tuple[int, int] = INPUT_SIZE,
+) -> "numpy.ndarray":
+	"""Converts a captured image to the input tensor of the encoder: the image is resized to the input size of
+	the encoder by area averaging, converted from BGRA to RGB, scaled to [0, 1] and normalised with L{MEAN}
+	and L{STD}. Resizing is done as two matrix products per channel, so the captured pixels are read once and
+	never copied into an intermediate image.
+	@param pixels: ctypes array or other object exporting the buffer interface holding 32 bit BGRA pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@param stride: number of bytes per row, defaults to M{4 * width}
+	@param inputSize: (width, height) of the encoder input
+	@return: float32 tensor of shape (1, 3, height, width) in NCHW layout
+	"""
+	targetWidth, targetHeight = inputSize
+	image = pixelsToArray(pixels, width, height, stride)
+	rowWeights = _areaWeights(height, targetHeight)
+	columnWeights = _areaWeights(width, targetWidth)
+	tensor = numpy.empty((1, 3, targetHeight, targetWidth), dtype=numpy.float32)
+	# BGRA to RGB, the alpha channel is ignored
+	for outChannel, inChannel in enumerate((2, 1, 0)):
+		channel = image[:, :, inChannel]
+		# resize the rows first, this shrinks the data the most for landscape screenshots
+		resized = rowWeights @ channel @ columnWeights.T
+		tensor[0, outChannel] = (resized / 255 - MEAN[outChannel]) / STD[outChannel]
+	return tensor
@@ -0,0 +1,342 @@
+# Image Captioning out of process captioning backend
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import itertools
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+	from logHandler import log
+except ImportError:
+	# running outside of NVDA, for example in the benchmarks
+	import logging
+	log = logging.getLogger(__name__)
+
+from . import _instrumentation
+from ._captioningBackend import CaptioningBackend
+from ._frameRing import FrameRing
+
+#: Script run by the inference process
+SERVER_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "_inferenceServer.py")
+#: Environment variable holding the path of the Python interpreter running the inference process
+INTERPRETER_VARIABLE = "NVDA_IMAGECAPTIONING_PYTHON"
+
+#: Number of images that can be on their way to the inference process at once
+_ringSlots = 4
+#: Initial size of a ring slot, enough for a 1920x1080 capture. Grown when a larger image is captioned.
+_initialSlotSize = 1920 * 1080 * 4
+#: Seconds to wait for the inference process to load the model
+_startTimeout = 300
+#: Seconds to wait for a caption before the inference process is considered hung
+_requestTimeout = 120
+#: Seconds to wait for the answer to a health check
+_pingTimeout = 5
+#: The inference process is checked before a request if it has been idle for this many seconds
+_healthCheckInterval = 30
+#: The inference process is restarted at most this many times within L{_restartWindow} seconds
+_maxRestarts = 3
+_restartWindow = 300
+
+
+def findInterpreter() -> Optional[str]:
+	"""Finds the Python interpreter running the inference process: the one named by the
+	L{INTERPRETER_VARIABLE} environment variable, the interpreter running this process unless it is NVDA
+	itself, or the first Python interpreter on the path. Its architecture must match the DLLs of the backend.
+	@return: path of the interpreter, None if none was found
+	"""
+	path = os.environ.get(INTERPRETER_VARIABLE)
+	if path:
+		return path if os.path.isfile(path) else None
+	if os.path.basename(sys.executable).lower().startswith("python"):
+		return sys.executable
+	for name in ("pythonw", "python", "python3"):
+		path = shutil.which(name)
+		# the python.exe of WindowsApps is an alias opening the Microsoft Store when Python is not installed
+		if path and "windowsapps" not in os.path.normpath(path).lower().split(os.sep):
+			return path
+	return None
+
+
+class InferenceProcessError(RuntimeError):
+	"""Raised when the inference process exits, hangs or fails to start."""
+
+
+class RemoteCaptioning(CaptioningBackend):
+	"""Runs another backend in a separate Python process (see L{_inferenceServer}), so that the model never
+	holds NVDA's interpreter lock and a crash of the model does not take NVDA down.
+	The process is started by L{initialize}, checked with a ping before a request if it has been idle and
+	restarted if it exited or stopped answering. Images are handed over through a L{FrameRing}, so the pipe
+	only carries small JSON messages.
+	"""
+	name = "remote"
+
+	def __init__(self, backend: str, options: Optional[dict] = None, interpreter: Optional[str] = None):
+		"""
+		@param backend: name of the backend run by the inference process
+		@param options: keyword arguments of the backend's constructor, must be serializable as JSON
+		@param interpreter: path of the Python interpreter, see L{findInterpreter}
+		"""
+		super().__init__((options or {}).get("modelVariant", "fp32"))
+		self.backend = backend
+		self.options = dict(options or {})
+		self.interpreter = interpreter or findInterpreter()
+		self._process: Optional[subprocess.Popen] = None
+		self._ring: Optional[FrameRing] = None
+		self._requestIds = itertools.count()
+		# Responses by request id, filled by the reader thread
+		self._responses: Dict[int, queue.Queue] = {}
+		self._responsesLock = threading.Lock()
+		self._lastResponseTime = 0.0
+		# Set once the process was started, later starts count as restarts
+		self._started = False
+		self._restartTimes = []
+		self._inputSize = None
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		return findInterpreter() is not None
+
+	@property
+	def isInitialized(self) -> bool:
+		return self._process is not None and self._process.poll() is None
+
+	@property
+	def inputSize(self) -> Tuple[int, int]:
+		return self._inputSize or super().inputSize
+
+	@property
+	def supportsPixelInput(self) -> bool:
+		# the image is preprocessed by the inference process
+		return True
+
+	@property
+	def supportsBatches(self) -> bool:
+		# several images are queued in the ring while the previous ones are captioned
+		return True
+
+	@property
+	def pid(self) -> Optional[int]:
+		"""Process id of the inference process, if it is running"""
+		return self._process.pid if self.isInitialized else None
+
+	def initialize(self):
+		"""Starts the inference process and waits for it to load the model. Does nothing if it is running.
+		Raises an L{InferenceProcessError} if it could not be started."""
+		with self._lock:
+			if self.isInitialized:
+				return
+			if self._started:
+				self._restart("exited")
+			else:
+				self._start()
+
+	def terminate(self):
+		"""Asks the inference process to exit, killing it if it does not. A later L{initialize} starts a new
+		process, which is not counted as a restart."""
+		with self._lock:
+			self._stop()
+			self._started = False
+
+	def _start(self):
+		if not self.interpreter:
+			raise InferenceProcessError("imageCaptioning: No Python interpreter found for the inference process")
+		self._started = True
+		startTime = time.perf_counter()
+		creationFlags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+		self._process = subprocess.Popen(
+			[self.interpreter, SERVER_PATH],
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL,
+			creationflags=creationFlags,
+		)
+		# each process has its own responses so that a late reader of an old process cannot disturb requests
+		self._responses = {}
+		reader = threading.Thread(
+			target=self._readResponses,
+			args=(self._process, self._responses),
+			name="imageCaptioning inference process reader",
+		)
+		reader.daemon = True
+		reader.start()
+		try:
+			self._ring = FrameRing.create(_ringSlots, _initialSlotSize)
+			self._request({"op": "map", "ring": self._ring.describe()}, _pingTimeout)
+			ready = self._request({"op": "init", "backend": self.backend, "options": self.options}, _startTimeout)
+		except Exception:
+			self._stop()
+			raise
+		if not ready["pixelInput"]:
+			self._stop()
+			raise InferenceProcessError(
+				"imageCaptioning: The backend of the inference process cannot caption pixel buffers"
+			)
+		self.modelVariant = ready["modelVariant"]
+		self._inputSize = tuple(ready["inputSize"])
+		log.debug(
+			f"(imageCaptioning) Inference process {ready['pid']} started in "
+			f"{(time.perf_counter() - startTime) * 1000:.0f} ms"
+		)
+
+	def _stop(self):
+		process, self._process = self._process, None
+		if process:
+			try:
+				process.stdin.write(b'{"op": "quit"}\n')
+				process.stdin.close()
+				process.wait(_pingTimeout)
+			except (OSError, subprocess.TimeoutExpired):
+				process.kill()
+		if self._ring:
+			self._ring.close()
+			self._ring = None
+
+	def _restart(self, reason: str):
+		"""Restarts the inference process, unless it was restarted too often recently."""
+		now = time.monotonic()
+		self._restartTimes = [
+			restartTime for restartTime in self._restartTimes if now - restartTime < _restartWindow
+		]
+		self._stop()
+		if len(self._restartTimes) >= _maxRestarts:
+			raise InferenceProcessError(f"imageCaptioning: Inference process {reason}, giving up restarting it")
+		self._restartTimes.append(now)
+		log.warning(f"imageCaptioning: Inference process {reason}, restarting it")
+		self._start()
+
+	def _ensureHealthy(self):
+		"""Checks the inference process is running and, if it has been idle, that it still answers. Restarts
+		it otherwise."""
+		if not self.isInitialized:
+			self.initialize()
+			return
+		if time.monotonic() - self._lastResponseTime < _healthCheckInterval:
+			return
+		try:
+			self._request({"op": "ping"}, _pingTimeout)
+		except InferenceProcessError:
+			self._restart("stopped answering")
+
+	def _readResponses(self, process: subprocess.Popen, responsesById: Dict[int, queue.Queue]):
+		"""Reader thread loop dispatching the responses of the inference process to the waiting requests."""
+		for line in process.stdout:
+			try:
+				response = json.loads(line)
+			except ValueError:
+				continue
+			with self._responsesLock:
+				responses = responsesById.get(response.get("id"))
+			if responses:
+				responses.put(response)
+		# the process exited, wake up every waiting request
+		with self._responsesLock:
+			for responses in responsesById.values():
+				responses.put(None)
+
+	def _send(self, message: dict) -> int:
+		"""Sends a request.
+		@return: id of the request, to be passed to L{_receive}
+		"""
+		requestId = next(self._requestIds)
+		with self._responsesLock:
+			self._responses[requestId] = queue.Queue()
+		message["id"] = requestId
+		try:
+			self._process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+			self._process.stdin.flush()
+		except (AttributeError, OSError):
+			with self._responsesLock:
+				del self._responses[requestId]
+			raise InferenceProcessError("imageCaptioning: Inference process exited")
+		return requestId
+
+	def _receive(self, requestId: int, timeout: float, onWords=None) -> dict:
+		"""Waits for the response to a request, passing the words of a caption to I{onWords} as they arrive.
+		Raises an L{InferenceProcessError} if the process exits or does not answer in time, and a
+		L{RuntimeError} if the request failed.
+		"""
+		responses = self._responses[requestId]
+		try:
+			deadline = time.monotonic() + timeout
+			while True:
+				try:
+					response = responses.get(timeout=max(0, deadline - time.monotonic()))
+				except queue.Empty:
+					raise InferenceProcessError("imageCaptioning: Inference process did not answer in time")
+				if response is None:
+					raise InferenceProcessError("imageCaptioning: Inference process exited")
+				self._lastResponseTime = time.monotonic()
+				if "words" in response:
+					if onWords:
+						onWords(response["words"])
+					continue
+				if "error" in response:
+					raise RuntimeError(f"imageCaptioning: Inference process error: {response['error']}")
+				return response
+		finally:
+			with self._responsesLock:
+				self._responses.pop(requestId, None)
+
+	def _request(self, message: dict, timeout: float) -> dict:
+		return self._receive(self._send(message), timeout)
+
+	def _ensureSlotSize(self, size: int):
+		"""Replaces the ring with a larger one if its slots cannot hold an image of the given size. Must only be
+		called while no caption request is in flight, otherwise the answer to the map request would wait behind
+		those captions.
+		@param size: size of the image in bytes
+		"""
+		if size <= self._ring.slotSize:
+			return
+		self._ring.close()
+		self._ring = FrameRing.create(_ringSlots, size)
+		self._request({"op": "map", "ring": self._ring.describe()}, _pingTimeout)
+
+	def _sendImage(self, slot: int, pixels, width: int, height: int, stride: Optional[int]) -> int:
+		"""Copies an image into a ring slot and requests its caption.
+		@return: id of the request
+		"""
+		if stride not in (None, width * 4):
+			raise ValueError("imageCaptioning: Padded rows are not supported by the inference process")
+		self._ensureSlotSize(width * height * 4)
+		with _instrumentation.stage("handoff"):
+			self._ring.write(slot, pixels)
+		return self._send({"op": "caption", "slot": slot, "width": width, "height": height})
+
+	def _receiveCaption(self, requestId: int, onWords=None) -> str:
+		try:
+			return self._receive(requestId, _requestTimeout, onWords)["caption"]
+		except InferenceProcessError:
+			# kill the process if it hung, the next request restarts it
+			self._stop()
+			raise
+
+	def getCaptionFromPixels(self, pixels, width, height, stride=None, onWords=None) -> str:
+		with self._lock:
+			self._ensureHealthy()
+			with _instrumentation.stage("model"):
+				return self._receiveCaption(self._sendImage(0, pixels, width, height, stride), onWords)
+
+	def getCaptionsFromPixels(self, images: Iterable[Tuple]) -> Iterator[str]:
+		"""Queues up to one image per ring slot so that the inference process never waits for the next image."""
+		images = list(images)
+		with self._lock:
+			self._ensureHealthy()
+			# the ring is sized for the largest image before any image is sent, since it cannot be replaced while
+			# captions are in flight
+			self._ensureSlotSize(max((width * height * 4 for _pixels, width, height in images), default=0))
+			pending = []
+			for index, (pixels, width, height) in enumerate(images):
+				if len(pending) == _ringSlots:
+					# the slot of the oldest request is reused once its caption was received
+					yield self._receiveCaption(pending.pop(0))
+				pending.append(self._sendImage(index % _ringSlots, pixels, width, height, None))
+			while pending:
+				yield self._receiveCaption(pending.pop(0))
@@ -0,0 +1,213 @@
+# Image Captioning memory management of the captioning model
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import ctypes
+import gc
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+try:
+	from logHandler import log
+except ImportError:
+	# running outside of NVDA, for example in the benchmarks
+	import logging
+	log = logging.getLogger(__name__)
+
+#: Seconds between two checks of whether the model should be unloaded
+_checkInterval = 30
+#: The system is under memory pressure if this percentage of its physical memory is in use
+_memoryPressureLoad = 90
+#: The system is also under memory pressure if less than this many bytes of address space are left to the
+#: process, which happens long before physical memory runs out in a 32 bit process such as NVDA
+_minAvailableAddressSpace = 256 * 1024 * 1024
+#: Under memory pressure, the model is only unloaded if it has not been used for this many seconds
+_minIdleUnderPressure = 30
+
+_MB = 1024 * 1024
+
+
+class PROCESS_MEMORY_COUNTERS_EX(ctypes.Structure):
+	_fields_ = [
+		("cb", ctypes.c_ulong),
+		("PageFaultCount", ctypes.c_ulong),
+		("PeakWorkingSetSize", ctypes.c_size_t),
+		("WorkingSetSize", ctypes.c_size_t),
+		("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+		("QuotaPagedPoolUsage", ctypes.c_size_t),
+		("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+		("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+		("PagefileUsage", ctypes.c_size_t),
+		("PeakPagefileUsage", ctypes.c_size_t),
+		("PrivateUsage", ctypes.c_size_t),
+	]
+
+
+class MEMORYSTATUSEX(ctypes.Structure):
+	_fields_ = [
+		("dwLength", ctypes.c_ulong),
+		("dwMemoryLoad", ctypes.c_ulong),
+		("ullTotalPhys", ctypes.c_ulonglong),
+		("ullAvailPhys", ctypes.c_ulonglong),
+		("ullTotalPageFile", ctypes.c_ulonglong),
+		("ullAvailPageFile", ctypes.c_ulonglong),
+		("ullTotalVirtual", ctypes.c_ulonglong),
+		("ullAvailVirtual", ctypes.c_ulonglong),
+		("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+	]
+
+
+def processMemory() -> Optional[int]:
+	"""@return: number of bytes of memory privately committed by this process (resident memory outside of
+	Windows), None if it cannot be measured"""
+	if sys.platform == "win32":
+		counters = PROCESS_MEMORY_COUNTERS_EX()
+		counters.cb = ctypes.sizeof(counters)
+		# -1 is the pseudo handle of the current process
+		if not ctypes.windll.psapi.GetProcessMemoryInfo(
+			ctypes.c_void_p(-1), ctypes.byref(counters), counters.cb
+		):
+			return None
+		return counters.PrivateUsage
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, IndexError, AttributeError):
+		return None
+
+
+def isUnderMemoryPressure() -> bool:
+	"""@return: True if the system is low on physical memory or the process is low on address space"""
+	if sys.platform == "win32":
+		status = MEMORYSTATUSEX()
+		status.dwLength = ctypes.sizeof(status)
+		if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+			return False
+		return (
+			status.dwMemoryLoad >= _memoryPressureLoad
+			or status.ullAvailVirtual < _minAvailableAddressSpace
+		)
+	try:
+		with open("/proc/meminfo") as f:
+			info = dict(line.split(":", 1) for line in f)
+		total = int(info["MemTotal"].split()[0])
+		available = int(info["MemAvailable"].split()[0])
+	except (OSError, ValueError, KeyError):
+		return False
+	return (total - available) * 100 >= _memoryPressureLoad * total
+
+
+def _formatMemory(size: Optional[int]) -> str:
+	return "an unknown amount of memory" if size is None else f"{size / _MB:.1f} MB"
+
+
+class ResourceManager():
+	"""Keeps track of the memory held by the captioning engine and unloads its model once it has not been used
+	for a while, or sooner if the system runs low on memory, so that the model does not sit in NVDA's
+	address space indefinitely. The model is loaded again transparently by the next caption request (see
+	L{load}). A background thread checks every L{_checkInterval} seconds whether the model should be unloaded.
+	"""
+	def __init__(self, idleTimeout: float = 0):
+		"""
+		@param idleTimeout: seconds without caption request after which the model is unloaded, 0 to only
+		unload it under memory pressure
+		"""
+		self.idleTimeout = idleTimeout
+		#: Approximate number of bytes held by the loaded model, None if it is not loaded or unknown
+		self.modelMemory: Optional[int] = None
+		self._engine = None
+		self._lastUsed = time.monotonic()
+		self._thread: Optional[threading.Thread] = None
+		self._stopEvent = threading.Event()
+		self._lock = threading.Lock()
+
+	def load(self, engine):
+		"""Loads the model of an engine if it is not loaded yet, and records that it is being used.
+		@param engine: the L{CaptioningBackend} about to be used
+		@return: the engine
+		"""
+		with self._lock:
+			self._engine = engine
+			self._lastUsed = time.monotonic()
+			self._ensureMonitor()
+		if engine.isInitialized:
+			return engine
+		memoryBefore = processMemory()
+		startTime = time.perf_counter()
+		engine.initialize()
+		loadTime = time.perf_counter() - startTime
+		memoryAfter = processMemory()
+		self.modelMemory = None if None in (memoryBefore, memoryAfter) else max(0, memoryAfter - memoryBefore)
+		log.info(
+			f"imageCaptioning: Captioning model ({engine.name}, {engine.modelVariant}) loaded in "
+			f"{loadTime * 1000:.0f} ms, using {_formatMemory(self.modelMemory)}"
+		)
+		return engine
+
+	def _shouldUnload(self) -> Optional[str]:
+		"""@return: the reason for unloading the model, None if it should stay loaded"""
+		idleTime = time.monotonic() - self._lastUsed
+		if self.idleTimeout and idleTime >= self.idleTimeout:
+			return f"unused for {idleTime:.0f} s"
+		if idleTime >= _minIdleUnderPressure and isUnderMemoryPressure():
+			return "memory pressure"
+		return None
+
+	def unloadIfIdle(self) -> bool:
+		"""Unloads the model if it has been idle for long enough or the system is under memory pressure. The
+		model is never unloaded while a caption is being generated.
+		@return: True if the model was unloaded
+		"""
+		engine = self._engine
+		if engine is None or not engine.isInitialized or not self._shouldUnload():
+			return False
+		# the engine lock is held while a caption is generated, try again on the next check
+		if not engine._lock.acquire(blocking=False):
+			return False
+		try:
+			reason = self._shouldUnload()
+			if not reason or not engine.isInitialized:
+				return False
+			memoryBefore = processMemory()
+			startTime = time.perf_counter()
+			engine.terminate()
+			gc.collect()
+			unloadTime = time.perf_counter() - startTime
+			memoryAfter = processMemory()
+		finally:
+			engine._lock.release()
+		reclaimed = None if None in (memoryBefore, memoryAfter) else max(0, memoryBefore - memoryAfter)
+		self.modelMemory = None
+		log.info(
+			f"imageCaptioning: Captioning model unloaded ({reason}) in {unloadTime * 1000:.0f} ms, "
+			f"reclaimed {_formatMemory(reclaimed)}"
+		)
+		return True
+
+	def _ensureMonitor(self):
+		if self._thread is None or not self._thread.is_alive():
+			# each thread has its own event so that a stopped thread cannot be revived by a later start
+			self._stopEvent = threading.Event()
+			self._thread = threading.Thread(
+				target=self._monitor, args=(self._stopEvent,), name="imageCaptioning resource monitor"
+			)
+			self._thread.daemon = True
+			self._thread.start()
+
+	def _monitor(self, stopEvent: threading.Event):
+		"""Monitor thread loop."""
+		while not stopEvent.wait(_checkInterval):
+			try:
+				self.unloadIfIdle()
+			except Exception:
+				log.error("imageCaptioning: Could not unload the captioning model", exc_info=True)
+
+	def stop(self):
+		"""Stops checking whether the model should be unloaded and forgets the engine."""
+		with self._lock:
+			self._stopEvent.set()
+			self._thread = None
+			self._engine = None
+			self.modelMemory = None
@@ -1,57 +1,209 @@
 # Image Captioning navigator object recognition, recognition tracking, result presentation and result caching
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
+import os
 import api
 import ui
-import screenBitmap
+import globalVars
 from logHandler import log
-from typing import Optional
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 import queueHandler
+import time
+from controlTypes import ROLE_GRAPHIC
 from contentRecog import ContentRecognizer, RecogImageInfo, SimpleTextResult
 from contentRecog.recogUi import RecogResultNVDAObject
-from collections import deque, namedtuple
-import time
+from browseMode import BrowseModeTreeInterceptor
+from locationHelper import RectLTWH
+from collections import namedtuple
+
+from visionEnhancementProviders.imageCaptioning import ImageCaptioning
+from ._imageHash import hashPixels
+from . import _instrumentation, _tiling
+from ._perceptualHash import dHash
+from ._preprocess import INPUT_SIZE
+from ._captionCache import CaptionCache
+from ._cacheBundle import CacheBundleSet
+from ._captioningBackend import DATA_DIR
+from ._modelVariants import modelVersion
+from ._sayLookTell import getActiveModelVariant
+from ._capture import captureImage, getViewport
+from ._objectIdentity import IDENTITY_MAX_AGE, getImageIdentity
+from ._doImageCaptioning import Detection, DoImageCaptioning, isLargeEnough
+
+#: Path of the on-disk caption cache store
+_cacheStorePath = os.path.join(globalVars.appArgs.configPath, "imageCaptioning", "captionCache.json.gz")
+#: Cache of image captioning results, created on first use by L{getCaptionCache}
+_captionCache: Optional[CaptionCache] = None
+
+def getCaptionCache() -> CaptionCache:
+	"""Returns the caption cache, configured according to the add-on settings. The cached captions are only
+	loaded from disk when the cache is first used.
+	"""
+	global _captionCache
+	settings = ImageCaptioning.getSettings()
+	maxBytes = settings.cacheMaxSizeKB * 1024
+	storePath = _cacheStorePath if settings.persistCache else None
+	if _captionCache is None or _captionCache.storePath != storePath:
+		if _captionCache:
+			_captionCache.save()
+		_captionCache = CaptionCache(settings.cacheMaxEntries, maxBytes, storePath)
+	else:
+		_captionCache.configure(settings.cacheMaxEntries, maxBytes)
+	return _captionCache
 
-_cachedResults = deque(maxlen=10)
+#: Directory of the caption cache bundles shared between machines, see L{_cacheBundle}
+_bundleDirectory = os.path.join(globalVars.appArgs.configPath, "imageCaptioning", "bundles")
+#: Bundles generated by the model in use, created on first use by L{getCacheBundles}
+_cacheBundles: Optional[CacheBundleSet] = None
+
+def getCacheBundles() -> Optional[CacheBundleSet]:
+	"""Returns the caption cache bundles generated by the model in use. The bundles are only opened when they
+	are first looked up.
+	@return: the bundles, None if they are disabled or the model variant in use is not known yet
+	"""
+	global _cacheBundles
+	variant = getActiveModelVariant()
+	if not ImageCaptioning.getSettings().useCacheBundles or variant is None:
+		return None
+	version = modelVersion(DATA_DIR, variant)
+	if _cacheBundles is None or _cacheBundles.modelVersion != version:
+		if _cacheBundles:
+			_cacheBundles.close()
+		_cacheBundles = CacheBundleSet(_bundleDirectory, version)
+	return _cacheBundles
+
+def closeCacheBundles():
+	"""Closes the caption cache bundles. Called when the add-on terminates."""
+	if _cacheBundles:
+		_cacheBundles.close()
+
+#: Path of the file timings are exported to as JSON lines
+_timingsExportPath = os.path.join(globalVars.appArgs.configPath, "imageCaptioning", "timings.jsonl")
+
+def configureInstrumentation():
+	"""Enables or disables the collection and export of timings according to the add-on settings."""
+	settings = ImageCaptioning.getSettings()
+	exportPath = None
+	if settings.collectTimings and settings.exportTimings:
+		exportPath = _timingsExportPath
+		os.makedirs(os.path.dirname(exportPath), exist_ok=True)
+	_instrumentation.configure(settings.collectTimings, exportPath)
+
+def presentTimings():
+	"""User interface function presenting the percentiles of the duration of each recognition stage in a
+	virtual window. The report is also written to the log."""
+	configureInstrumentation()
+	if not _instrumentation.enabled:
+		# Translators: Reported when the timing report is requested but timings are not collected.
+		ui.message(_("Timings are not collected, enable them in the image captioning settings"))
+		return
+	_instrumentation.flush()
+	report = _instrumentation.report()
+	log.info(f"(imageCaptioning) Recognition timings in milliseconds:\n{report}")
+	resObj = RecogResultNVDAObject(result=SimpleTextResult(report))
+	resObj.setFocus()
 
-class SpeakResult():
-	"""ResultHandlerClass that speaks the obtained image captioning result."""
+def saveCaptionCache():
+	"""Writes the caption cache to disk if it is persistent. Called when the add-on terminates."""
+	if _captionCache:
+		try:
+			_captionCache.save()
+		except OSError:
+			log.error("imageCaptioning: Could not save the caption cache", exc_info=True)
+
+
+class ResultHandler():
+	"""Base class of the ResultHandlerClasses, caches the obtained image captioning result."""
 	def __init__(self, result: namedtuple):
-		"""Calls methods that cache the result and speak it.
+		"""
 		@param result: image captioning result
 		"""
 		self.result = result
 		self.cacheResult()
+
+	def cacheResult(self):
+		"""Caches the result in the caption cache. The result may already be cached since the same
+		ResultHandlerClass is used to present result in case of cache hits, caching it again only marks it
+		as recently used.
+		"""
+		cache = getCaptionCache()
+		cache.put(self.result.imageHash, self.result.caption, self.result.perceptualHash)
+		if self.result.identity:
+			cache.putIdentity(self.result.identity, self.result.imageHash)
+
+
+class SpeakResult(ResultHandler):
+	"""ResultHandlerClass that speaks the obtained image captioning result. The beginning of the caption may
+	already have been spoken while it was generated, see L{CaptionStream}."""
+	def __init__(self, result: namedtuple, spokenText: str = ""):
+		"""Calls methods that cache the result and speak it.
+		@param result: image captioning result
+		@param spokenText: beginning of the caption that was already spoken
+		"""
+		self.spokenText = spokenText
+		super().__init__(result)
 		self.presentResult()
 
+	@_instrumentation.timed("presentation")
 	def presentResult(self):
-		"""Speaks the caption"""
-		ui.message(self.result.caption)
+		"""Speaks the caption, or the part of it that was not spoken yet. Speech is queued on the main thread
+		so that it follows any part of the caption spoken while it was generated."""
+		caption = self.result.caption
+		if self.spokenText and caption.startswith(self.spokenText):
+			caption = caption[len(self.spokenText):].strip()
+			if not caption.strip("."):
+				return
+		queueHandler.queueFunction(queueHandler.eventQueue, ui.message, caption)
 
-	def cacheResult(self):
-		"""Caches the result in _cachedResults unless it is already cached. The result may already be
-		cached since the same ResultHandlerClass is used to present result in case of cache hits.
+
+#: Number of words gathered before part of a caption that is still being generated is spoken
+_phraseLength = 3
+
+class CaptionStream():
+	"""Speaks a caption in short phrases while it is generated, so that the user hears its first words long
+	before the whole caption is known. Phrases are only spoken while the recognition is still the latest one
+	and its result is to be spoken, the rest of the caption is then spoken by L{SpeakResult}.
+	"""
+	def __init__(self, recognizer: ContentRecognizer):
+		"""
+		@param recognizer: the recognizer generating the caption
+		"""
+		self._recognizer = recognizer
+		self._pendingWords: List[str] = []
+		#: Words already queued for speech
+		self.spokenWords: List[str] = []
+
+	@property
+	def spokenText(self) -> str:
+		return " ".join(self.spokenWords)
+
+	def onWords(self, words: List[str]):
+		"""Gathers the next words of the caption and speaks them once they form a phrase. Runs on the
+		recognition worker thread.
+		@param words: the next words of the caption
 		"""
-		global _cachedResults
-		alreadyCached = False
-		for cachedResult in _cachedResults:
-			if self.result.imageHash == cachedResult.imageHash:
-				alreadyCached = True
-				break
-		if not alreadyCached:
-			_cachedResults.appendleft(self.result)
+		recognizer = self._recognizer
+		if _activeRecog is not recognizer or not issubclass(recognizer.resultHandlerClass, SpeakResult):
+			# superseded by another recognition, or the result is to be presented in a virtual window instead
+			return
+		self._pendingWords.extend(words)
+		if len(self._pendingWords) >= _phraseLength:
+			phrase = " ".join(self._pendingWords)
+			self.spokenWords.extend(self._pendingWords)
+			self._pendingWords = []
+			queueHandler.queueFunction(queueHandler.eventQueue, ui.message, phrase)
 
 
-class BrowseableResult():
+class BrowseableResult(ResultHandler):
 	"""ResultHandlerClass that presents the obtained image captioning result in a virtual window."""
 	def __init__(self, result: namedtuple):
 		"""Calls methods that cache the result and present it in a virtual window.
 		@param result: image captioning result
 		"""
-		self.result = result
-		self.cacheResult()
+		super().__init__(result)
 		self.presentResults()
 
+	@_instrumentation.timed("presentation")
 	def presentResults(self):
 		"""converts the caption from string to L{SimpleTextResult}, create a virtual result window
 		using it and set focus onto the window."""
@@ -59,21 +211,287 @@ class BrowseableResult():
 		resObj = RecogResultNVDAObject(result=sentenceResult)
 		resObj.setFocus()
 
+
+class DetailedResult(BrowseableResult):
+	"""ResultHandlerClass that presents a more detailed caption, followed by other likely captions, in a virtual
+	window (see L{DoImageCaptioning.recognizeDetails}). Detailed captions are not cached so that the caption
+	spoken for an image stays the same."""
 	def cacheResult(self):
-		"""Caches the result in _cachedResults unless it is already cached. The result may already be
-		cached since the same ResultHandlerClass is used to present result in case of cache hits.
-		"""
-		global _cachedResults
-		alreadyCached = False
-		for cachedResult in _cachedResults:
-			if self.result.imageHash == cachedResult.imageHash:
-				alreadyCached = True
-				break
-		if not alreadyCached:
-			_cachedResults.appendleft(self.result)
+		if self.result.alternatives is None:
+			# a regular result, when more detail was requested while the image was still being recognized
+			super().cacheResult()
 
+	@_instrumentation.timed("presentation")
+	def presentResults(self):
+		lines = [self.result.caption]
+		if self.result.alternatives:
+			# Translators: Presented before the alternative captions of an image in the result window.
+			lines.append(_("Other possible descriptions:"))
+			lines.extend(self.result.alternatives)
+		resObj = RecogResultNVDAObject(result=SimpleTextResult("\n".join(lines)))
+		resObj.setFocus()
+
+
+def findCachedResult(imageHash: str, pixels, imgInfo: RecogImageInfo) -> Detection:
+	"""Looks up the caption of a captured image in the caption cache by its hash, then in the caption cache
+	bundles and, if enabled in the settings, in the caption cache by its perceptual hash.
+	@param imageHash: hash of the image
+	@param pixels: 2D array of RGBAQUAD values that store image pixels
+	@param imgInfo: stores details of the captured image
+	@return: the cached result. Its caption is None if no caption was found. Its perceptualHash is only set if
+	similar images are looked up and the image has enough detail to be matched, see L{dHash}.
+	"""
+	cache = getCaptionCache()
+	cachedCaption = cache.get(imageHash)
+	if cachedCaption is not None:
+		return Detection(imageHash, cachedCaption)
+	# Captions generated on other machines, the caption is copied to the cache so that it is found there
+	# from now on
+	bundles = getCacheBundles()
+	bundledCaption = bundles.get(imageHash) if bundles else None
+	if bundledCaption is not None:
+		cache.put(imageHash, bundledCaption)
+		return Detection(imageHash, bundledCaption)
+	# No exact match, the image may still be visually identical to a cached image with a few changed pixels
+	# (blinking caret, hover highlight...) so look for a cached image with a similar perceptual hash.
+	settings = ImageCaptioning.getSettings()
+	if not settings.matchSimilarImages:
+		return Detection(imageHash, None)
+	perceptualHash = dHash(pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+	if perceptualHash is None:
+		# the image is too plain for similar images to be told apart, only its exact caption may be reused
+		return Detection(imageHash, None)
+	similarHash = cache.findSimilar(perceptualHash, settings.similarImageThreshold)
+	if similarHash is not None:
+		log.debug(f"(imageCaptioning) Using caption of similar image {similarHash}")
+		cachedCaption = cache.get(similarHash)
+	return Detection(imageHash, cachedCaption, perceptualHash)
+
+def cacheResult(result: Detection):
+	"""Caches an image captioning result that is not presented to the user.
+	@param result: image captioning result or the exception raised while obtaining it
+	"""
+	if not isinstance(result, Exception):
+		cache = getCaptionCache()
+		cache.put(result.imageHash, result.caption, result.perceptualHash)
+		if result.identity:
+			cache.putIdentity(result.identity, result.imageHash)
+
+
+#: Maximum number of objects looked at when searching for graphic objects
+_maxNodes = 200
+
+def _intersects(first: RectLTWH, second: RectLTWH) -> bool:
+	return (
+		first.left < second.right and second.left < first.right
+		and first.top < second.bottom and second.top < first.bottom
+	)
+
+def findVisibleGraphics(container, maxImages: int) -> Iterator:
+	"""Finds the graphic objects of a browse mode document or of a container object that are visible on screen
+	and large enough to be captioned. Graphics that are scrolled out of view cannot be captured so they are
+	skipped.
+	@param container: browse mode document (L{BrowseModeTreeInterceptor}) or NVDAObject
+	@param maxImages: maximum number of objects to return
+	@return: the graphic objects, in document order
+	"""
+	viewport = getViewport(container)
+	if isinstance(container, BrowseModeTreeInterceptor):
+		candidates = (item.obj for item in container._iterNodesByType("graphic"))
+	else:
+		candidates = _iterDescendantGraphics(container)
+	if not viewport:
+		return
+	found = 0
+	for index, obj in enumerate(candidates):
+		if found >= maxImages or index >= _maxNodes:
+			return
+		location = obj.location
+		if location and isLargeEnough(location) and _intersects(location, viewport):
+			found += 1
+			yield obj
 
-#: Keeps track of the recognition in progress, if any.
+def _iterDescendantGraphics(obj) -> Iterator:
+	"""Yields the graphic descendants of an object, and the object itself if it is graphic, in breadth first
+	order. At most L{_maxNodes} objects are visited."""
+	queue = [obj]
+	visited = 0
+	while queue and visited < _maxNodes:
+		current = queue.pop(0)
+		visited += 1
+		if current.role == ROLE_GRAPHIC:
+			yield current
+		queue.extend(current.children)
+
+
+#: Maximum number of images captioned by L{recognizeAllGraphics}
+_maxBatchImages = 20
+
+def recognizeAllGraphics():
+	"""User interface function to caption all the visible graphics of the focused browse mode document, or of
+	the focused object if it is not in a browse mode document. The captions are presented in a virtual window.
+	"""
+	if isinstance(api.getFocusObject(), RecogResultNVDAObject):
+		# Translators: Reported when content recognition is attempted, but the user is already reading a
+		# content recognition result.
+		ui.message(_("Already in a content recognition result"))
+		return
+	obj = api.getFocusObject()
+	container = obj.treeInterceptor if isinstance(obj.treeInterceptor, BrowseModeTreeInterceptor) else obj
+	graphics = list(findVisibleGraphics(container, _maxBatchImages))
+	if not graphics:
+		# Translators: Reported when captioning all images but no visible image was found.
+		ui.message(_("No visible images found"))
+		return
+
+	recognizer = DoImageCaptioning(None, time.time())
+	viewport = getViewport(container)
+	captures = [
+		captureImage(recognizer, graphic.location, viewport, recognizer.captureAtModelSize)
+		for graphic in graphics
+	]
+	count = _recognizeCaptures(recognizer, captures, _presentAllResults)
+	if count:
+		# Translators: Reported when captioning all images begins. {count} is the number of images.
+		ui.message(_("Captioning {count} images").format(count=count))
+
+def _recognizeCaptures(
+		recognizer: DoImageCaptioning,
+		captures: List[Optional[Tuple[RecogImageInfo, Any]]],
+		present: Callable[[List[Optional[Detection]]], None],
+) -> int:
+	"""Captions several captured images as a single batch, using cached captions where possible.
+	@param recognizer: the recognizer running the batch
+	@param captures: image info and pixels of each image, None for images that could not be captured
+	@param present: called on the main thread with the result of each image, None for images that could not
+	be captioned, once all images have been captioned
+	@return: number of images that are being captioned, 0 if all results were presented already
+	"""
+	results: List[Optional[Detection]] = [None] * len(captures)
+	images = []
+	indexes = []
+	for index, capture in enumerate(captures):
+		if capture is None:
+			continue
+		imgInfo, pixels = capture
+		imageHash = hashPixels(pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+		cachedResult = findCachedResult(imageHash, pixels, imgInfo)
+		if cachedResult.caption is not None:
+			results[index] = cachedResult
+		else:
+			images.append((imageHash, pixels, imgInfo, cachedResult.perceptualHash))
+			indexes.append(index)
+
+	def onImageResult(batchIndex: int, result: Detection):
+		# Results are cached as they are streamed so that they are kept even if the batch fails later on
+		cacheResult(result)
+		results[indexes[batchIndex]] = result
+
+	def onResult(batchResult):
+		if isinstance(batchResult, Exception):
+			log.error("Recognition failed: %s" % batchResult)
+		queueHandler.queueFunction(queueHandler.eventQueue, present, results)
+
+	if not images:
+		present(results)
+		return 0
+	recognizer.recognizeBatch(images, onImageResult, onResult)
+	return len(images)
+
+def _presentAllResults(results: List[Optional[Detection]]):
+	"""Presents the captions of several images in a virtual result window, one image per line."""
+	lines = []
+	for index, result in enumerate(results):
+		if result is None:
+			# Translators: Presented in place of the caption of an image that could not be captioned.
+			caption = _("Recognition failed")
+		else:
+			caption = result.caption
+		# Translators: A line of the result window of the caption all images command.
+		lines.append(_("Image {number}: {caption}").format(number=index + 1, caption=caption))
+	resObj = RecogResultNVDAObject(result=SimpleTextResult("\n".join(lines)))
+	resObj.setFocus()
+
+
+def _regionName(row: int, column: int) -> str:
+	"""@return: name of a region of an image by the row and column of its third of the image"""
+	names = (
+		# Translators: Name of the top left part of an image, presented with the caption of that region.
+		(_("Top left"), _("Top"), _("Top right")),
+		# Translators: Name of the middle parts of an image, presented with the caption of that region.
+		(_("Left"), _("Centre"), _("Right")),
+		# Translators: Name of the bottom parts of an image, presented with the caption of that region.
+		(_("Bottom left"), _("Bottom"), _("Bottom right")),
+	)
+	return names[row][column]
+
+def recognizeRegions(recognizer: DoImageCaptioning, imgInfo: RecogImageInfo, pixels):
+	"""Captions a large image as a whole and its most detailed regions separately, in a single batch, and
+	presents the captions in a virtual result window. Regions are overlapping tiles of the image (see
+	L{_tiling}) captured again at the size used by the model, so that their details are not lost when the
+	whole image is shrunk to that size.
+	@param recognizer: the recognizer to use
+	@param imgInfo: stores details of the captured image
+	@param pixels: the whole image, used to find the most detailed regions
+	"""
+	columns, rows = _tiling.gridSize(imgInfo.screenWidth, imgInfo.screenHeight, INPUT_SIZE)
+	tiles = _tiling.tileRects(imgInfo.recogWidth, imgInfo.recogHeight, columns, rows)
+	tiles = [
+		tiles[index]
+		for index in _tiling.selectSalientTiles(pixels, imgInfo.recogWidth, imgInfo.recogHeight, tiles)
+	]
+	captures = [(imgInfo, pixels)]
+	names = [None]
+	for tile in tiles:
+		left, top, width, height = tile
+		location = RectLTWH(
+			imgInfo.convertXToScreen(left),
+			imgInfo.convertYToScreen(top),
+			imgInfo.convertWidthToScreen(width),
+			imgInfo.convertHeightToScreen(height),
+		)
+		captures.append(captureImage(recognizer, location))
+		names.append(_regionName(*_tiling.regionPosition(tile, imgInfo.recogWidth, imgInfo.recogHeight)))
+	count = _recognizeCaptures(recognizer, captures, lambda results: _presentRegionResults(results, names))
+	if not count:
+		return
+	if not tiles:
+		# Translators: Reported when captioning a large image begins and none of its regions is detailed enough
+		# to be captioned separately.
+		ui.message(_("Captioning image"))
+	elif len(tiles) == 1:
+		# Translators: Reported when captioning a large image and one of its regions begins.
+		ui.message(_("Captioning image and 1 region"))
+	else:
+		# Translators: Reported when captioning the regions of a large image begins.
+		ui.message(_("Captioning image and {count} regions").format(count=len(tiles)))
+
+def _presentRegionResults(results: List[Optional[Detection]], names: List[Optional[str]]):
+	"""Presents the caption of an image followed by the captions of its regions that do not repeat an earlier
+	caption, one per line, in a virtual result window.
+	@param results: results of the whole image and of each region
+	@param names: names of the regions, None for the whole image
+	"""
+	captions = [result.caption if result else None for result in results]
+	duplicates = _tiling.findDuplicateCaptions(captions)
+	lines = []
+	for name, caption, isDuplicate in zip(names, captions, duplicates):
+		if isDuplicate:
+			continue
+		if caption is None:
+			# Translators: Presented in place of the caption of an image that could not be captioned.
+			caption = _("Recognition failed")
+		if name is None:
+			lines.append(caption)
+		else:
+			# Translators: A line of the result window listing the captions of the regions of an image.
+			lines.append(_("{region}: {caption}").format(region=name, caption=caption))
+	resObj = RecogResultNVDAObject(result=SimpleTextResult("\n".join(lines)))
+	resObj.setFocus()
+
+
+#: Keeps track of the latest recognition in progress, if any. Older recognitions are superseded by newer
+#: ones and their results are only cached.
 _activeRecog: Optional[ContentRecognizer] = None
 
 def recognizeNavigatorObject(recognizer, filterNonGraphic=True):
@@ -103,6 +521,8 @@ def recognizeNavigatorObject(recognizer, filterNonGraphic=True):
 	else:
 		obj = api.getNavigatorObject()
 
+	configureInstrumentation()
+	validationStart = time.perf_counter()
 	# if filterNonGraphic True, validate the object. If invalid end the recognition process
 	if filterNonGraphic and not recognizer.validateObject(obj):
 		return
@@ -117,79 +537,139 @@ def recognizeNavigatorObject(recognizer, filterNonGraphic=True):
 	# If the object bounds are not valid, end the recognition process.
 	if not recognizer.validateBounds(obj.location):
 		return
-	try:
-		imgInfo = RecogImageInfo.createFromRecognizer(left, top, width, height, recognizer)
-	except ValueError:
+	_instrumentation.record("validation", time.perf_counter() - validationStart)
+
+	# Objects with a stable identity, such as web images with a source URL, are looked up before anything
+	# is captured. Objects without identity, and objects whose identity is not cached or was last confirmed by
+	# a capture too long ago, are captured and looked up by image hash.
+	tileLargeImages = ImageCaptioning.getSettings().tileLargeImages
+	# requests for more detail need the pixels of the image in case its encoder features are not cached
+	wantsDetails = issubclass(recognizer.resultHandlerClass, DetailedResult)
+	if not wantsDetails and not (tileLargeImages and _tiling.shouldTile(width, height, INPUT_SIZE)):
+		with _instrumentation.stage("identityLookup"):
+			recognizer.identity = getImageIdentity(obj, width, height)
+			cachedIdentity = None
+			if recognizer.identity:
+				cachedIdentity = getCaptionCache().getByIdentity(recognizer.identity, IDENTITY_MAX_AGE)
+		if cachedIdentity:
+			imageHash, caption = cachedIdentity
+			# the identity is not recorded again, so that it expires once the object was last captured too long ago
+			handler = recognizer.getResultHandler(Detection(imageHash, caption))
+			_recordTotal(recognizer)
+			return
+
+	# capture the visible part of the object, scaled down to the size used by the model and without its
+	# borders if enabled
+	container = obj.treeInterceptor if isinstance(obj.treeInterceptor, BrowseModeTreeInterceptor) else obj
+	with _instrumentation.stage("capture"):
+		capture = captureImage(
+			recognizer, obj.location, getViewport(container), recognizer.captureAtModelSize
+		)
+	if capture is None:
 		ui.message(notVisibleMsg)
 		return
+	imgInfo, pixels = capture
+	if (
+		tileLargeImages
+		and _tiling.shouldTile(imgInfo.screenWidth, imgInfo.screenHeight, INPUT_SIZE)
+	):
+		recognizeRegions(recognizer, imgInfo, pixels)
+		return
+
+	# calculate L{imageHash} over all channels of all pixels since using only part of the image may cause
+	# false cache hits for images with padding.
+	with _instrumentation.stage("hashing"):
+		imageHash = hashPixels(pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+
+	# check if the current object matches any previous result. If a match is found, call the recognizer's
+	# I{getResultHandler} method with the cached result and end the current recognition process here.
+	with _instrumentation.stage("cacheLookup"):
+		cachedResult = findCachedResult(imageHash, pixels, imgInfo)
+	if cachedResult.caption is not None and wantsDetails:
+		_recognizeDetails(recognizer, cachedResult, pixels, imgInfo)
+		return
+	if cachedResult.caption is not None:
+		# remember the identity of the object so that the next lookup does not need a capture
+		handler = recognizer.getResultHandler(cachedResult._replace(identity=recognizer.identity))
+		_recordTotal(recognizer)
+		return
+	recognizer.perceptualHash = cachedResult.perceptualHash
 
 	global _activeRecog
+	if _activeRecog and _activeRecog.isCancelled:
+		# the recognition was dropped by the scheduler, it will never deliver a result
+		_activeRecog = None
+	if _activeRecog and _activeRecog.imageHash == imageHash:
+		# The same image is already being recognized so the user probably pressed the gesture multiple times.
+		# Present the pending result using the latest resultHandlerClass (which is L{BrowseableResult} for
+		# repeated presses) instead of starting a new recognition process.
+		_activeRecog.resultHandlerClass = recognizer.resultHandlerClass
+		# Translators: Reporting when content recognition begins.
+		ui.message(_("Recognizing"))
+		return
 	if _activeRecog:
-		# If a recognition process is already occurring and a new one is started after more than 3 seconds,
-		# warn the user and block the new recognition process. If the delay is less than 3 seconds, the
-		# user probably pressed the gesture multiple times so cancel the old process and let the new one
-		# continue. Cancelling the old process results in errors that cause both recognition processes to
-		# fail so we just update the resultHandlerClass of the previous recognition process instead of
-		# cancelling it and end the new recognition process here.
-		if ((time.time() - _activeRecog.timeCreated) <= 3) and (
-				_activeRecog.resultHandlerClass != BrowseableResult):
-			_activeRecog.resultHandlerClass = BrowseableResult
-			# Translators: Reporting when content recognition begins.
-			ui.message(_("Recognizing"))
-		else:
-			ui.message("Already running an image captioning process. Please try again later.")
-		return
-
-	# capture object pixels
-	sb = screenBitmap.ScreenBitmap(imgInfo.recogWidth, imgInfo.recogHeight)
-	pixels = sb.captureImage(left, top, width, height)
-
-	# calculate L{imageHash} using the inbuilt hash function. Only one channel is used to calculate the
-	# hash to save time but all pixels in that channel must be used since using only part of the image may
-	# cause false cache hits for images with padding.
-	rowHashes = []
-	for i in range(imgInfo.recogWidth):
-		row = []
-		for j in range(imgInfo.recogHeight):
-			row.append(pixels[j][i].rgbRed)  # column major order
-		rowHashes.append(hash(str(row)))
-	imageHash = hash(str(rowHashes))
-
-	global _cachedResults
-	# check if the hash of the current object matches that of any previous result
-	for result in _cachedResults:
-		# if a match is found, call the recognizer's I{getResultHandler} method with the cached result and
-		# end the current recognition process here.
-		if result[0] == imageHash:
-			handler = recognizer.getResultHandler(result)
-			return
+		# The user moved on to another image, nobody is waiting for the old result anymore.
+		_activeRecog.cancel()
 
 	# Translators: Reporting when content recognition begins.
 	ui.message(_("Recognizing"))
-	# Store a copy of the recognizer before image captioning really starts. This can also be used to check
-	# recognition process is active
+	# Store a copy of the recognizer before image captioning really starts. This is used to check which
+	# recognition process is the latest one.
 	_activeRecog = recognizer
 
-	recognizer.recognize(imageHash, pixels, imgInfo, _recogOnResult)
+	stream = CaptionStream(recognizer) if ImageCaptioning.getSettings().streamCaptions else None
+	recognizer.recognize(
+		imageHash, pixels, imgInfo,
+		lambda result: _recogOnResult(recognizer, result, stream),
+		onDiscardedResult=cacheResult,
+		onWords=stream.onWords if stream else None
+	)
 
 
-def _recogOnResult(result):
+def _recognizeDetails(recognizer: DoImageCaptioning, cachedResult: Detection, pixels, imgInfo: RecogImageInfo):
+	"""Starts generating a more detailed caption of an image that was already captioned."""
+	global _activeRecog
+	if _activeRecog:
+		_activeRecog.cancel()
+	# Translators: Reporting when content recognition begins.
+	ui.message(_("Recognizing"))
+	_activeRecog = recognizer
+	recognizer.identity = None
+	recognizer.perceptualHash = cachedResult.perceptualHash
+	recognizer.recognizeDetails(
+		cachedResult.imageHash, cachedResult.caption, pixels, imgInfo,
+		lambda result: _recogOnResult(recognizer, result)
+	)
+
+
+def _recordTotal(recognizer: ContentRecognizer):
+	"""Records the time from the gesture to the presentation of the result of a recognition."""
+	_instrumentation.record("total", time.time() - recognizer.timeCreated)
+
+
+def _recogOnResult(recognizer: ContentRecognizer, result, stream: Optional[CaptionStream] = None):
 	"""Presents the image captioning result whether successful or not.
+	@param recognizer: the recognizer that produced the result
 	@param result: image captioning result
+	@param stream: speaks the caption while it is generated, if enabled
 	"""
 	global _activeRecog
-	# Create a local copy of the active recognizer for later use and set original to L{None} so new
-	# recognition processes may be started.
-	recognizer: ContentRecognizer = _activeRecog
-	_activeRecog = None
+	# Set the active recognizer to L{None} if it is the one that produced this result
+	if _activeRecog is recognizer:
+		_activeRecog = None
 	# This might get called from a background thread, so any UI calls must be queued to the main thread.
 	if isinstance(result, Exception):
 		# Translators: Reported when recognition fails.
 		log.error("Recognition failed: %s" % result)
 		queueHandler.queueFunction(queueHandler.eventQueue, ui.message, _("Recognition failed"))
 		return
+	if stream and stream.spokenWords and issubclass(recognizer.resultHandlerClass, SpeakResult):
+		# Only speak the part of the caption that was not spoken while it was generated
+		handler = recognizer.resultHandlerClass(result, spokenText=stream.spokenText)
+		_recordTotal(recognizer)
+		return
 	# Call the recognizer's L{getResultHandler} method. The __init__ method of the L{ResultHandlerClass}
 	# usually contains code that presents the result to the user and so the result is presented when this
 	# method is called.
-	if recognizer:
-		handler = recognizer.getResultHandler(result)
+	handler = recognizer.getResultHandler(result)
+	_recordTotal(recognizer)
@@ -1,36 +1,77 @@
-# Image Captioning model DLL interface
+# Image Captioning model DLL interface and captioning engine management
 # Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
 
 import os
+import sys
+import threading
 from ctypes import *
+from typing import Dict, Optional, Type
 
+try:
+	from logHandler import log
+except ImportError:
+	# running outside of NVDA, for example in the inference process
+	import logging
+	log = logging.getLogger(__name__)
 
-class SayLookTellCaptioning():
-	"""Class that interfaces with the ImageCaptioning DLL that performs image captioning. Responsible for
-	converting results to appropriate formats and ensuring DLL dependencies are satisfied."""
-	def __init__(self, imagePath):
-		""" Defines paths to all the required files (image, DLLs and model files)
-		@param imagePath: path to image to be recognized
+from ._captioningBackend import CaptioningBackend, DATA_DIR
+from . import _instrumentation
+from ._modelVariants import AUTO, VARIANTS, selectFastestVariant
+from ._resourceManager import ResourceManager
+
+
+class SayLookTellCaptioning(CaptioningBackend):
+	"""Backend that interfaces with the ImageCaptioning DLL that performs image captioning. Responsible for
+	converting results to appropriate formats and ensuring DLL dependencies are satisfied.
+	The DLLs are loaded once by L{initialize} and stay resident until L{terminate} is called, so every caption
+	after the first one runs against an already loaded library.
+	"""
+	name = "dll"
+
+	def __init__(self, modelVariant: str = "fp32"):
+		""" Defines paths to all the required files (DLLs and model files)
+		@param modelVariant: variant of the models to load, one of L{_modelVariants.VARIANTS}
 		"""
-		self.imagePath = imagePath
+		super().__init__(modelVariant)
 		self.baseDir = os.path.abspath(os.path.dirname(__file__))
-		self.encoderPath = self.baseDir + "\\data\\encoder.onnx"
-		self.decoderPath = self.baseDir + "\\data\\decoder.onnx"
-		self.vocabPath = self.baseDir + "\\data\\vocab.txt"
+		self.encoderPath = self._modelPath("encoder")
+		self.decoderPath = self._modelPath("decoder")
+		self.vocabPath = os.path.join(DATA_DIR, "vocab.txt")
 		# Must be in dependency order (ie. A<-B<-C where C depends on B and B depends on A).
-		self.dllPaths = ["\\dlls\\opencv_core430.dll", "\\dlls\\opencv_imgproc430.dll",
-						"\\dlls\\opencv_imgcodecs430.dll", "\\dlls\\onnxruntime.dll",
-						"\\dlls\\ImageCaptioning-DLL.dll"]
-		self.dllPaths = [self.baseDir + dllPath for dllPath in self.dllPaths]
-		self._checkFiles()
+		self.dllPaths = ["opencv_core430.dll", "opencv_imgproc430.dll", "opencv_imgcodecs430.dll",
+						"onnxruntime.dll", "ImageCaptioning-DLL.dll"]
+		self.dllPaths = [os.path.join(self.baseDir, "dlls", dllPath) for dllPath in self.dllPaths]
+		#: Handles of the loaded DLLs in load order, the ImageCaptioning DLL is always the last one.
+		self._libs = []
+		#: True if the ImageCaptioning DLL owns the ONNX sessions itself (see L{_defineFunctions})
+		self._hasResidentModel = False
+		#: True if the ImageCaptioning DLL accepts raw pixel buffers (see L{getCaptionFromPixels})
+		self._hasPixelInput = False
+		#: True if the ImageCaptioning DLL accepts preprocessed tensors (see L{getCaptionFromTensor})
+		self._hasTensorInput = False
+		# Note that the DLL keeps the result of the last detection in global state until 'getCaption' is
+		# called, so the lock must be held from detection until the result was read.
+
+	@classmethod
+	def isAvailable(cls) -> bool:
+		return sys.platform == "win32"
+
+	@property
+	def isInitialized(self) -> bool:
+		return bool(self._libs)
+
+	@property
+	def supportsPixelInput(self) -> bool:
+		return self._hasPixelInput
+
+	@property
+	def supportsTensorInput(self) -> bool:
+		return self._hasTensorInput
 
 	def _checkFiles(self):
 		"""Checks if all the required files are present. Raises a L{FileNotFoundError} if any file is
 		missing"""
 		notFound = ""
-		if not os.path.exists(self.imagePath):
-			notFound = notFound + f'imageCaptioning: Image file not found at {self.imagePath}'
-
 		if not os.path.exists(self.encoderPath):
 			notFound = notFound + f'\nimageCaptioning: Encoder model file not found at {self.encoderPath}'
 
@@ -42,36 +83,126 @@ class SayLookTellCaptioning():
 				notFound = notFound + f'\nimageCaptioning: DLL file not found at {dllPath}'
 
 		if notFound != "":
-			raise FileNotFoundError(notFound)
+			raise FileNotFoundError(notFound.strip())
 
 	def _loadDLLs(self):
-		"""Loads all the DLL files."""
-		# loads all the DLLs required by the ImageCaptioning DLL
-		for dllPath in self.dllPaths[:-1]:
-			_ = CDLL(dllPath)
+		"""Loads all the DLL files and keeps a reference to each of them so they stay resident."""
+		# loads all the DLLs required by the ImageCaptioning DLL followed by the ImageCaptioning DLL itself
+		self._libs = [CDLL(dllPath) for dllPath in self.dllPaths]
+		return self._libs[-1]
 
-		# load the ImageCaptioning DLL
-		lib = CDLL(self.dllPaths[-1])
-		return lib
-
-	def _getResult(self, lib) -> str:
-		"""Calls the DLL public methods and gets the image captioning results.
-		@return: generated caption
+	def _defineFunctions(self, lib):
+		"""Defines the return types and arguments of the DLL public methods.
+		Builds of the DLL that export 'initModel'/'releaseModel'/'runDetection' keep the encoder and decoder
+		sessions alive between calls. Older builds only export 'doDetection', which receives the model paths
+		on every call.
 		"""
 		# define return type and arguments of 'doDetection' function
 		lib.doDetection.restype = c_int
 		lib.doDetection.argtypes = [c_wchar_p, c_wchar_p, c_char_p, c_char_p]
+		# define return type and arguments of 'getCaption' function
+		lib.getCaption.restype = c_int
+		lib.getCaption.argtypes = [c_char_p, c_size_t]
+
+		self._hasResidentModel = all(
+			hasattr(lib, name) for name in ("initModel", "releaseModel", "runDetection")
+		)
+		if self._hasResidentModel:
+			lib.initModel.restype = c_int
+			lib.initModel.argtypes = [c_wchar_p, c_wchar_p, c_char_p]
+			lib.releaseModel.restype = None
+			lib.releaseModel.argtypes = []
+			lib.runDetection.restype = c_int
+			lib.runDetection.argtypes = [c_char_p]
 
-		# call 'doDetection' function and get length of result
-		res = lib.doDetection(c_wchar_p(self.encoderPath), c_wchar_p(self.decoderPath),
-							c_char_p(self.vocabPath.encode('utf-8')), c_char_p(self.imagePath.encode('utf-8')))
+		# 'runDetectionFromBuffer' receives a 32 bit BGRA pixel buffer along with its width, height and stride
+		self._hasPixelInput = self._hasResidentModel and hasattr(lib, "runDetectionFromBuffer")
+		if self._hasPixelInput:
+			lib.runDetectionFromBuffer.restype = c_int
+			lib.runDetectionFromBuffer.argtypes = [c_void_p, c_int, c_int, c_int]
 
+		# 'runDetectionFromTensor' receives a float32 NCHW tensor of a single, already resized and normalised,
+		# RGB image along with its channel count, height and width
+		self._hasTensorInput = self._hasResidentModel and hasattr(lib, "runDetectionFromTensor")
+		if self._hasTensorInput:
+			lib.runDetectionFromTensor.restype = c_int
+			lib.runDetectionFromTensor.argtypes = [c_void_p, c_int, c_int, c_int]
+
+	def acceptsPixels(self) -> bool:
+		"""Loads the DLLs to check their exports, without loading the model. The DLLs are unloaded again unless
+		the backend was already initialized."""
+		with self._lock:
+			if self.isInitialized:
+				return self._hasPixelInput or self._hasTensorInput
+			try:
+				self._defineFunctions(self._loadDLLs())
+			except OSError:
+				log.warning("imageCaptioning: Could not load the DLLs", exc_info=True)
+				self._unloadDLLs()
+				return False
+			accepted = self._hasPixelInput or self._hasTensorInput
+			self._unloadDLLs()
+			return accepted
+
+	def initialize(self):
+		"""Loads the DLLs and, if supported by the DLL, the model. Does nothing if already initialized.
+		Raises a L{FileNotFoundError} if any required file is missing and a L{RuntimeError} if the model
+		could not be loaded.
+		"""
+		with self._lock:
+			if self.isInitialized:
+				return
+			self._checkFiles()
+			lib = self._loadDLLs()
+			self._defineFunctions(lib)
+			if self._hasResidentModel:
+				res = lib.initModel(c_wchar_p(self.encoderPath), c_wchar_p(self.decoderPath),
+									c_char_p(self.vocabPath.encode('utf-8')))
+				if res == 0:
+					self.terminate()
+					raise RuntimeError("imageCaptioning: Could not load the image captioning model")
+
+	def terminate(self):
+		"""Releases the model and unloads all the DLLs. The engine can be initialized again later."""
+		with self._lock:
+			if not self.isInitialized:
+				return
+			if self._hasResidentModel:
+				self._libs[-1].releaseModel()
+			self._unloadDLLs()
+
+	def _unloadDLLs(self):
+		"""Unloads the DLLs loaded by L{_loadDLLs}, without releasing the model."""
+		if sys.platform == "win32":
+			freeLibrary = windll.kernel32.FreeLibrary
+			freeLibrary.argtypes = [c_void_p]
+			# unload in reverse dependency order
+			for lib in reversed(self._libs):
+				freeLibrary(lib._handle)
+		self._libs = []
+		self._hasResidentModel = False
+		self._hasPixelInput = False
+		self._hasTensorInput = False
+
+	def _runDetection(self, imagePath) -> int:
+		"""Calls the DLL detection function on an image file.
+		@param imagePath: path to image to be recognized
+		@return: length of the result
+		"""
+		lib = self._libs[-1]
+		if self._hasResidentModel:
+			return lib.runDetection(c_char_p(imagePath.encode('utf-8')))
+		return lib.doDetection(c_wchar_p(self.encoderPath), c_wchar_p(self.decoderPath),
+							c_char_p(self.vocabPath.encode('utf-8')), c_char_p(imagePath.encode('utf-8')))
+
+	def _getResult(self, res) -> str:
+		"""Gets the image captioning results of the last detection from the DLL.
+		@param res: length of the result as returned by the detection function
+		@return: generated caption
+		"""
+		lib = self._libs[-1]
 		# continue if there is a result
 		if res != 0:
-			# define return type and arguments of 'getCaption' function
-			lib.getCaption.restype = c_int
-			lib.getCaption.argtypes = [c_char_p, c_size_t]
-
 			# define string buffer to store caption and call 'getCaption' function
 			caption = create_string_buffer(res)
 			size = lib.getCaption(caption, res)
@@ -82,17 +213,183 @@ class SayLookTellCaptioning():
 		else:
 			return None
 
-	def getCaption(self) -> str:
-		"""Performs image captioning on input image and returns the resulting caption
+	def _readCaption(self, res) -> str:
+		"""Reads the result of the last detection from the DLL and formats it as a caption."""
+		with _instrumentation.stage("postprocessing"):
+			return self._formatCaption(self._getResult(res))
+
+	def getCaption(self, imagePath) -> str:
+		"""Performs image captioning on input image and returns the resulting caption. Initializes the engine
+		first if required.
+		@param imagePath: path to image to be recognized
 		@return: caption
 		"""
-		lib = self._loadDLLs()
-		result = self._getResult(lib)
-		if not result:
-			return "Could not generate a caption for the image."
-		caption = ""
-		for word in result.split():
-			if "<" not in word and word != ".":
-				caption = caption + f'{word} '
-		caption = caption.strip() + "."
-		return caption
+		if not os.path.exists(imagePath):
+			raise FileNotFoundError(f'imageCaptioning: Image file not found at {imagePath}')
+		with self._lock:
+			self.initialize()
+			with _instrumentation.stage("model"):
+				res = self._runDetection(imagePath)
+			return self._readCaption(res)
+
+	def getCaptionFromPixels(self, pixels, width, height, stride=None, onWords=None) -> str:
+		"""Performs image captioning on a 32 bit BGRA pixel buffer (such as the RGBQUAD array returned by
+		L{screenBitmap.ScreenBitmap.captureImage}) and returns the resulting caption. The buffer is passed to
+		the DLL as is, without being copied. Must only be called if L{supportsPixelInput} is True.
+		The DLL decodes the whole caption at once so I{onWords} is never called.
+		"""
+		if stride is None:
+			stride = width * 4
+		with self._lock:
+			self.initialize()
+			if not self._hasPixelInput:
+				raise RuntimeError("imageCaptioning: The loaded DLL does not accept pixel buffers")
+			if isinstance(pixels, Array):
+				address = addressof(pixels)
+			else:
+				address = addressof(c_char.from_buffer(pixels))
+			with _instrumentation.stage("model"):
+				res = self._libs[-1].runDetectionFromBuffer(c_void_p(address), width, height, stride)
+			return self._readCaption(res)
+
+	def getCaptionFromTensor(self, tensor, onWords=None) -> str:
+		"""Performs image captioning on an image preprocessed by L{_preprocess.preprocessPixels} and returns the
+		resulting caption. Must only be called if L{supportsTensorInput} is True.
+		The DLL decodes the whole caption at once so I{onWords} is never called.
+		"""
+		_batch, channels, height, width = tensor.shape
+		with self._lock:
+			self.initialize()
+			if not self._hasTensorInput:
+				raise RuntimeError("imageCaptioning: The loaded DLL does not accept tensors")
+			with _instrumentation.stage("model"):
+				res = self._libs[-1].runDetectionFromTensor(c_void_p(tensor.ctypes.data), channels, height, width)
+			return self._readCaption(res)
+
+
+def _getBackends() -> Dict[str, Type[CaptioningBackend]]:
+	"""@return: all backends by name. The ONNX Runtime backend imports NumPy, so it is only imported when a
+	backend other than the DLL backend is needed."""
+	from ._onnxBackend import OnnxRuntimeCaptioning
+	return {
+		SayLookTellCaptioning.name: SayLookTellCaptioning,
+		OnnxRuntimeCaptioning.name: OnnxRuntimeCaptioning,
+	}
+
+def getAvailableBackends() -> Dict[str, Type[CaptioningBackend]]:
+	"""@return: backends whose dependencies are satisfied, by name"""
+	return {name: backend for name, backend in _getBackends().items() if backend.isAvailable()}
+
+
+#: The captioning engine shared by all recognitions. Created on first use by L{getEngine}.
+_engine: Optional[CaptioningBackend] = None
+_engineLock = threading.Lock()
+#: Name and options of the backend used by L{getEngine}, and whether it runs in a separate process
+_backendName = SayLookTellCaptioning.name
+_backendOptions = {}
+_isolated = False
+
+def setBackend(name: str, isolated: bool = False, **options):
+	"""Selects the backend used by the shared captioning engine. If the engine was already created with a
+	different backend or different options, it is unloaded and recreated on next use.
+	@param name: name of the backend, falls back to the DLL backend if that backend is not available
+	@param isolated: if True, the backend runs in a separate process, see L{_remoteBackend}
+	@param options: keyword arguments of the backend's constructor
+	"""
+	global _engine, _backendName, _backendOptions, _isolated
+	if name != SayLookTellCaptioning.name and name not in getAvailableBackends():
+		name = SayLookTellCaptioning.name
+	with _engineLock:
+		if name == _backendName and options == _backendOptions and isolated == _isolated:
+			return
+		_backendName = name
+		_backendOptions = options
+		_isolated = isolated
+		if _engine is not None:
+			_engine.terminate()
+			_engine = None
+
+def getActiveModelVariant() -> Optional[str]:
+	"""@return: the model variant captions are generated with, None if it is not known yet because the fastest
+	variant is only selected when the engine is first used"""
+	with _engineLock:
+		if _engine is not None:
+			variant = _engine.modelVariant
+		else:
+			variant = _backendOptions.get("modelVariant", VARIANTS[0])
+	return None if variant == AUTO else variant
+
+def _createEngine(name: str, options: dict, isolated: bool = False) -> CaptioningBackend:
+	"""Creates a backend, resolving its model variant option: the L{AUTO} variant is the fastest installed
+	variant and a variant that is not installed falls back to the most accurate installed one.
+	If I{isolated} is True, a L{_remoteBackend.RemoteCaptioning} is returned instead, which creates the backend
+	in the inference process, unless no Python interpreter is available to run that process or the backend
+	cannot caption the pixels it receives.
+	"""
+	backendClass = SayLookTellCaptioning if name == SayLookTellCaptioning.name else _getBackends()[name]
+	if isolated:
+		from ._remoteBackend import RemoteCaptioning
+		if not RemoteCaptioning.isAvailable():
+			log.warning("imageCaptioning: No Python interpreter found, captioning in the NVDA process")
+		elif not backendClass(**options).acceptsPixels():
+			log.warning(
+				f"imageCaptioning: The {name} backend does not accept pixels, captioning in the NVDA process"
+			)
+		else:
+			return RemoteCaptioning(name, options)
+	options = dict(options)
+	variant = options.get("modelVariant", VARIANTS[0])
+	available = backendClass(**options).getAvailableVariants()
+	if variant == AUTO:
+		otherOptions = tuple(sorted((key, value) for key, value in options.items() if key != "modelVariant"))
+		variant = selectFastestVariant(
+			lambda candidate: backendClass(**dict(options, modelVariant=candidate)),
+			available,
+			key=(name, otherOptions),
+		)
+	elif variant not in available and available:
+		variant = available[0]
+	if "modelVariant" in options:
+		options["modelVariant"] = variant
+	return backendClass(**options)
+
+def getEngine() -> CaptioningBackend:
+	"""Returns the shared captioning engine, creating it with the backend selected by L{setBackend} if
+	required. The engine is initialized lazily by the first caption request.
+	"""
+	global _engine
+	while True:
+		with _engineLock:
+			if _engine is not None:
+				return _engine
+			name, options, isolated = _backendName, _backendOptions, _isolated
+		# Selecting the model variant may run a benchmark of several seconds, so the lock is released meanwhile
+		# to not block L{setBackend} on the main thread.
+		engine = _createEngine(name, options, isolated)
+		with _engineLock:
+			if _engine is None and (name, options, isolated) == (_backendName, _backendOptions, _isolated):
+				_engine = engine
+			# otherwise the backend was changed meanwhile and the engine, which is not initialized yet, is dropped
+
+#: Unloads the model of the shared engine when it is not used, see L{getLoadedEngine}
+_resourceManager = ResourceManager()
+
+def configureResources(idleTimeout: float):
+	"""Sets the number of seconds without caption request after which the model of the shared engine is
+	unloaded, 0 to only unload it under memory pressure."""
+	_resourceManager.idleTimeout = idleTimeout
+
+def getLoadedEngine() -> CaptioningBackend:
+	"""Returns the shared captioning engine with its model loaded. The model is loaded on first use and
+	loaded again if it was unloaded by the L{ResourceManager} since it was last used.
+	"""
+	return _resourceManager.load(getEngine())
+
+def terminateEngine():
+	"""Unloads the shared captioning engine, if any. Called when the add-on terminates."""
+	global _engine
+	_resourceManager.stop()
+	with _engineLock:
+		if _engine is not None:
+			_engine.terminate()
+			_engine = None
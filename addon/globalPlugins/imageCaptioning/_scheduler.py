@@ -0,0 +1,288 @@
+# Image Captioning recognition scheduling
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import threading
+import time
+from concurrent.futures import CancelledError
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+	from logHandler import log
+except ImportError:
+	# running outside of NVDA, for example in the benchmarks
+	import logging
+	log = logging.getLogger(__name__)
+
+from . import _instrumentation
+
+#: Priority of recognitions requested by the user
+PRIORITY_INTERACTIVE = 0
+#: Priority of recognitions nobody is waiting for, such as prefetching
+PRIORITY_BACKGROUND = 1
+
+
+class RecognitionJob():
+	"""A unit of work run by the L{RecognitionScheduler}. Jobs with the same key are expected to produce the
+	same result, so submitting a job while another one with the same key is pending adds its callbacks to
+	the pending job instead.
+	"""
+	def __init__(
+			self,
+			key: Any,
+			work: Callable[[], Any],
+			onResult: Optional[Callable[[Any], None]] = None,
+			priority: int = PRIORITY_INTERACTIVE,
+			onDiscardedResult: Optional[Callable[[Any], None]] = None,
+			group: Optional[str] = None,
+	):
+		"""
+		@param key: identifies the work, usually an image hash
+		@param work: callable run on the worker thread, its return value (or the exception it raised) is
+		the result of the job
+		@param onResult: called on the worker thread with the result, unless the job was cancelled
+		@param priority: one of the PRIORITY_* constants, jobs with lower values are run first
+		@param onDiscardedResult: called on the worker thread with the result if the job was cancelled
+		while it was running, for example to cache a result nobody is waiting for anymore. Called with a
+		L{CancelledError} instead if the job is dropped without being run, because it was cancelled while
+		queued or because the queue is full, so that the submitter can move on.
+		@param group: jobs of the same group and priority supersede each other when submitted with
+		I{latestWins}, see L{RecognitionScheduler.submit}. Jobs without group are never superseded.
+		"""
+		self.key = key
+		self.work = work
+		self.priority = priority
+		self.group = group
+		self._callbacks: List[Callable[[Any], None]] = [onResult] if onResult else []
+		self._discardCallbacks: List[Callable[[Any], None]] = [onDiscardedResult] if onDiscardedResult else []
+		#: Set once the job was cancelled. Queued jobs are dropped before they are run.
+		self.cancelled = False
+		#: Set once the worker started running the job
+		self.started = False
+		#: Set once the result was delivered
+		self.done = threading.Event()
+		#: L{time.perf_counter} value when the job was created
+		self.submitTime = time.perf_counter()
+		#: Number of seconds the worker spent running the job, None until it has run
+		self.runTime: Optional[float] = None
+
+	def cancel(self):
+		"""Cancels the job. If it has not started yet it is never run, otherwise its result is discarded."""
+		self.cancelled = True
+
+	def _merge(self, job: "RecognitionJob"):
+		"""Adds the callbacks of a job with the same key to this job. A cancelled job is revived, but the
+		callbacks of whoever cancelled it are dropped."""
+		if self.cancelled:
+			self.cancelled = False
+			self._callbacks = []
+		self._callbacks.extend(job._callbacks)
+		self._discardCallbacks.extend(job._discardCallbacks)
+		self.priority = min(self.priority, job.priority)
+
+
+class RecognitionScheduler():
+	"""Runs recognition jobs one at a time on a single persistent worker thread, so that the captioning
+	model stays warm on that thread and is never used concurrently.
+	The queue is bounded, jobs with the same key are coalesced and an interactive job may supersede all the
+	interactive jobs submitted before it ("latest wins") so that rapid navigation does not build a backlog.
+	"""
+	def __init__(self, maxQueued: int = 8):
+		"""
+		@param maxQueued: maximum number of jobs waiting to be run
+		"""
+		self.maxQueued = maxQueued
+		self._queue: List[RecognitionJob] = []
+		self._jobsByKey: Dict[Any, RecognitionJob] = {}
+		self._activeJob: Optional[RecognitionJob] = None
+		self._condition = threading.Condition()
+		self._worker: Optional[threading.Thread] = None
+		self._terminated = False
+
+	@property
+	def activeJob(self) -> Optional[RecognitionJob]:
+		"""The job currently being run, if any."""
+		return self._activeJob
+
+	def findJob(self, key: Any) -> Optional[RecognitionJob]:
+		"""@return: the queued or running job with the given key that has not been cancelled, if any"""
+		with self._condition:
+			job = self._jobsByKey.get(key)
+			if job and not job.cancelled:
+				return job
+			return None
+
+	def submit(self, job: RecognitionJob, latestWins: bool = False) -> RecognitionJob:
+		"""Queues a job.
+		@param job: the job to run
+		@param latestWins: if True, all other pending jobs of the same group and priority are cancelled. Does
+		nothing for jobs without group.
+		@return: the job that will deliver the result, which is an already pending job with the same key if
+		there is one. If the queue is full of more urgent jobs, the job is cancelled and its discard callbacks
+		are called with a L{CancelledError} before this method returns.
+		"""
+		dropped: List[RecognitionJob] = []
+		with self._condition:
+			if self._terminated:
+				raise RuntimeError("imageCaptioning: Recognition scheduler has been terminated")
+			existing = self._jobsByKey.get(job.key)
+			if existing and not existing.started and existing not in self._queue:
+				# the job was dropped from the queue, it can no longer deliver a result
+				self._forget(existing)
+				existing = None
+			if latestWins and job.group is not None:
+				for other in self._pendingJobs():
+					if other is not existing and other.group == job.group and other.priority == job.priority:
+						other.cancel()
+			if existing:
+				existing._merge(job)
+				if not existing.started:
+					self._sortQueue()
+				return existing
+			for queued in self._queue:
+				if queued.cancelled:
+					self._forget(queued)
+					dropped.append(queued)
+			self._queue = [queued for queued in self._queue if not queued.cancelled]
+			if len(self._queue) >= self.maxQueued:
+				leastUrgent = max(queued.priority for queued in self._queue)
+				if job.priority > leastUrgent:
+					# the queue is full of more urgent jobs, so this job is never run
+					dropped.append(job)
+				else:
+					# drop the oldest of the least urgent jobs to make room
+					oldest = next(queued for queued in self._queue if queued.priority == leastUrgent)
+					self._queue.remove(oldest)
+					self._forget(oldest)
+					dropped.append(oldest)
+			if job not in dropped:
+				self._queue.append(job)
+				self._jobsByKey[job.key] = job
+				self._sortQueue()
+				self._ensureWorker()
+				self._condition.notify()
+		# callbacks are called without holding the lock since they may submit other jobs
+		for droppedJob in dropped:
+			self._drop(droppedJob)
+		return job
+
+	def cancel(self, key: Any):
+		"""Cancels the pending job with the given key, if any."""
+		with self._condition:
+			job = self._jobsByKey.get(key)
+			if job:
+				job.cancel()
+
+	def cancelAll(self, priority: Optional[int] = None):
+		"""Cancels all pending jobs, or only those with the given priority."""
+		with self._condition:
+			for job in self._pendingJobs():
+				if priority is None or job.priority == priority:
+					job.cancel()
+
+	def terminate(self, timeout: float = 5):
+		"""Cancels all jobs and stops the worker thread.
+		@param timeout: number of seconds to wait for a running job to complete
+		"""
+		with self._condition:
+			self._terminated = True
+			for job in self._pendingJobs():
+				job.cancel()
+			self._condition.notify_all()
+		if self._worker:
+			self._worker.join(timeout)
+			self._worker = None
+
+	def _pendingJobs(self) -> List[RecognitionJob]:
+		jobs = list(self._queue)
+		if self._activeJob:
+			jobs.append(self._activeJob)
+		return jobs
+
+	def _sortQueue(self):
+		# sort is stable so jobs of the same priority stay in submission order
+		self._queue.sort(key=lambda job: job.priority)
+
+	def _ensureWorker(self):
+		if self._worker is None or not self._worker.is_alive():
+			self._worker = threading.Thread(target=self._run, name="imageCaptioning recognition worker")
+			self._worker.daemon = True
+			self._worker.start()
+
+	def _nextJob(self) -> Optional[RecognitionJob]:
+		"""Waits for the next job. A cancelled job is returned without being marked as started so that it is
+		dropped. Returns None once terminated."""
+		with self._condition:
+			while True:
+				if self._terminated:
+					return None
+				if self._queue:
+					job = self._queue.pop(0)
+					if job.cancelled:
+						self._forget(job)
+						return job
+					job.started = True
+					self._activeJob = job
+					return job
+				self._condition.wait()
+
+	def _forget(self, job: RecognitionJob):
+		if self._jobsByKey.get(job.key) is job:
+			del self._jobsByKey[job.key]
+
+	def _run(self):
+		"""Worker thread loop."""
+		while True:
+			job = self._nextJob()
+			if job is None:
+				return
+			if not job.started:
+				self._drop(job)
+				continue
+			if job.priority == PRIORITY_INTERACTIVE:
+				_instrumentation.record("queued", time.perf_counter() - job.submitTime)
+			startTime = time.perf_counter()
+			try:
+				result = job.work()
+			except Exception as e:
+				result = e
+			job.runTime = time.perf_counter() - startTime
+			with self._condition:
+				self._activeJob = None
+				self._forget(job)
+				callbacks = job._discardCallbacks if job.cancelled else job._callbacks
+			self._deliver(callbacks, result)
+			job.done.set()
+
+	def _drop(self, job: RecognitionJob):
+		"""Tells the submitters of a job dropped without being run."""
+		job.cancel()
+		self._deliver(job._discardCallbacks, CancelledError())
+		job.done.set()
+
+	def _deliver(self, callbacks: List[Callable[[Any], None]], result):
+		for callback in callbacks:
+			try:
+				callback(result)
+			except Exception:
+				log.error("imageCaptioning: Error handling recognition result", exc_info=True)
+
+
+#: The scheduler shared by all recognitions. Created on first use by L{getScheduler}.
+_scheduler = None
+_schedulerLock = threading.Lock()
+
+def getScheduler() -> RecognitionScheduler:
+	"""Returns the shared recognition scheduler, creating it if required."""
+	global _scheduler
+	with _schedulerLock:
+		if _scheduler is None:
+			_scheduler = RecognitionScheduler()
+		return _scheduler
+
+def terminateScheduler():
+	"""Cancels all recognitions and stops the shared scheduler's worker thread, if any."""
+	global _scheduler
+	with _schedulerLock:
+		if _scheduler is not None:
+			_scheduler.terminate()
+			_scheduler = None
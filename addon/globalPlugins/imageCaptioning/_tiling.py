@@ -0,0 +1,134 @@
+# Image Captioning tiling of large images
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+from typing import List, Sequence, Tuple
+
+#: Images are tiled if they are at least this many times as large as the model input on one side
+_minTilingScale = 4
+#: Each tile covers about this many times the model input on each side
+_tileScale = 2
+#: Maximum number of columns and rows of tiles
+_maxGridSize = 3
+#: Part of a tile that overlaps its neighbours, so that objects on a tile edge are seen whole by one tile
+_overlap = 0.2
+#: Maximum number of tiles captioned per image
+_maxTiles = 6
+#: Tiles with less edge energy than this part of the most detailed tile are not captioned
+_minEnergyShare = 0.25
+#: Number of samples along each side of a tile when measuring its edge energy
+_samplesPerSide = 16
+#: Captions sharing at least this part of their words with an earlier caption are dropped
+_duplicateWordShare = 0.7
+
+#: (left, top, width, height) rectangle in pixels
+Rect = Tuple[int, int, int, int]
+
+
+def shouldTile(width: int, height: int, inputSize: Tuple[int, int]) -> bool:
+	"""@return: True if an image of the given size on screen is large enough to be captioned in tiles"""
+	inputWidth, inputHeight = inputSize
+	return max(width / inputWidth, height / inputHeight) >= _minTilingScale
+
+
+def gridSize(width: int, height: int, inputSize: Tuple[int, int]) -> Tuple[int, int]:
+	"""@return: number of columns and rows of tiles of an image of the given size on screen"""
+	inputWidth, inputHeight = inputSize
+	columns = min(_maxGridSize, max(1, round(width / (inputWidth * _tileScale))))
+	rows = min(_maxGridSize, max(1, round(height / (inputHeight * _tileScale))))
+	return columns, rows
+
+
+def tileRects(width: int, height: int, columns: int, rows: int) -> List[Rect]:
+	"""Splits an image into a grid of overlapping tiles covering the whole image.
+	@return: the tiles, row by row
+	"""
+	tileWidth = width / (columns - (columns - 1) * _overlap)
+	tileHeight = height / (rows - (rows - 1) * _overlap)
+	tiles = []
+	for row in range(rows):
+		top = round(row * tileHeight * (1 - _overlap))
+		bottom = min(height, round(top + tileHeight))
+		for column in range(columns):
+			left = round(column * tileWidth * (1 - _overlap))
+			right = min(width, round(left + tileWidth))
+			tiles.append((left, top, right - left, bottom - top))
+	return tiles
+
+
+def edgeEnergy(pixels, width: int, height: int, rect: Rect) -> float:
+	"""Measures the amount of detail in part of an image as the mean luminance difference between
+	neighbouring samples of a grid. Uniform areas such as backgrounds have no energy.
+	@param pixels: ctypes array or other object exporting the buffer interface holding 32 bit BGRA pixels
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@param rect: part of the image that is measured
+	@return: the edge energy
+	"""
+	data = memoryview(pixels).cast("B")
+	left, top, rectWidth, rectHeight = rect
+	xs = [min(width - 1, left + rectWidth * i // _samplesPerSide) for i in range(_samplesPerSide)]
+	ys = [min(height - 1, top + rectHeight * i // _samplesPerSide) for i in range(_samplesPerSide)]
+	luma = []
+	for y in ys:
+		rowStart = y * width
+		row = []
+		for x in xs:
+			index = (rowStart + x) * 4
+			# ITU-R 601 luma, pixels are stored in BGRA order
+			row.append(data[index] * 114 + data[index + 1] * 587 + data[index + 2] * 299)
+		luma.append(row)
+	total = 0
+	for rowIndex, row in enumerate(luma):
+		total += sum(abs(row[i] - row[i + 1]) for i in range(len(row) - 1))
+		if rowIndex:
+			total += sum(abs(value - above) for value, above in zip(row, luma[rowIndex - 1]))
+	return total / (2 * _samplesPerSide * (_samplesPerSide - 1) * 1000)
+
+
+def selectSalientTiles(pixels, width: int, height: int, tiles: Sequence[Rect]) -> List[int]:
+	"""Keeps the tiles with the most detail, as measured by L{edgeEnergy}, so that backgrounds and empty
+	areas are not captioned.
+	@param pixels: the whole image, see L{edgeEnergy}
+	@param tiles: tiles of the image
+	@return: indexes of the kept tiles, in the order of I{tiles}
+	"""
+	energies = [edgeEnergy(pixels, width, height, tile) for tile in tiles]
+	if not energies or not max(energies):
+		return []
+	threshold = max(energies) * _minEnergyShare
+	ranked = sorted(range(len(tiles)), key=lambda index: energies[index], reverse=True)
+	return sorted(index for index in ranked[:_maxTiles] if energies[index] >= threshold)
+
+
+def regionPosition(rect: Rect, width: int, height: int) -> Tuple[int, int]:
+	"""@return: row and column (0 to 2) of the third of the image holding the centre of a rectangle"""
+	left, top, rectWidth, rectHeight = rect
+	column = min(2, int((left + rectWidth / 2) * 3 / width))
+	row = min(2, int((top + rectHeight / 2) * 3 / height))
+	return row, column
+
+
+def _captionWords(caption: str) -> set:
+	return set(caption.lower().rstrip(".").split())
+
+
+def findDuplicateCaptions(captions: Sequence[str]) -> List[bool]:
+	"""Finds captions that repeat an earlier caption: tiles often see the same object, which would only
+	make the user read the same caption several times.
+	@param captions: captions in presentation order, None for images that could not be captioned
+	@return: for each caption, whether it is a duplicate of an earlier caption
+	"""
+	keptWords = []
+	duplicates = []
+	for caption in captions:
+		if caption is None:
+			duplicates.append(False)
+			continue
+		words = _captionWords(caption)
+		isDuplicate = any(
+			len(words & kept) >= _duplicateWordShare * max(len(words), len(kept), 1) for kept in keptWords
+		)
+		duplicates.append(isDuplicate)
+		if not isDuplicate:
+			keptWords.append(words)
+	return duplicates
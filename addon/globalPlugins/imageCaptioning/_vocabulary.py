@@ -0,0 +1,144 @@
+# Image Captioning vocabulary
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import mmap
+import os
+import struct
+import threading
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, List
+
+#: Special tokens of the vocabulary, they are never part of a caption
+PAD = "<pad>"
+START = "<start>"
+END = "<end>"
+UNKNOWN = "<unk>"
+
+#: Identifies vocabulary files in the binary format written by L{Vocabulary.saveBinary}
+_binaryMagic = b"ICVOCAB1"
+#: Magic, number of words and the ids of the four special tokens (-1 if missing), little endian
+_binaryHeader = struct.Struct("<8sI4i")
+
+
+def isCaptionWord(word: str) -> bool:
+	"""@return: False for special tokens and punctuation that are not spoken as part of a caption"""
+	return "<" not in word and word != "."
+
+
+class Vocabulary():
+	"""Maps the word ids output by the decoder to words. The words are stored as a single UTF-8 buffer indexed
+	by an array of offsets, which takes a fraction of the memory of a list of strings and can be memory
+	mapped from a file in the binary format written by L{saveBinary}, so that loading it is instant.
+	"""
+	def __init__(self, blob, offsets, captionWordMask, specialIds: Iterable[int]):
+		"""Use L{fromTextFile} or L{fromBinaryFile} instead.
+		@param blob: UTF-8 encoded words, one after the other
+		@param offsets: offset of each word in I{blob}, followed by the length of I{blob}
+		@param captionWordMask: one byte per word, 1 if the word can be part of a caption
+		@param specialIds: ids of the pad, start, end and unknown tokens, -1 if missing
+		"""
+		self._blob = blob
+		self._offsets = offsets
+		self._captionWordMask = captionWordMask
+		self.padId, self.startId, self.endId, self.unknownId = specialIds
+		# Keeps the file of a memory mapped vocabulary open
+		self._mmap = None
+
+	@classmethod
+	def fromTextFile(cls, path: str) -> "Vocabulary":
+		"""Reads a vocabulary with one word per line, the line number being the id of the word."""
+		with open(path, "rb") as f:
+			data = f.read()
+		words = [line.strip() for line in data.splitlines()]
+		blob = b"".join(words)
+		offsets = array("I", accumulate([0] + [len(word) for word in words]))
+		captionWordMask = bytes(isCaptionWord(word.decode("utf-8")) for word in words)
+		ids = {word: wordId for wordId, word in enumerate(words) if word.startswith(b"<")}
+		specialIds = [ids.get(token.encode("utf-8"), -1) for token in (PAD, START, END, UNKNOWN)]
+		return cls(blob, offsets, captionWordMask, specialIds)
+
+	@classmethod
+	def fromBinaryFile(cls, path: str) -> "Vocabulary":
+		"""Memory maps a vocabulary written by L{saveBinary}. Raises a L{ValueError} if the file is not a
+		vocabulary."""
+		with open(path, "rb") as f:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		view = memoryview(data)
+		magic, count, *specialIds = _binaryHeader.unpack_from(view)
+		if magic != _binaryMagic:
+			view.release()
+			data.close()
+			raise ValueError(f"imageCaptioning: {path} is not a vocabulary file")
+		maskStart = _binaryHeader.size
+		# offsets are 4 byte aligned by the padding written after the mask
+		offsetsStart = maskStart + count + (-count % 4)
+		blobStart = offsetsStart + 4 * (count + 1)
+		offsets = view[offsetsStart:blobStart].cast("I")
+		vocabulary = cls(view[blobStart:], offsets, view[maskStart:maskStart + count], specialIds)
+		vocabulary._mmap = data
+		return vocabulary
+
+	def saveBinary(self, path: str):
+		"""Writes the vocabulary in a binary format that can be memory mapped by L{fromBinaryFile}.
+		The offsets are written in the byte order of this machine, which is little endian on all the
+		platforms supported by NVDA."""
+		count = len(self)
+		with open(path, "wb") as f:
+			specialIds = (self.padId, self.startId, self.endId, self.unknownId)
+			f.write(_binaryHeader.pack(_binaryMagic, count, *specialIds))
+			f.write(self._captionWordMask)
+			f.write(b"\0" * (-count % 4))
+			f.write(bytes(self._offsets))
+			f.write(self._blob)
+
+	def __len__(self) -> int:
+		return len(self._offsets) - 1
+
+	def __getitem__(self, wordId: int) -> str:
+		return str(self._blob[self._offsets[wordId]:self._offsets[wordId + 1]], "utf-8")
+
+	def isCaptionWord(self, wordId: int) -> bool:
+		"""@return: False for special tokens and punctuation"""
+		return bool(self._captionWordMask[wordId])
+
+	def detokenize(self, wordIds: Iterable[int]) -> List[str]:
+		"""Converts word ids to the words of a caption, in one pass: special tokens and punctuation are
+		skipped and conversion stops at the first end token.
+		@param wordIds: ids output by the decoder
+		@return: the words of the caption
+		"""
+		blob = self._blob
+		offsets = self._offsets
+		mask = self._captionWordMask
+		endId = self.endId
+		words = []
+		for wordId in wordIds:
+			wordId = int(wordId)
+			if wordId == endId:
+				break
+			if mask[wordId]:
+				words.append(str(blob[offsets[wordId]:offsets[wordId + 1]], "utf-8"))
+		return words
+
+
+#: Vocabularies loaded by L{getVocabulary}, by path
+_vocabularies: Dict[str, Vocabulary] = {}
+_vocabulariesLock = threading.Lock()
+
+def getVocabulary(path: str) -> Vocabulary:
+	"""Returns the vocabulary read from a text file, loading it on first use only so that it is shared by all
+	backends. If a binary vocabulary with the same name and the .bin extension is at least as recent as the
+	text file, it is memory mapped instead.
+	@param path: path of the vocabulary text file
+	"""
+	with _vocabulariesLock:
+		vocabulary = _vocabularies.get(path)
+		if vocabulary is None:
+			binaryPath = os.path.splitext(path)[0] + ".bin"
+			if os.path.exists(binaryPath) and os.path.getmtime(binaryPath) >= os.path.getmtime(path):
+				vocabulary = Vocabulary.fromBinaryFile(binaryPath)
+			else:
+				vocabulary = Vocabulary.fromTextFile(path)
+			_vocabularies[path] = vocabulary
+		return vocabulary
@@ -0,0 +1,155 @@
+# Image Captioning continuous captioning of a watched object
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import time
+from typing import Optional
+
+import wx
+import core
+import ui
+from logHandler import log
+from browseMode import BrowseModeTreeInterceptor
+
+from visionEnhancementProviders.imageCaptioning import ImageCaptioning
+from ._capture import captureImage, getViewport
+from ._doImageCaptioning import DoImageCaptioning, isLargeEnough
+from ._frameDifference import captionsDiffer, frameDifference, thumbnail
+from ._imageHash import hashPixels
+from ._resultUI import cacheResult, findCachedResult
+from ._scheduler import PRIORITY_BACKGROUND
+
+
+class RegionWatcher():
+	"""Captions an object, such as a video player, a slideshow or a live dashboard tile, whenever it changes.
+	The object is captured at a regular interval on the main thread and a frame is only captioned if it
+	differs enough from the last captioned frame (see L{_frameDifference}). Frames captured while the previous
+	frame is still being captioned are skipped, so that a slow model never builds a backlog. Captions are
+	looked up in and added to the caption cache, and only captions that differ from the last spoken one are
+	spoken.
+	"""
+	def __init__(self):
+		self._obj = None
+		self._recognizer: Optional[DoImageCaptioning] = None
+		self._timer = None
+		# Thumbnail of the last captioned frame and the last spoken caption
+		self._lastThumbnail: Optional[bytes] = None
+		self._lastCaption = ""
+		# Set while a frame is being captioned
+		self._busy = False
+		# Incremented on each start and stop so that results of an earlier watch are ignored
+		self._generation = 0
+		self._capturedFrames = 0
+		self._skippedFrames = 0
+		self._captionedFrames = 0
+
+	@property
+	def isWatching(self) -> bool:
+		return self._obj is not None
+
+	def start(self, obj):
+		"""Starts watching an object, replacing the watched object if there is one.
+		@param obj: the NVDAObject to watch
+		"""
+		self.stop()
+		self._generation += 1
+		self._obj = obj
+		self._recognizer = DoImageCaptioning(None, time.time())
+		self._lastThumbnail = None
+		self._lastCaption = ""
+		self._busy = False
+		self._capturedFrames = self._skippedFrames = self._captionedFrames = 0
+		self._schedule(0)
+
+	def stop(self):
+		"""Stops watching. A frame that is being captioned is still cached but its caption is not spoken."""
+		if self._timer:
+			self._timer.Stop()
+			self._timer = None
+		if self._obj is None:
+			return
+		self._obj = None
+		self._generation += 1
+		log.debug(
+			f"(imageCaptioning) Stopped watching: {self._capturedFrames} frames captured, "
+			f"{self._captionedFrames} captioned, {self._skippedFrames} skipped while busy"
+		)
+
+	def _schedule(self, delay: float):
+		if self._timer:
+			self._timer.Stop()
+		self._timer = core.callLater(int(delay * 1000), self._step)
+
+	def _step(self):
+		"""Captures the watched object and captions it if it changed. Runs on the main thread."""
+		self._timer = None
+		if self._obj is None:
+			return
+		settings = ImageCaptioning.getSettings()
+		self._schedule(settings.watchInterval)
+		if self._busy and not self._recognizer.isCancelled:
+			# the model has not caught up with the last frame yet
+			self._skippedFrames += 1
+			return
+		self._busy = False
+		try:
+			location = self._obj.location
+		except Exception:
+			location = None
+		if not location:
+			# Translators: Reported when the object watched for changes can no longer be found.
+			ui.message(_("Stopped watching, the object is no longer available"))
+			self.stop()
+			return
+		if not isLargeEnough(location):
+			return
+		obj = self._obj
+		container = obj.treeInterceptor if isinstance(obj.treeInterceptor, BrowseModeTreeInterceptor) else obj
+		# borders are not trimmed so that successive frames cover the same area and can be compared
+		capture = captureImage(self._recognizer, location, getViewport(container))
+		if capture is None:
+			return
+		self._capturedFrames += 1
+		imgInfo, pixels = capture
+		frameThumbnail = thumbnail(pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+		if (
+			self._lastThumbnail is not None
+			and frameDifference(self._lastThumbnail, frameThumbnail) < settings.watchThreshold
+		):
+			return
+		# compared with the last captioned frame rather than the previous one, so that slow changes add up
+		self._lastThumbnail = frameThumbnail
+		imageHash = hashPixels(pixels, imgInfo.recogWidth, imgInfo.recogHeight)
+		cachedResult = findCachedResult(imageHash, pixels, imgInfo)
+		if cachedResult.caption is not None:
+			self._present(cachedResult.caption)
+			return
+		self._recognizer.perceptualHash = cachedResult.perceptualHash
+		self._busy = True
+		self._captionedFrames += 1
+		generation = self._generation
+		self._recognizer.recognize(
+			imageHash, pixels, imgInfo,
+			lambda result: self._onResult(result, generation),
+			onDiscardedResult=cacheResult,
+			priority=PRIORITY_BACKGROUND,
+		)
+
+	def _onResult(self, result, generation: int):
+		"""Caches the caption of a frame and presents it on the main thread. Runs on the recognition worker
+		thread."""
+		cacheResult(result)
+		wx.CallAfter(self._presentResult, result, generation)
+
+	def _presentResult(self, result, generation: int):
+		if generation != self._generation:
+			return
+		self._busy = False
+		if isinstance(result, Exception):
+			log.error("imageCaptioning: Could not caption watched object", exc_info=result)
+			return
+		self._present(result.caption)
+
+	def _present(self, caption: str):
+		if captionsDiffer(self._lastCaption, caption):
+			self._lastCaption = caption
+			ui.message(caption)
@@ -1,12 +1,59 @@
+from collections import OrderedDict
 from autoSettingsUtils.autoSettings import SupportedSettingType
+from autoSettingsUtils.utils import StringParameterInfo
 from vision import providerBase
 import driverHandler
 
 
 class ImageCaptioningSettings(providerBase.VisionEnhancementProviderSettings):
 	"""Class that defines the settings for the visionEnhancementProvider"""
-	# only setting we use if is non-graphic elements must be filtered or not.
+	# should non-graphic elements be filtered or not.
 	filterNonGraphicElements = True
+	# whether images are captured at a size derived from the model input size and their borders trimmed
+	captureAtModelSize = True
+	# whether the most detailed regions of large images are captioned separately
+	tileLargeImages = False
+	# bounds of the caption cache and whether it is kept on disk across NVDA restarts.
+	cacheMaxEntries = 100
+	cacheMaxSizeKB = 1024
+	persistCache = True
+	# whether captions are also looked up in the caption cache bundles of the bundles folder
+	useCacheBundles = True
+	# whether captions of visually identical images are reused and how many bits of their 64 bit perceptual
+	# hashes may differ.
+	matchSimilarImages = False
+	similarImageThreshold = 4
+	# background captioning of the visible images of browse mode documents
+	prefetchImages = False
+	prefetchMaxImages = 10
+	prefetchCpuShare = 25
+	# interval in seconds at which a watched object is captured and how much it must change, in percent, to
+	# be captioned again
+	watchInterval = 2
+	watchThreshold = 5
+	# whether the model is loaded in the background after NVDA starts instead of on first use
+	warmUpModel = False
+	# minutes without caption request after which the model is unloaded, 0 to keep it loaded
+	unloadIdleMinutes = 10
+	# backend running the model and the session options of the onnxruntime backend
+	backend = "dll"
+	# whether the model runs in a separate Python process rather than in NVDA
+	isolateInference = False
+	intraOpThreads = 0
+	interOpThreads = 0
+	optimizationLevel = 3
+	parallelExecution = False
+	# number of hypotheses kept by beam search, 1 for greedy decoding
+	beamWidth = 1
+	# whether captions are spoken while they are generated
+	streamCaptions = True
+	# whether repeated presses of the gesture present a more detailed caption and alternative captions
+	describeMoreOnRepeat = True
+	# precision of the models, "auto" selects the fastest installed variant
+	modelVariant = "fp32"
+	# whether the duration of each recognition stage is measured and exported to a JSON lines file
+	collectTimings = False
+	exportTimings = False
 
 	@classmethod
 	def getId(cls) -> str:
@@ -16,13 +63,201 @@ class ImageCaptioningSettings(providerBase.VisionEnhancementProviderSettings):
 	def getDisplayName(cls) -> str:
 		return _("Image captioning add-on")
 
+	def _get_availableBackends(self):
+		"""Backends listed in the backend setting. Imported here to not load the backends at NVDA startup."""
+		from globalPlugins.imageCaptioning._sayLookTell import getAvailableBackends
+		names = {
+			"dll": "ImageCaptioning DLL (loads the model for every caption)",
+			"onnxruntime": "ONNX Runtime (keeps the model loaded)",
+		}
+		return OrderedDict(
+			(name, StringParameterInfo(name, names.get(name, name))) for name in getAvailableBackends()
+		)
+
+	def _get_availableModelVariants(self):
+		"""Model variants listed in the model variant setting, only the installed variants are listed."""
+		from globalPlugins.imageCaptioning._captioningBackend import DATA_DIR
+		from globalPlugins.imageCaptioning._modelVariants import AUTO, availableVariants
+		names = {
+			AUTO: "automatic (fastest)",
+			"fp32": "full precision",
+			"fp16": "half precision weights (smaller download, same speed)",
+			"int8": "8 bit quantized",
+		}
+		return OrderedDict(
+			(variant, StringParameterInfo(variant, names[variant]))
+			for variant in [AUTO] + availableVariants(DATA_DIR)
+		)
+
 	def _get_supportedSettings(self) -> SupportedSettingType:
 		settings = [
 			driverHandler.BooleanDriverSetting(
 				"filterNonGraphicElements",
 				"filter non-graphic elements",
 				defaultVal=True
-			)
+			),
+			driverHandler.BooleanDriverSetting(
+				"captureAtModelSize",
+				"capture images at the size used by the model and trim their borders",
+				defaultVal=True
+			),
+			driverHandler.BooleanDriverSetting(
+				"tileLargeImages",
+				"also caption the most detailed regions of large images",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"cacheMaxEntries",
+				"maximum number of cached captions",
+				defaultVal=100,
+				minVal=10,
+				maxVal=10000,
+				minStep=10,
+			),
+			driverHandler.NumericDriverSetting(
+				"cacheMaxSizeKB",
+				"maximum caption cache size in kilobytes",
+				defaultVal=1024,
+				minVal=64,
+				maxVal=65536,
+				minStep=64,
+			),
+			driverHandler.BooleanDriverSetting(
+				"persistCache",
+				"keep cached captions after restarting NVDA",
+				defaultVal=True
+			),
+			driverHandler.BooleanDriverSetting(
+				"useCacheBundles",
+				"use captions of the caption cache bundles in the bundles folder",
+				defaultVal=True
+			),
+			driverHandler.BooleanDriverSetting(
+				"matchSimilarImages",
+				"reuse captions of similar images",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"similarImageThreshold",
+				"similar image threshold",
+				defaultVal=4,
+				minVal=1,
+				maxVal=16,
+			),
+			driverHandler.BooleanDriverSetting(
+				"prefetchImages",
+				"caption visible images of documents in the background",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"prefetchMaxImages",
+				"maximum number of images captioned in the background per document",
+				defaultVal=10,
+				minVal=1,
+				maxVal=50,
+			),
+			driverHandler.NumericDriverSetting(
+				"prefetchCpuShare",
+				"percentage of time spent captioning in the background",
+				defaultVal=25,
+				minVal=5,
+				maxVal=100,
+				minStep=5,
+			),
+			driverHandler.NumericDriverSetting(
+				"watchInterval",
+				"seconds between captures of a watched object",
+				defaultVal=2,
+				minVal=1,
+				maxVal=60,
+			),
+			driverHandler.NumericDriverSetting(
+				"watchThreshold",
+				"percentage a watched object must change before it is captioned again",
+				defaultVal=5,
+				minVal=1,
+				maxVal=50,
+			),
+			driverHandler.BooleanDriverSetting(
+				"warmUpModel",
+				"load the captioning model in the background after NVDA starts",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"unloadIdleMinutes",
+				"minutes of inactivity before the captioning model is unloaded (0 to keep it loaded)",
+				defaultVal=10,
+				minVal=0,
+				maxVal=240,
+			),
+			driverHandler.DriverSetting(
+				"backend",
+				"captioning backend",
+				defaultVal="dll"
+			),
+			driverHandler.BooleanDriverSetting(
+				"isolateInference",
+				"run the model in a separate process (requires Python)",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"intraOpThreads",
+				"ONNX Runtime threads per operator (0 for automatic)",
+				defaultVal=0,
+				minVal=0,
+				maxVal=32,
+			),
+			driverHandler.NumericDriverSetting(
+				"interOpThreads",
+				"ONNX Runtime threads for parallel operators (0 for automatic)",
+				defaultVal=0,
+				minVal=0,
+				maxVal=32,
+			),
+			driverHandler.NumericDriverSetting(
+				"optimizationLevel",
+				"ONNX Runtime graph optimization level",
+				defaultVal=3,
+				minVal=0,
+				maxVal=3,
+			),
+			driverHandler.BooleanDriverSetting(
+				"parallelExecution",
+				"ONNX Runtime parallel execution",
+				defaultVal=False
+			),
+			driverHandler.NumericDriverSetting(
+				"beamWidth",
+				"beam width (1 for greedy decoding)",
+				defaultVal=1,
+				minVal=1,
+				maxVal=5,
+			),
+			driverHandler.BooleanDriverSetting(
+				"streamCaptions",
+				"speak captions while they are generated",
+				defaultVal=True
+			),
+			driverHandler.BooleanDriverSetting(
+				"describeMoreOnRepeat",
+				"describe images in more detail when the gesture is pressed repeatedly",
+				defaultVal=True
+			),
+			driverHandler.DriverSetting(
+				"modelVariant",
+				"model variant",
+				defaultVal="fp32"
+			),
+			driverHandler.BooleanDriverSetting(
+				"collectTimings",
+				"measure how long each stage of image captioning takes",
+				defaultVal=False
+			),
+			driverHandler.BooleanDriverSetting(
+				"exportTimings",
+				"write the measured timings to timings.jsonl in the NVDA configuration",
+				defaultVal=False
+			),
 		]
 		return settings
 
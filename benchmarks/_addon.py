@@ -0,0 +1,57 @@
+# Image Captioning benchmark helpers
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Makes the add-on modules that do not depend on NVDA importable outside of NVDA.
+The add-on package is registered without running its __init__ module, which needs NVDA, so that modules
+such as C{imageCaptioning._imageHash} can be imported by the benchmarks.
+"""
+
+import os
+import sys
+import types
+from ctypes import Structure, c_ubyte
+
+ADDON_PACKAGE_DIR = os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, "addon", "globalPlugins", "imageCaptioning"
+)
+ADDON_PACKAGE_DIR = os.path.normpath(ADDON_PACKAGE_DIR)
+
+
+def registerAddonPackage() -> types.ModuleType:
+	"""Registers the add-on package as C{imageCaptioning} without importing its __init__ module.
+	@return: the package module
+	"""
+	package = sys.modules.get("imageCaptioning")
+	if package is None:
+		package = types.ModuleType("imageCaptioning")
+		package.__path__ = [ADDON_PACKAGE_DIR]
+		sys.modules["imageCaptioning"] = package
+	return package
+
+
+class RGBQUAD(Structure):
+	"""Same layout as the RGBQUAD structure used by NVDA's screenBitmap module."""
+	_fields_ = [
+		("rgbBlue", c_ubyte),
+		("rgbGreen", c_ubyte),
+		("rgbRed", c_ubyte),
+		("rgbReserved", c_ubyte),
+	]
+
+
+def makePixels(width: int, height: int, seed: int = 0):
+	"""Creates a 2D RGBQUAD array like the one returned by C{screenBitmap.ScreenBitmap.captureImage}, filled
+	with pseudo random pixels.
+	@param width: width of the image in pixels
+	@param height: height of the image in pixels
+	@param seed: seed of the pseudo random pixels
+	@return: the pixels
+	"""
+	pixels = ((RGBQUAD * width) * height)()
+	data = memoryview(pixels).cast("B")
+	# repeat a cheap pseudo random pattern, generating random bytes for large images is too slow
+	pattern = bytearray((seed * 31 + i * 131 + (i >> 8) * 7) & 0xFF for i in range(65536))
+	for offset in range(0, len(data), len(pattern)):
+		chunk = min(len(pattern), len(data) - offset)
+		data[offset:offset + chunk] = pattern[:chunk]
+	return pixels
@@ -0,0 +1,92 @@
+# Image Captioning fake captioning backend
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""A captioning backend that simulates the latency of the model instead of running it, so that the rest of
+the recognition pipeline can be benchmarked without the DLL or the model files.
+"""
+
+import random
+import time
+import zlib
+
+from _addon import registerAddonPackage
+
+registerAddonPackage()
+from imageCaptioning import _instrumentation, _preprocess  # noqa: E402
+from imageCaptioning._captioningBackend import CaptioningBackend  # noqa: E402
+
+#: Words the fake captions are made of
+_words = ("a", "man", "woman", "dog", "cat", "sitting", "on", "table", "with", "bench", "of", "street", "red")
+
+
+class FakeCaptioning(CaptioningBackend):
+	"""Sleeps for a configurable time instead of captioning images. Captions are derived from a checksum of
+	the input, so identical images get identical captions."""
+	name = "fake"
+
+	def __init__(
+			self,
+			latency: float = 0.2,
+			jitter: float = 0.0,
+			decoderShare: float = 0.5,
+			loadTime: float = 0.0,
+			tensorInput: bool = True,
+			seed: int = 0,
+	):
+		"""
+		@param latency: mean number of seconds taken by a caption
+		@param jitter: maximum number of seconds randomly added to or removed from the latency
+		@param decoderShare: part of the latency spent in the decoder, the rest is spent in the encoder
+		@param loadTime: number of seconds taken by L{initialize}
+		@param tensorInput: whether the backend accepts preprocessed images, if NumPy is installed
+		@param seed: seed of the random jitter
+		"""
+		super().__init__()
+		self.latency = latency
+		self.jitter = jitter
+		self.decoderShare = decoderShare
+		self.loadTime = loadTime
+		self.tensorInput = tensorInput
+		self._random = random.Random(seed)
+		self._initialized = False
+
+	@property
+	def isInitialized(self) -> bool:
+		return self._initialized
+
+	@property
+	def supportsPixelInput(self) -> bool:
+		return True
+
+	@property
+	def supportsTensorInput(self) -> bool:
+		return self.tensorInput and _preprocess.isAvailable()
+
+	def initialize(self):
+		with self._lock:
+			if not self._initialized:
+				time.sleep(self.loadTime)
+				self._initialized = True
+
+	def terminate(self):
+		with self._lock:
+			self._initialized = False
+
+	def _caption(self, data, onWords=None) -> str:
+		with self._lock:
+			latency = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+			with _instrumentation.stage("encoder"):
+				time.sleep(latency * (1 - self.decoderShare))
+			checksum = zlib.crc32(data)
+			words = [_words[(checksum >> shift) % len(_words)] for shift in range(0, 24, 3)]
+			with _instrumentation.stage("decoder"):
+				time.sleep(latency * self.decoderShare)
+			if onWords:
+				onWords(words)
+			return self._captionFromWords(words)
+
+	def getCaptionFromPixels(self, pixels, width: int, height: int, stride: int = None, onWords=None) -> str:
+		return self._caption(memoryview(pixels).cast("B"), onWords)
+
+	def getCaptionFromTensor(self, tensor, onWords=None) -> str:
+		return self._caption(tensor.tobytes(), onWords)
@@ -0,0 +1,57 @@
+# Image Captioning decoding benchmark
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Measures the cost of greedy decoding and of beam search of several widths with the incremental decoder of
+the ONNX Runtime backend. Requires NumPy, onnxruntime and a data directory holding encoder.onnx,
+decoder_step.onnx, embeddings.npy and vocab.txt.
+Usage: python benchmarks/benchDecoding.py --dataDir DIR [--repeat N] [--beamWidths 1,2,3,5]
+"""
+
+import argparse
+import statistics
+
+from _addon import registerAddonPackage, makePixels
+
+registerAddonPackage()
+from imageCaptioning._onnxBackend import OnnxRuntimeCaptioning  # noqa: E402
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--dataDir", required=True, help="directory holding the model files")
+	parser.add_argument("--repeat", type=int, default=10, help="number of captions generated per beam width")
+	parser.add_argument("--beamWidths", default="1,2,3,5", help="comma separated beam widths")
+	args = parser.parse_args()
+	if not OnnxRuntimeCaptioning.isAvailable():
+		raise SystemExit("NumPy and onnxruntime are required by the ONNX Runtime backend")
+
+	pixels = makePixels(640, 480)
+	print(
+		"beam".ljust(6) + "steps".rjust(8) + "step p50".rjust(12) + "step max".rjust(12)
+		+ "decoding".rjust(12) + "   (ms)"
+	)
+	for beamWidth in (int(width) for width in args.beamWidths.split(",")):
+		backend = OnnxRuntimeCaptioning(intraOpThreads=1, beamWidth=beamWidth, dataDir=args.dataDir)
+		backend.initialize()
+		if not backend.hasIncrementalDecoder:
+			raise SystemExit("The data directory does not hold an incremental decoder")
+		# warm up the sessions
+		backend.getCaptionFromPixels(pixels, 640, 480)
+		stepTimes = []
+		totals = []
+		for _repeat in range(args.repeat):
+			backend.getCaptionFromPixels(pixels, 640, 480)
+			stepTimes.extend(backend.lastDecoding.stepTimes)
+			totals.append(sum(backend.lastDecoding.stepTimes))
+		print(
+			f"{beamWidth}".ljust(6)
+			+ f"{len(stepTimes) / args.repeat:8.1f}"
+			+ f"{statistics.median(stepTimes) * 1000:12.3f}"
+			+ f"{max(stepTimes) * 1000:12.3f}"
+			+ f"{statistics.mean(totals) * 1000:12.3f}"
+		)
+		backend.terminate()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,54 @@
+# Image Captioning image hashing micro-benchmark
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Measures the time taken to hash captured images of common sizes with every available hash function.
+Usage: python benchmarks/benchImageHash.py [--repeat N] [--legacy]
+"""
+
+import argparse
+import timeit
+
+from _addon import registerAddonPackage, makePixels
+
+registerAddonPackage()
+from imageCaptioning import _imageHash  # noqa: E402
+
+#: (width, height) of the benchmarked images
+SIZES = [(128, 128), (640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+
+
+def legacyHash(pixels, width, height):
+	"""The per pixel hash previously used by recognizeNavigatorObject, kept for comparison."""
+	rowHashes = []
+	for i in range(width):
+		row = []
+		for j in range(height):
+			row.append(pixels[j][i].rgbRed)
+		rowHashes.append(hash(str(row)))
+	return hash(str(rowHashes))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--repeat", type=int, default=20, help="number of times each image is hashed")
+	parser.add_argument("--legacy", action="store_true", help="also time the old per pixel hash")
+	args = parser.parse_args()
+
+	names = sorted(_imageHash._hashFunctions)
+	columns = names + (["legacy"] if args.legacy else [])
+	print("size".ljust(12) + "".join(name.rjust(12) for name in columns) + "   (ms per image)")
+	for width, height in SIZES:
+		pixels = makePixels(width, height)
+		timings = []
+		for name in names:
+			_imageHash.setHashFunction(name)
+			seconds = timeit.timeit(lambda: _imageHash.hashPixels(pixels, width, height), number=args.repeat)
+			timings.append(seconds / args.repeat * 1000)
+		if args.legacy:
+			seconds = timeit.timeit(lambda: legacyHash(pixels, width, height), number=1)
+			timings.append(seconds * 1000)
+		print(f"{width}x{height}".ljust(12) + "".join(f"{timing:12.3f}" for timing in timings))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,287 @@
+# Image Captioning recognition pipeline benchmark
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Replays a corpus of captured images through the recognition pipeline of the add-on outside of NVDA:
+hashing, caption cache and similar image lookups, preprocessing and the recognition scheduler, with either a
+fake backend simulating the latency of the model or the ONNX Runtime backend.
+The corpus is a directory of .npy files holding (height, width, 4) uint8 BGRA arrays, as returned by
+C{numpy.save} on a capture, and of image files if Pillow is installed. Without a corpus, synthetic images are
+generated, some of which are exact or near duplicates of earlier images so that the cache is exercised.
+By default each image is submitted once the previous one was captioned, like a user requesting captions one
+after the other. With --interval, images are submitted at a fixed rate regardless of the results, which
+exercises the queue of the scheduler.
+Throughput, latency percentiles and the percentiles of each stage are printed as JSON, in milliseconds.
+Usage: python benchmarks/benchPipeline.py [--corpus DIR] [--backend fake|onnxruntime [--isolated]] [--output PATH]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from _addon import registerAddonPackage, makePixels
+
+registerAddonPackage()
+from imageCaptioning import _instrumentation, _preprocess  # noqa: E402
+from imageCaptioning._captionCache import CaptionCache  # noqa: E402
+from imageCaptioning._captioningBackend import DATA_DIR  # noqa: E402
+from imageCaptioning._imageHash import hashPixels  # noqa: E402
+from imageCaptioning._perceptualHash import dHash  # noqa: E402
+from imageCaptioning._scheduler import RecognitionJob, RecognitionScheduler  # noqa: E402
+from _fakeBackend import FakeCaptioning  # noqa: E402
+
+#: Extensions of the image files of a corpus, read with Pillow
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png")
+#: (width, height) of the synthetic images, in turn
+SYNTHETIC_SIZES = [(640, 480), (300, 200), (1280, 720), (128, 128)]
+
+
+def loadCorpus(directory: str):
+	"""@return: (name, BGRA pixels, width, height) tuples, in file name order"""
+	images = []
+	for name in sorted(os.listdir(directory)):
+		path = os.path.join(directory, name)
+		if name.lower().endswith(".npy"):
+			import numpy
+			array = numpy.load(path)
+			if array.ndim != 3 or array.shape[2] != 4 or array.dtype != numpy.uint8:
+				raise SystemExit(f"{name} is not a (height, width, 4) uint8 array")
+			images.append((name, numpy.ascontiguousarray(array).tobytes(), array.shape[1], array.shape[0]))
+		elif name.lower().endswith(IMAGE_EXTENSIONS):
+			from PIL import Image
+			with Image.open(path) as image:
+				image = image.convert("RGBA")
+				red, green, blue, alpha = image.split()
+				pixels = Image.merge("RGBA", (blue, green, red, alpha)).tobytes()
+				images.append((name, pixels, image.width, image.height))
+	return images
+
+
+def syntheticCorpus(count: int, duplicates: float, nearDuplicates: float, seed: int = 0):
+	"""Generates a corpus of pseudo random images.
+	@param count: number of images
+	@param duplicates: part of the images that are copies of an earlier image
+	@param nearDuplicates: part of the images that are copies of an earlier image with a few changed pixels
+	@return: (name, BGRA pixels, width, height) tuples
+	"""
+	rand = random.Random(seed)
+	images = []
+	for index in range(count):
+		draw = rand.random()
+		if images and draw < duplicates:
+			_name, pixels, width, height = rand.choice(images)
+		elif images and draw < duplicates + nearDuplicates:
+			_name, pixels, width, height = rand.choice(images)
+			pixels = bytearray(pixels)
+			# a blinking caret
+			for offset in range(0, min(len(pixels), 4 * width * 10), 4 * width):
+				pixels[offset:offset + 4] = b"\0\0\0\xff"
+			pixels = bytes(pixels)
+		else:
+			width, height = SYNTHETIC_SIZES[index % len(SYNTHETIC_SIZES)]
+			pixels = bytes(makePixels(width, height, seed=index))
+		images.append((f"synthetic{index}", pixels, width, height))
+	return images
+
+
+def createBackend(args):
+	if args.backend == "fake":
+		return FakeCaptioning(
+			latency=args.latency / 1000,
+			jitter=args.jitter / 1000,
+			tensorInput=not args.pixelInput,
+			seed=args.seed,
+		)
+	from imageCaptioning._onnxBackend import OnnxRuntimeCaptioning
+	if not OnnxRuntimeCaptioning.isAvailable():
+		raise SystemExit("NumPy and onnxruntime are required by the ONNX Runtime backend")
+	options = {"beamWidth": args.beamWidth, "modelVariant": args.modelVariant, "dataDir": args.dataDir}
+	if args.isolated:
+		from imageCaptioning._remoteBackend import RemoteCaptioning
+		return RemoteCaptioning(OnnxRuntimeCaptioning.name, options)
+	return OnnxRuntimeCaptioning(**options)
+
+
+def getCaption(backend, pixels, width: int, height: int) -> str:
+	"""Same input selection as C{_doImageCaptioning._getCaption}, without the temporary file fallback."""
+	if _preprocess.isAvailable() and backend.supportsTensorInput:
+		with _instrumentation.stage("handoff"):
+			tensor = _preprocess.preprocessPixels(pixels, width, height, inputSize=backend.inputSize)
+		return backend.getCaptionFromTensor(tensor)
+	return backend.getCaptionFromPixels(pixels, width, height)
+
+
+class PipelineRun():
+	"""Replays images through the pipeline and collects the outcome of each request."""
+	def __init__(self, backend, cache: CaptionCache, scheduler: RecognitionScheduler, similarThreshold: int):
+		self.backend = backend
+		self.cache = cache
+		self.scheduler = scheduler
+		self.similarThreshold = similarThreshold
+		#: Seconds from the request to the caption, of requests that got a caption
+		self.latencies = _instrumentation.Histogram(None)
+		self.cacheHits = 0
+		self.similarHits = 0
+		self.errors = 0
+		self._lock = threading.Lock()
+
+	def request(self, pixels, width: int, height: int) -> RecognitionJob:
+		"""Requests the caption of an image like C{recognizeNavigatorObject}.
+		@return: the job that delivers the caption, or None if it was found in the cache
+		"""
+		startTime = time.perf_counter()
+		with _instrumentation.stage("hashing"):
+			imageHash = hashPixels(pixels, width, height)
+		with _instrumentation.stage("cacheLookup"):
+			caption = self.cache.get(imageHash)
+			perceptualHash = None
+			if caption is None and self.similarThreshold >= 0:
+				perceptualHash = dHash(pixels, width, height)
+				similarHash = None
+				if perceptualHash is not None:
+					similarHash = self.cache.findSimilar(perceptualHash, self.similarThreshold)
+				if similarHash is not None:
+					caption = self.cache.get(similarHash)
+					self.similarHits += caption is not None
+		if caption is not None:
+			self._onCaption(startTime)
+			self.cacheHits += 1
+			return None
+
+		def cacheResult(result):
+			if not isinstance(result, Exception):
+				self.cache.put(imageHash, result, perceptualHash)
+
+		def onResult(result):
+			if isinstance(result, Exception):
+				with self._lock:
+					self.errors += 1
+				return
+			cacheResult(result)
+			self._onCaption(startTime)
+
+		job = RecognitionJob(
+			imageHash,
+			lambda: getCaption(self.backend, pixels, width, height),
+			onResult,
+			onDiscardedResult=cacheResult,
+		)
+		return self.scheduler.submit(job, latestWins=False)
+
+	def _onCaption(self, startTime: float):
+		seconds = time.perf_counter() - startTime
+		_instrumentation.record("total", seconds)
+		with self._lock:
+			self.latencies.add(seconds)
+
+
+def milliseconds(summary: dict) -> dict:
+	return {key: value if key == "count" else round(value * 1000, 3) for key, value in summary.items()}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--corpus", help="directory holding the captured images, synthetic images if omitted")
+	parser.add_argument("--images", type=int, default=100, help="number of synthetic images")
+	parser.add_argument("--duplicates", type=float, default=0.2, help="part of synthetic exact duplicates")
+	parser.add_argument("--nearDuplicates", type=float, default=0.1, help="part of synthetic near duplicates")
+	parser.add_argument("--passes", type=int, default=1, help="number of times the corpus is replayed")
+	parser.add_argument("--backend", choices=("fake", "onnxruntime"), default="fake")
+	parser.add_argument("--latency", type=float, default=200, help="fake backend latency in ms")
+	parser.add_argument("--jitter", type=float, default=0, help="fake backend latency jitter in ms")
+	parser.add_argument(
+		"--pixelInput", action="store_true", help="hand pixels rather than tensors to the fake backend"
+	)
+	parser.add_argument("--dataDir", default=DATA_DIR, help="directory holding the model files")
+	parser.add_argument("--modelVariant", default="fp32", help="model variant of the ONNX Runtime backend")
+	parser.add_argument("--beamWidth", type=int, default=1, help="beam width of the ONNX Runtime backend")
+	parser.add_argument(
+		"--isolated", action="store_true", help="run the ONNX Runtime backend in a separate process"
+	)
+	parser.add_argument("--cacheEntries", type=int, default=100, help="caption cache size, 0 to disable it")
+	parser.add_argument(
+		"--similarThreshold", type=int, default=4,
+		help="maximum hash distance of similar images, -1 to disable similar image lookups",
+	)
+	parser.add_argument(
+		"--interval", type=float,
+		help="submit an image every INTERVAL ms instead of waiting for the previous caption",
+	)
+	parser.add_argument("--maxQueued", type=int, default=8, help="size of the scheduler queue")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--output", help="write the JSON results to this file instead of the standard output")
+	args = parser.parse_args()
+
+	if args.corpus:
+		images = loadCorpus(args.corpus)
+		if not images:
+			raise SystemExit("No images found")
+	else:
+		images = syntheticCorpus(args.images, args.duplicates, args.nearDuplicates, args.seed)
+	backend = createBackend(args)
+	# load the model and run a first inference outside of the measurements, like _doImageCaptioning.warmUp
+	backend.initialize()
+	width, height = backend.inputSize
+	getCaption(backend, bytes(width * height * 4), width, height)
+
+	_instrumentation.configure(True)
+	_instrumentation.reset(None)
+	cache = CaptionCache(maxEntries=args.cacheEntries, maxBytes=args.cacheEntries * 1024)
+	scheduler = RecognitionScheduler(maxQueued=args.maxQueued)
+	run = PipelineRun(backend, cache, scheduler, args.similarThreshold)
+	jobs = []
+	startTime = time.perf_counter()
+	for index, (_name, pixels, width, height) in enumerate(images * args.passes):
+		if args.interval is not None:
+			delay = startTime + index * args.interval / 1000 - time.perf_counter()
+			if delay > 0:
+				time.sleep(delay)
+		job = run.request(pixels, width, height)
+		if job is None:
+			continue
+		if args.interval is None:
+			job.done.wait()
+		jobs.append(job)
+	for job in jobs:
+		job.done.wait()
+	wallTime = time.perf_counter() - startTime
+	scheduler.terminate()
+	backend.terminate()
+	# requests merged into a pending job with the same key appear once per request
+	dropped = sum(1 for job in jobs if job.cancelled)
+
+	requests = len(images) * args.passes
+	p50, p95, p99 = run.latencies.percentiles()
+	results = {
+		"backend": args.backend,
+		"modelVariant": args.modelVariant if args.backend == "onnxruntime" else None,
+		"isolated": args.isolated,
+		"corpus": args.corpus or "synthetic",
+		"images": len(images),
+		"requests": requests,
+		"captioned": run.latencies.count,
+		"cacheHits": run.cacheHits,
+		"similarHits": run.similarHits,
+		"dropped": dropped,
+		"errors": run.errors,
+		"seconds": round(wallTime, 3),
+		"throughput": round(run.latencies.count / wallTime, 3),
+		"latency": milliseconds({
+			"count": run.latencies.count, "p50": p50, "p95": p95, "p99": p99, "max": run.latencies.maximum,
+		}),
+		"stages": {name: milliseconds(summary) for name, summary in _instrumentation.summary().items()},
+	}
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as f:
+			json.dump(results, f, indent="\t")
+		print(_instrumentation.report())
+	else:
+		json.dump(results, sys.stdout, indent="\t")
+		print()
+
+
+if __name__ == "__main__":
+	main()
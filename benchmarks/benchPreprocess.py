@@ -0,0 +1,37 @@
+# Image Captioning preprocessing micro-benchmark
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Measures the time taken to turn captured images of common sizes into encoder input tensors.
+Requires NumPy. Usage: python benchmarks/benchPreprocess.py [--repeat N]
+"""
+
+import argparse
+import timeit
+
+from _addon import registerAddonPackage, makePixels
+
+registerAddonPackage()
+from imageCaptioning import _preprocess  # noqa: E402
+
+#: (width, height) of the benchmarked images
+SIZES = [(128, 128), (640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--repeat", type=int, default=20, help="number of times each image is preprocessed")
+	args = parser.parse_args()
+	if not _preprocess.isAvailable():
+		raise SystemExit("NumPy is required by the preprocessing stage")
+
+	print("size".ljust(12) + "first".rjust(12) + "warm".rjust(12) + "   (ms per image)")
+	for width, height in SIZES:
+		pixels = makePixels(width, height)
+		# the first call includes building the resize matrices for this size
+		first = timeit.timeit(lambda: _preprocess.preprocessPixels(pixels, width, height), number=1)
+		warm = timeit.timeit(lambda: _preprocess.preprocessPixels(pixels, width, height), number=args.repeat)
+		print(f"{width}x{height}".ljust(12) + f"{first * 1000:12.3f}" + f"{warm / args.repeat * 1000:12.3f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,61 @@
+# Image Captioning import time benchmark
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Measures the time taken to import the add-on modules that do not depend on NVDA, each in a fresh
+interpreter so that nothing is cached, and whether importing them also imports NumPy or onnxruntime.
+The time NVDA takes to load the add-on itself is written to the NVDA log at debug level
+("Add-on loaded in ... ms"), as is the time taken to import the captioning modules on first use.
+Usage: python benchmarks/benchStartup.py [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+#: Modules whose import time is measured
+MODULES = [
+	"_scheduler",
+	"_imageHash",
+	"_captionCache",
+	"_vocabulary",
+	"_captioningBackend",
+	"_onnxBackend",
+	"_sayLookTell",
+]
+
+_measureScript = """
+import json, sys, time
+sys.path.insert(0, {benchmarksDir!r})
+from _addon import registerAddonPackage
+registerAddonPackage()
+startTime = time.perf_counter()
+import imageCaptioning.{module}
+print(json.dumps([time.perf_counter() - startTime, "numpy" in sys.modules, "onnxruntime" in sys.modules]))
+"""
+
+
+def measure(module: str):
+	"""@return: import time in seconds, and whether NumPy and onnxruntime were imported"""
+	script = _measureScript.format(benchmarksDir=os.path.dirname(os.path.abspath(__file__)), module=module)
+	output = subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE).stdout
+	return json.loads(output)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--repeat", type=int, default=5, help="number of imports per module")
+	args = parser.parse_args()
+
+	print("module".ljust(20) + "median ms".rjust(12) + "numpy".rjust(8) + "onnxruntime".rjust(13))
+	for module in MODULES:
+		results = [measure(module) for _repeat in range(args.repeat)]
+		_seconds, numpy, onnxruntime = results[0]
+		median = statistics.median(seconds for seconds, _numpy, _onnxruntime in results)
+		print(module.ljust(20) + f"{median * 1000:12.1f}" + f"{str(numpy):>8}" + f"{str(onnxruntime):>13}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,115 @@
+# Image Captioning model variant comparison
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Captions a fixed set of images with every installed model variant of the ONNX Runtime backend, to judge
+the speed and accuracy trade-off of the reduced precision variants produced by tools/convertModels.py.
+Captions of each variant are compared with those of the fp32 models: exact matches and word overlap (F1 of
+the words of both captions). Requires NumPy, onnxruntime and Pillow.
+Usage: python benchmarks/compareVariants.py --images DIR [--dataDir DIR] [--verbose]
+"""
+
+import argparse
+import os
+import statistics
+import time
+from collections import Counter
+
+from PIL import Image
+
+from _addon import registerAddonPackage
+
+registerAddonPackage()
+from imageCaptioning._captioningBackend import DATA_DIR  # noqa: E402
+from imageCaptioning._modelVariants import availableVariants, modelPath  # noqa: E402
+from imageCaptioning._onnxBackend import OnnxRuntimeCaptioning  # noqa: E402
+
+#: Extensions of the image files that are captioned
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png")
+
+
+def loadImages(directory: str):
+	"""@return: (name, BGRA pixels, width, height) tuples, in file name order"""
+	images = []
+	for name in sorted(os.listdir(directory)):
+		if not name.lower().endswith(IMAGE_EXTENSIONS):
+			continue
+		with Image.open(os.path.join(directory, name)) as image:
+			image = image.convert("RGBA")
+			red, green, blue, alpha = image.split()
+			pixels = Image.merge("RGBA", (blue, green, red, alpha)).tobytes()
+			images.append((name, pixels, image.width, image.height))
+	return images
+
+
+def wordOverlap(caption: str, reference: str) -> float:
+	"""@return: F1 score of the words of a caption compared to the words of the reference caption"""
+	words = Counter(caption.lower().rstrip(".").split())
+	referenceWords = Counter(reference.lower().rstrip(".").split())
+	common = sum((words & referenceWords).values())
+	if not common:
+		return 0.0
+	precision = common / sum(words.values())
+	recall = common / sum(referenceWords.values())
+	return 2 * precision * recall / (precision + recall)
+
+
+def modelSize(dataDir: str, variant: str) -> float:
+	"""@return: size in MB of the model files of a variant"""
+	paths = (modelPath(dataDir, model, variant) for model in ("encoder", "decoder", "decoder_step"))
+	return sum(os.path.getsize(path) for path in paths if os.path.exists(path)) / 2 ** 20
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--images", required=True, help="directory holding the images to caption")
+	parser.add_argument("--dataDir", default=DATA_DIR, help="directory holding the model files")
+	parser.add_argument("--verbose", action="store_true", help="print the caption of every image")
+	args = parser.parse_args()
+	if not OnnxRuntimeCaptioning.isAvailable():
+		raise SystemExit("NumPy and onnxruntime are required by the ONNX Runtime backend")
+	variants = availableVariants(args.dataDir)
+	if "fp32" not in variants:
+		raise SystemExit("The fp32 models, used as the reference, are missing")
+	images = loadImages(args.images)
+	if not images:
+		raise SystemExit("No images found")
+
+	captions = {}
+	times = {}
+	for variant in variants:
+		backend = OnnxRuntimeCaptioning(modelVariant=variant, dataDir=args.dataDir)
+		backend.initialize()
+		captions[variant] = []
+		times[variant] = []
+		for _name, pixels, width, height in images:
+			startTime = time.perf_counter()
+			captions[variant].append(backend.getCaptionFromPixels(pixels, width, height))
+			times[variant].append(time.perf_counter() - startTime)
+		backend.terminate()
+
+	reference = captions["fp32"]
+	print(
+		"variant".ljust(10) + "size MB".rjust(10) + "median ms".rjust(12) + "exact".rjust(8)
+		+ "overlap".rjust(10)
+	)
+	for variant in variants:
+		exact = sum(caption == ref for caption, ref in zip(captions[variant], reference)) / len(images)
+		overlap = statistics.mean(
+			wordOverlap(caption, ref) for caption, ref in zip(captions[variant], reference)
+		)
+		print(
+			variant.ljust(10)
+			+ f"{modelSize(args.dataDir, variant):10.1f}"
+			+ f"{statistics.median(times[variant]) * 1000:12.1f}"
+			+ f"{exact:8.0%}"
+			+ f"{overlap:10.2f}"
+		)
+	if args.verbose:
+		for index, (name, _pixels, _width, _height) in enumerate(images):
+			print(f"\n{name}")
+			for variant in variants:
+				print(f"  {variant}: {captions[variant][index]}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,18 @@
+# Image Captioning test configuration
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Registers the add-on package so that the tests can import the add-on modules that do not depend on NVDA,
+the same way the benchmarks do (see benchmarks/_addon.py).
+Usage: python -m pytest tests
+"""
+
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.normpath(os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, "benchmarks"
+))
+sys.path.insert(0, BENCHMARKS_DIR)
+from _addon import registerAddonPackage  # noqa: E402
+
+registerAddonPackage()
@@ -0,0 +1,92 @@
+# Image Captioning caption cache bundle tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import tempfile
+import unittest
+
+from imageCaptioning._cacheBundle import (
+	CacheBundle, CacheBundleSet, EXTENSION, contentDigest, mergeEntries, writeBundle
+)
+
+
+def _entries(*captions):
+	"""@return: bundle entries of images whose hash is the hexadecimal UTF-8 encoding of their caption"""
+	return [(contentDigest(_imageHash(caption)), caption) for caption in captions]
+
+
+def _imageHash(caption: str) -> str:
+	return "test:" + caption.encode("utf-8").hex()
+
+
+class TestCacheBundle(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def _write(self, name: str, entries, modelVersion: str = "1") -> str:
+		path = os.path.join(self.directory.name, name + EXTENSION)
+		writeBundle(path, entries, modelVersion, {"source": name})
+		return path
+
+	def test_roundTrip(self):
+		path = self._write("bundle", _entries("a dog", "a cat", "café"))
+		bundle = CacheBundle(path)
+		try:
+			self.assertEqual(len(bundle), 3)
+			self.assertEqual(bundle.modelVersion, "1")
+			self.assertEqual(bundle.metadata["source"], "bundle")
+			self.assertEqual(bundle.get(_imageHash("a cat")), "a cat")
+			self.assertEqual(bundle.get(_imageHash("café")), "café")
+			self.assertIsNone(bundle.get(_imageHash("a bird")))
+			self.assertEqual(sorted(bundle.entries()), sorted(_entries("a dog", "a cat", "café")))
+		finally:
+			bundle.close()
+
+	def test_sharedCaptionsStoredOnce(self):
+		caption = "a very long caption " * 10
+		single = self._write("single", [(contentDigest("test:1"), caption)])
+		shared = self._write("shared", [(contentDigest(f"test:{index}"), caption) for index in range(10)])
+		self.assertLess(os.path.getsize(shared) - os.path.getsize(single), 10 * len(caption))
+
+	def test_notABundle(self):
+		path = os.path.join(self.directory.name, "other" + EXTENSION)
+		with open(path, "wb") as f:
+			f.write(b"not a caption cache bundle at all")
+		with self.assertRaises(ValueError):
+			CacheBundle(path)
+
+	def test_mergeConflicts(self):
+		first = [(contentDigest("test:1"), "a dog"), (contentDigest("test:2"), "a cat")]
+		second = [(contentDigest("test:1"), "a puppy")]
+		self.assertEqual(dict(mergeEntries([first, second], "first"))[contentDigest("test:1")], "a dog")
+		self.assertEqual(dict(mergeEntries([first, second], "last"))[contentDigest("test:1")], "a puppy")
+		self.assertEqual(mergeEntries([first, second], "drop"), [(contentDigest("test:2"), "a cat")])
+		with self.assertRaises(ValueError):
+			mergeEntries([first], "newest")
+
+	def test_mergeLimits(self):
+		"""Images found in the most bundles are kept first."""
+		first = _entries("a", "b", "c")
+		second = _entries("c")
+		merged = mergeEntries([first, second], maxEntries=2)
+		self.assertEqual([caption for _digest, caption in merged], ["c", "a"])
+		self.assertEqual(mergeEntries([first, second], maxBytes=0), [])
+
+	def test_bundleSet(self):
+		self._write("b", _entries("second"))
+		self._write("a", _entries("first") + [(contentDigest(_imageHash("second")), "shadowed")])
+		self._write("c", _entries("other model"), modelVersion="2")
+		bundles = CacheBundleSet(self.directory.name, "1")
+		try:
+			self.assertEqual(bundles.get(_imageHash("first")), "first")
+			# the first bundle in file name order wins
+			self.assertEqual(bundles.get(_imageHash("second")), "shadowed")
+			self.assertIsNone(bundles.get(_imageHash("other model")))
+		finally:
+			bundles.close()
+		missing = CacheBundleSet(os.path.join(self.directory.name, "missing"), "1")
+		self.assertIsNone(missing.get(_imageHash("first")))
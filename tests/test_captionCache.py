@@ -0,0 +1,96 @@
+# Image Captioning caption cache tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import tempfile
+import time
+import unittest
+
+from imageCaptioning._captionCache import CaptionCache
+
+
+def _perceptualHash(differenceHash: int, brightness: int = 128) -> int:
+	"""@return: a perceptual hash of a square image, see L{_perceptualHash.dHash}"""
+	return (128 << 72) | (brightness << 64) | differenceHash
+
+
+class TestCaptionCache(unittest.TestCase):
+
+	def test_evictsLeastRecentlyUsed(self):
+		cache = CaptionCache(maxEntries=2)
+		cache.put("a", "A")
+		cache.put("b", "B")
+		# a is now more recently used than b
+		self.assertEqual(cache.get("a"), "A")
+		cache.put("c", "C")
+		self.assertNotIn("b", cache)
+		self.assertEqual([key for key, _caption in cache.items()], ["a", "c"])
+
+	def test_boundedByBytes(self):
+		cache = CaptionCache(maxEntries=100, maxBytes=10)
+		cache.put("a", "12345")
+		cache.put("b", "12345")
+		self.assertEqual(len(cache), 1)
+		self.assertLessEqual(cache.sizeInBytes, 10)
+		cache.configure(maxEntries=100, maxBytes=0)
+		self.assertEqual(len(cache), 0)
+
+	def test_findSimilar(self):
+		cache = CaptionCache()
+		cache.put("a", "A", _perceptualHash(0b1111_0000_1111))
+		self.assertEqual(cache.findSimilar(_perceptualHash(0b1111_0000_1110), 1), "a")
+		self.assertIsNone(cache.findSimilar(_perceptualHash(0b1111_0000_1110), 0))
+		# images of a different brightness are never similar
+		self.assertIsNone(cache.findSimilar(_perceptualHash(0b1111_0000_1111, brightness=200), 4))
+		# replacing a caption keeps the perceptual hash of its image
+		cache.put("a", "another A")
+		self.assertEqual(cache.findSimilar(_perceptualHash(0b1111_0000_1111), 0), "a")
+
+	def test_identities(self):
+		cache = CaptionCache(maxEntries=2)
+		cache.putIdentity("unknown", "a")
+		self.assertIsNone(cache.getByIdentity("unknown"))
+		cache.put("a", "A")
+		cache.putIdentity("object", "a")
+		self.assertEqual(cache.getByIdentity("object"), ("a", "A"))
+		self.assertEqual(cache.getByIdentity("object", maxAge=60), ("a", "A"))
+
+	def test_staleIdentity(self):
+		cache = CaptionCache()
+		cache.put("a", "A")
+		cache.putIdentity("object", "a")
+		cache._identities["object"] = ("a", time.time() - 120)
+		self.assertIsNone(cache.getByIdentity("object", maxAge=60))
+		self.assertEqual(cache.getByIdentity("object"), ("a", "A"))
+
+	def test_identityForgottenWithCaption(self):
+		cache = CaptionCache(maxEntries=1)
+		cache.put("a", "A")
+		cache.putIdentity("object", "a")
+		cache.put("b", "B")
+		self.assertIsNone(cache.getByIdentity("object"))
+		self.assertNotIn("object", cache._identities)
+
+	def test_store(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "imageCaptioning", "captionCache.json.gz")
+			cache = CaptionCache(storePath=path)
+			cache.put("a", "A", _perceptualHash(0b1011))
+			cache.put("b", "B")
+			cache.putIdentity("object", "b")
+			cache.save()
+			loaded = CaptionCache(storePath=path)
+			self.assertEqual(loaded.items(), [("a", "A"), ("b", "B")])
+			self.assertEqual(loaded.findSimilar(_perceptualHash(0b1011), 0), "a")
+			self.assertEqual(loaded.getByIdentity("object"), ("b", "B"))
+
+	def test_unreadableStore(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "captionCache.json.gz")
+			with open(path, "wb") as f:
+				f.write(b"not a store")
+			cache = CaptionCache(storePath=path)
+			self.assertEqual(len(cache), 0)
+			cache.put("a", "A")
+			cache.save()
+			self.assertEqual(CaptionCache(storePath=path).get("a"), "A")
@@ -0,0 +1,55 @@
+# Image Captioning capture geometry tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import unittest
+
+from imageCaptioning._captureGeometry import captureResizeFactor, clipRect, findContentBounds
+
+_white = bytes((255, 255, 255, 255))
+_black = bytes((0, 0, 0, 255))
+_gray = bytes((128, 128, 128, 255))
+_red = bytes((0, 0, 255, 255))
+
+
+def _framed(width: int, height: int, content, border: bytes = _white) -> bytearray:
+	"""@param content: (left, top, right, bottom) of the checkered content, the rest of the image is the border
+	@return: 32 bit BGRA pixels"""
+	left, top, right, bottom = content
+	pixels = bytearray()
+	for y in range(height):
+		for x in range(width):
+			if left <= x < right and top <= y < bottom:
+				pixels += _black if (x + y) % 2 else _gray
+			else:
+				pixels += border
+	return pixels
+
+
+class TestCaptureGeometry(unittest.TestCase):
+
+	def test_captureResizeFactor(self):
+		self.assertEqual(captureResizeFactor(300, 200, (224, 224)), 1.0)
+		# the shorter side keeps twice the input size
+		self.assertAlmostEqual(captureResizeFactor(1920, 1080, (224, 224)), 448 / 1080)
+		self.assertAlmostEqual(captureResizeFactor(1000, 4000, (224, 224)), 448 / 1000)
+
+	def test_clipRect(self):
+		viewport = (0, 0, 100, 100)
+		self.assertEqual(clipRect((10, 10, 20, 20), viewport), (10, 10, 20, 20))
+		self.assertEqual(clipRect((-10, 90, 30, 30), viewport), (0, 90, 20, 10))
+		self.assertIsNone(clipRect((100, 0, 10, 10), viewport))
+		self.assertIsNone(clipRect((-20, -20, 20, 20), viewport))
+
+	def test_findContentBounds(self):
+		self.assertEqual(findContentBounds(_framed(20, 10, (3, 2, 15, 9)), 20, 10), (3, 2, 15, 9))
+		# content touching the edges
+		self.assertEqual(findContentBounds(_framed(20, 10, (0, 0, 5, 10)), 20, 10), (0, 0, 5, 10))
+
+	def test_bordersOfDifferentColors(self):
+		"""Each side is trimmed against the color of its own corner."""
+		pixels = _framed(10, 10, (2, 2, 8, 9))
+		pixels[-4 * 10:] = _red * 10
+		self.assertEqual(findContentBounds(pixels, 10, 10), (2, 2, 8, 9))
+
+	def test_uniformImage(self):
+		self.assertEqual(findContentBounds(_white * 12, 4, 3), (0, 0, 4, 3))
@@ -0,0 +1,74 @@
+# Image Captioning caption decoding tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import unittest
+
+from imageCaptioning._decoding import IncrementalDecoder, beamSearch, greedyDecode, lengthPenalty, numpy
+
+# Word ids of the fake decoder, 0 to 2 are the pad, start and end tokens and the other words are fillers
+_a = 3
+_b = 4
+_vocabularySize = 20
+
+
+class _MarkovDecoder(IncrementalDecoder):
+	"""Decoder whose next word only depends on the last word, following a table of probabilities. Fillers are
+	unlikely and the end token is even less likely unless listed, so that beam search only finishes the
+	listed captions."""
+	def __init__(self, transitions: dict):
+		"""@param transitions: maps a word id to the probability of each next word id"""
+		self.table = numpy.full((_vocabularySize, _vocabularySize), 1e-9)
+		self.table[:, 2] = 1e-30
+		for wordId, probabilities in transitions.items():
+			for nextId, probability in probabilities.items():
+				self.table[wordId, nextId] = probability
+
+	def initialState(self, features):
+		return None
+
+	def step(self, wordIds, state):
+		return numpy.log(self.table[wordIds]), state
+
+	def reorderState(self, state, indices):
+		return state
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestDecoding(unittest.TestCase):
+
+	def setUp(self):
+		# the most likely first word leads to a less likely caption
+		self.decoder = _MarkovDecoder({
+			1: {_a: 0.55, _b: 0.45},
+			_a: {2: 0.34, _a: 0.33, _b: 0.33},
+			_b: {2: 0.9, _a: 0.05, _b: 0.05},
+		})
+
+	def test_greedyDecode(self):
+		words = []
+		result = greedyDecode(self.decoder, None, onWords=words.extend)
+		self.assertEqual(result.wordIds, [_a])
+		self.assertEqual(words, [_a])
+		self.assertAlmostEqual(result.score, float(numpy.log(0.55 * 0.34)), places=5)
+		self.assertEqual(len(result.stepTimes), 2)
+
+	def test_maxLength(self):
+		decoder = _MarkovDecoder({1: {_a: 1}, _a: {_a: 1}})
+		self.assertEqual(greedyDecode(decoder, None, maxLength=5).wordIds, [_a] * 5)
+		self.assertTrue(all(len(result.wordIds) <= 5 for result in beamSearch(decoder, None, maxLength=5)))
+
+	def test_beamSearch(self):
+		words = []
+		results = beamSearch(self.decoder, None, beamWidth=2, onWords=words.extend)
+		self.assertEqual(results[0].wordIds, [_b])
+		self.assertGreater(results[0].score, results[1].score)
+		self.assertAlmostEqual(results[0].score, float(numpy.log(0.45 * 0.9)) / lengthPenalty(2, 0.7), places=5)
+		# the hypotheses never agreed on a first word
+		self.assertEqual(words, [])
+
+	def test_beamSearchStreamsSharedWords(self):
+		decoder = _MarkovDecoder({1: {_a: 1}, _a: {_b: 1}, _b: {2: 1}})
+		words = []
+		results = beamSearch(decoder, None, beamWidth=2, onWords=words.extend)
+		self.assertEqual(results[0].wordIds, [_a, _b])
+		self.assertEqual(words, [_a, _b])
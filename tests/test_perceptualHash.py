@@ -0,0 +1,64 @@
+# Image Captioning perceptual hash tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import unittest
+
+from imageCaptioning._perceptualHash import PerceptualIndex, dHash, hammingDistance, isCompatible
+
+
+def _circle(width: int, height: int, background: int = 40, foreground: int = 220) -> bytearray:
+	"""@return: 32 bit BGRA pixels of a light disc on a dark background"""
+	pixels = bytearray()
+	radius = min(width, height) / 3
+	for y in range(height):
+		for x in range(width):
+			inside = (x - width / 2) ** 2 + (y - height / 2) ** 2 < radius ** 2
+			gray = foreground if inside else background
+			pixels += bytes((gray, gray, gray, 255))
+	return pixels
+
+
+class TestDHash(unittest.TestCase):
+
+	def test_plainImagesHaveNoHash(self):
+		"""Images without detail would all match each other."""
+		self.assertIsNone(dHash(bytes([128, 128, 128, 255]) * 64 * 64, 64, 64))
+		gradient = bytearray()
+		for _y in range(64):
+			for x in range(64):
+				gradient += bytes((x * 4, x * 4, x * 4, 255))
+		self.assertIsNone(dHash(gradient, 64, 64))
+		self.assertIsNone(dHash(_circle(8, 8), 8, 8))
+
+	def test_nearDuplicate(self):
+		pixels = _circle(64, 48)
+		original = dHash(pixels, 64, 48)
+		self.assertIsNotNone(original)
+		# a blinking caret
+		pixels[0:4] = b"\xff\xff\xff\xff"
+		changed = dHash(pixels, 64, 48)
+		self.assertLessEqual(hammingDistance(original, changed), 1)
+		self.assertTrue(isCompatible(original, changed))
+
+	def test_brightnessAndAspect(self):
+		original = dHash(_circle(64, 64), 64, 64)
+		brighter = dHash(_circle(64, 64, background=120, foreground=255), 64, 64)
+		wider = dHash(_circle(128, 64), 128, 64)
+		self.assertFalse(isCompatible(original, brighter))
+		self.assertFalse(isCompatible(original, wider))
+
+
+class TestPerceptualIndex(unittest.TestCase):
+
+	def test_findSimilar(self):
+		index = PerceptualIndex()
+		perceptualHash = dHash(_circle(64, 64), 64, 64)
+		index.add("circle", perceptualHash)
+		self.assertEqual(index.getHash("circle"), perceptualHash)
+		self.assertEqual(index.findSimilar(perceptualHash ^ 1, 1), "circle")
+		self.assertIsNone(index.findSimilar(perceptualHash ^ 0b111, 2))
+		# similar difference bits do not make images of another brightness similar
+		self.assertIsNone(index.findSimilar(perceptualHash ^ (1 << 70), 4))
+		index.remove("circle")
+		self.assertIsNone(index.findSimilar(perceptualHash, 4))
+		self.assertEqual(len(index), 0)
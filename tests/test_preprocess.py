@@ -0,0 +1,65 @@
+# Image Captioning image preprocessing tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import unittest
+
+from imageCaptioning import _preprocess
+
+
+def _solid(width: int, height: int, blue: int, green: int, red: int, padding: int = 0) -> bytes:
+	"""@return: 32 bit BGRA pixels of a single color, each row followed by I{padding} bytes"""
+	return (bytes((blue, green, red, 255)) * width + b"\xff" * padding) * height
+
+
+@unittest.skipUnless(_preprocess.isAvailable(), "NumPy is not installed")
+class TestPreprocess(unittest.TestCase):
+
+	def setUp(self):
+		_preprocess._importNumpy()
+		self.numpy = _preprocess.numpy
+
+	def _expected(self, value: int, channel: int) -> float:
+		return (value / 255 - _preprocess.MEAN[channel]) / _preprocess.STD[channel]
+
+	def test_areaWeights(self):
+		weights = _preprocess._areaWeights(10, 4)
+		self.assertEqual(weights.shape, (4, 10))
+		self.numpy.testing.assert_allclose(weights.sum(axis=1), 1, rtol=1e-6)
+		# enlarging also keeps the average of each pixel
+		self.numpy.testing.assert_allclose(_preprocess._areaWeights(2, 4).sum(axis=1), 1, rtol=1e-6)
+
+	def test_pixelsToArray(self):
+		pixels = bytearray(_solid(3, 2, 1, 2, 3, padding=4))
+		array = _preprocess.pixelsToArray(pixels, 3, 2, stride=16)
+		self.assertEqual(array.shape, (2, 3, 4))
+		self.assertEqual(array[1, 2].tolist(), [1, 2, 3, 255])
+		# the array is a view of the pixels
+		pixels[16] = 9
+		self.assertEqual(array[1, 0, 0], 9)
+
+	def test_solidImage(self):
+		tensor = _preprocess.preprocessPixels(_solid(300, 200, 10, 128, 250), 300, 200)
+		self.assertEqual(tensor.shape, (1, 3, 224, 224))
+		self.assertEqual(tensor.dtype, self.numpy.float32)
+		# BGRA is converted to RGB
+		for channel, value in enumerate((250, 128, 10)):
+			self.numpy.testing.assert_allclose(tensor[0, channel], self._expected(value, channel), atol=1e-4)
+
+	def test_strideAndInputSize(self):
+		"""Padding at the end of the rows is ignored."""
+		tensor = _preprocess.preprocessPixels(
+			_solid(50, 40, 0, 0, 255, padding=8), 50, 40, stride=50 * 4 + 8, inputSize=(32, 16)
+		)
+		self.assertEqual(tensor.shape, (1, 3, 16, 32))
+		self.numpy.testing.assert_allclose(tensor[0, 0], self._expected(255, 0), atol=1e-4)
+		self.numpy.testing.assert_allclose(tensor[0, 2], self._expected(0, 2), atol=1e-4)
+
+	def test_areaAveraging(self):
+		"""Halving an image averages each 2x2 block."""
+		pixels = bytearray()
+		for y in range(4):
+			for x in range(4):
+				gray = 255 if (x + y) % 2 else 0
+				pixels += bytes((gray, gray, gray, 255))
+		tensor = _preprocess.preprocessPixels(pixels, 4, 4, inputSize=(2, 2))
+		self.numpy.testing.assert_allclose(tensor[0, 1], self._expected(127.5, 1), atol=1e-4)
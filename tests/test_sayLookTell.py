@@ -0,0 +1,72 @@
+# Image Captioning DLL backend export probing tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import unittest
+from types import SimpleNamespace
+
+from imageCaptioning._sayLookTell import SayLookTellCaptioning
+
+#: Exports of the shipped ImageCaptioning DLL
+_shippedExports = ("doDetection", "getCaption")
+#: Exports of a build of the DLL keeping the model loaded
+_residentExports = _shippedExports + ("initModel", "releaseModel", "runDetection")
+
+
+def _fakeDLL(*exports):
+	"""@return: an object with a function attribute per export, like a ctypes library"""
+	return SimpleNamespace(**{name: SimpleNamespace() for name in exports})
+
+
+class TestExportProbing(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = SayLookTellCaptioning()
+
+	def _probe(self, *exports):
+		lib = _fakeDLL(*exports)
+		self.backend._defineFunctions(lib)
+		return lib
+
+	def test_shippedDLL(self):
+		"""The shipped DLL reloads the model for every caption and only reads image files."""
+		lib = self._probe(*_shippedExports)
+		self.assertFalse(self.backend._hasResidentModel)
+		self.assertFalse(self.backend.supportsPixelInput)
+		self.assertFalse(self.backend.supportsTensorInput)
+		self.assertEqual(lib.doDetection.argtypes[-1].__name__, "c_char_p")
+
+	def test_residentModel(self):
+		self._probe(*_residentExports)
+		self.assertTrue(self.backend._hasResidentModel)
+		self.assertFalse(self.backend.supportsPixelInput)
+		self.assertFalse(self.backend.supportsTensorInput)
+
+	def test_pixelAndTensorInput(self):
+		lib = self._probe(*_residentExports, "runDetectionFromBuffer", "runDetectionFromTensor")
+		self.assertTrue(self.backend.supportsPixelInput)
+		self.assertTrue(self.backend.supportsTensorInput)
+		self.assertEqual(len(lib.runDetectionFromBuffer.argtypes), 4)
+		self.assertEqual(len(lib.runDetectionFromTensor.argtypes), 4)
+
+	def test_inputsNeedResidentModel(self):
+		"""Pixel and tensor input are only used by builds that also keep the model loaded."""
+		self._probe(*_shippedExports, "runDetectionFromBuffer", "runDetectionFromTensor")
+		self.assertFalse(self.backend.supportsPixelInput)
+		self.assertFalse(self.backend.supportsTensorInput)
+
+	def test_acceptsPixels(self):
+		"""Probing for L{_remoteBackend} does not load the model and leaves the DLLs unloaded."""
+		for exports, accepted in (
+			(_shippedExports, False),
+			(_residentExports + ("runDetectionFromBuffer",), True),
+		):
+			lib = _fakeDLL(*exports)
+
+			def loadDLLs():
+				self.backend._libs = [lib]
+				return lib
+
+			self.backend._loadDLLs = loadDLLs
+			self.assertIs(self.backend.acceptsPixels(), accepted)
+			self.assertFalse(self.backend.isInitialized)
+			self.assertFalse(self.backend.supportsPixelInput)
@@ -0,0 +1,105 @@
+# Image Captioning recognition scheduler tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import threading
+import unittest
+from concurrent.futures import CancelledError
+
+from imageCaptioning._scheduler import (
+	PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RecognitionJob, RecognitionScheduler
+)
+
+#: Seconds to wait for a job before failing
+_timeout = 5
+
+
+class TestRecognitionScheduler(unittest.TestCase):
+
+	def setUp(self):
+		self.scheduler = RecognitionScheduler(maxQueued=2)
+		# blocks the worker thread so that the jobs submitted by a test stay queued
+		self.running = threading.Event()
+		self.release = threading.Event()
+		self.scheduler.submit(RecognitionJob("blocker", self._block))
+		self.assertTrue(self.running.wait(_timeout))
+
+	def _block(self):
+		self.running.set()
+		self.release.wait(_timeout)
+
+	def tearDown(self):
+		self.release.set()
+		self.scheduler.terminate()
+
+	def test_resubmitAfterCancel(self):
+		"""A job cancelled and removed from the queue must not swallow a later job with the same key."""
+		results = []
+		self.scheduler.submit(RecognitionJob("image", lambda: "first", results.append))
+		self.scheduler.cancel("image")
+		# removes the cancelled job from the queue
+		self.scheduler.submit(RecognitionJob("other", lambda: "other"))
+		job = self.scheduler.submit(RecognitionJob("image", lambda: "second", results.append))
+		self.release.set()
+		self.assertTrue(job.done.wait(_timeout))
+		self.assertEqual(results, ["second"])
+
+	def test_droppedJobsAreReported(self):
+		"""Jobs dropped because the queue is full call their discard callbacks with a CancelledError."""
+		discarded = []
+		background = RecognitionJob(
+			"background", lambda: "background", priority=PRIORITY_BACKGROUND, onDiscardedResult=discarded.append
+		)
+		self.scheduler.submit(background)
+		self.scheduler.submit(RecognitionJob("first", lambda: "first"))
+		# the queue is full, the background job makes room for this one
+		self.scheduler.submit(RecognitionJob("second", lambda: "second", priority=PRIORITY_INTERACTIVE))
+		self.assertTrue(background.done.is_set())
+		# the queue is full of more urgent jobs, this job is rejected
+		rejected = RecognitionJob(
+			"rejected", lambda: "rejected", priority=PRIORITY_BACKGROUND, onDiscardedResult=discarded.append
+		)
+		self.assertTrue(self.scheduler.submit(rejected).cancelled)
+		self.assertTrue(rejected.done.is_set())
+		self.assertEqual(len(discarded), 2)
+		self.assertTrue(all(isinstance(result, CancelledError) for result in discarded))
+
+	def test_cancelledQueuedJobIsReported(self):
+		"""A queued job that is merged and then superseded calls the discard callbacks of all its submitters."""
+		discarded = []
+		prefetch = RecognitionJob(
+			"A", lambda: "A", discarded.append, priority=PRIORITY_BACKGROUND, onDiscardedResult=discarded.append,
+			group="image"
+		)
+		self.scheduler.submit(prefetch)
+		interactive = RecognitionJob("A", lambda: "A", onDiscardedResult=discarded.append, group="image")
+		self.assertIs(self.scheduler.submit(interactive, latestWins=True), prefetch)
+		self.scheduler.submit(RecognitionJob("B", lambda: "B", group="image"), latestWins=True)
+		self.release.set()
+		self.assertTrue(prefetch.done.wait(_timeout))
+		self.assertEqual(len(discarded), 2)
+		self.assertTrue(all(isinstance(result, CancelledError) for result in discarded))
+
+	def test_batchIsNotSuperseded(self):
+		"""An interactive single image job submitted with latestWins does not cancel a batch job."""
+		results = []
+		batch = RecognitionJob(("A", "B"), lambda: ["A", "B"], results.append)
+		self.scheduler.submit(batch)
+		single = RecognitionJob("C", lambda: "C", results.append, group="image")
+		self.scheduler.submit(single, latestWins=True)
+		self.release.set()
+		self.assertTrue(single.done.wait(_timeout))
+		self.assertFalse(batch.cancelled)
+		self.assertEqual(results, [["A", "B"], "C"])
+
+	def test_latestWinsSupersedesSameGroup(self):
+		"""An interactive single image job submitted with latestWins cancels older jobs of its group."""
+		results = []
+		older = RecognitionJob("A", lambda: "A", results.append, group="image")
+		self.scheduler.submit(older)
+		newer = RecognitionJob("B", lambda: "B", results.append, group="image")
+		self.scheduler.submit(newer, latestWins=True)
+		self.release.set()
+		self.assertTrue(newer.done.wait(_timeout))
+		self.assertTrue(older.cancelled)
+		self.assertEqual(results, ["B"])
+
@@ -0,0 +1,56 @@
+# Image Captioning vocabulary tests
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+import os
+import tempfile
+import unittest
+
+from imageCaptioning._vocabulary import Vocabulary, isCaptionWord
+
+_words = ["<pad>", "<start>", "<end>", "<unk>", "a", "dog", ".", "café"]
+
+
+class TestVocabulary(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.textPath = os.path.join(self.directory.name, "vocab.txt")
+		with open(self.textPath, "w", encoding="utf-8", newline="\r\n") as f:
+			f.write("\n".join(_words) + "\n")
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def _checkVocabulary(self, vocabulary: Vocabulary):
+		self.assertEqual(len(vocabulary), len(_words))
+		self.assertEqual([vocabulary[wordId] for wordId in range(len(vocabulary))], _words)
+		self.assertEqual(
+			(vocabulary.padId, vocabulary.startId, vocabulary.endId, vocabulary.unknownId), (0, 1, 2, 3)
+		)
+		self.assertFalse(vocabulary.isCaptionWord(1))
+		self.assertTrue(vocabulary.isCaptionWord(7))
+
+	def test_isCaptionWord(self):
+		self.assertTrue(isCaptionWord("dog"))
+		self.assertFalse(isCaptionWord("<unk>"))
+		self.assertFalse(isCaptionWord("."))
+
+	def test_fromTextFile(self):
+		self._checkVocabulary(Vocabulary.fromTextFile(self.textPath))
+
+	def test_detokenize(self):
+		vocabulary = Vocabulary.fromTextFile(self.textPath)
+		# special tokens and punctuation are skipped, decoding stops at the end token
+		self.assertEqual(vocabulary.detokenize([1, 4, 3, 5, 6, 7, 2, 4]), ["a", "dog", "café"])
+		self.assertEqual(vocabulary.detokenize([]), [])
+
+	def test_binaryFile(self):
+		binaryPath = os.path.join(self.directory.name, "vocab.bin")
+		Vocabulary.fromTextFile(self.textPath).saveBinary(binaryPath)
+		vocabulary = Vocabulary.fromBinaryFile(binaryPath)
+		self._checkVocabulary(vocabulary)
+		self.assertEqual(vocabulary.detokenize([4, 5, 2]), ["a", "dog"])
+
+	def test_notABinaryFile(self):
+		with self.assertRaises(ValueError):
+			Vocabulary.fromBinaryFile(self.textPath)
@@ -0,0 +1,38 @@
+# Image Captioning binary vocabulary builder
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Converts vocab.txt to the binary vocabulary format (vocab.bin next to it), which the add-on memory maps
+instead of parsing the text file. See addon/globalPlugins/imageCaptioning/_vocabulary.py.
+Usage: python tools/buildVocabulary.py [--vocab PATH]
+"""
+
+import argparse
+import os
+import sys
+
+ADDON_PACKAGE_DIR = os.path.normpath(os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, "addon", "globalPlugins", "imageCaptioning"
+))
+sys.path.insert(0, ADDON_PACKAGE_DIR)
+from _vocabulary import Vocabulary  # noqa: E402
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument(
+		"--vocab", default=os.path.join(ADDON_PACKAGE_DIR, "data", "vocab.txt"), help="vocabulary text file"
+	)
+	args = parser.parse_args()
+	vocabulary = Vocabulary.fromTextFile(args.vocab)
+	binaryPath = os.path.splitext(args.vocab)[0] + ".bin"
+	vocabulary.saveBinary(binaryPath)
+	# check the file can be read back
+	if [Vocabulary.fromBinaryFile(binaryPath)[index] for index in range(len(vocabulary))] != [
+		vocabulary[index] for index in range(len(vocabulary))
+	]:
+		raise SystemExit(f"{binaryPath} does not match {args.vocab}")
+	print(f"Wrote {len(vocabulary)} words to {binaryPath}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,130 @@
+# Image Captioning caption cache bundle tool
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Builds, merges and describes caption cache bundles, which let machines reuse captions generated on other
+machines. Bundles copied to the bundles folder in the imageCaptioning folder of the NVDA configuration are
+looked up when a caption is not in the caption cache.
+Inputs of build and merge are bundles (.icb) or caption cache stores (captionCache.json.gz in the
+imageCaptioning folder of the NVDA configuration). Stores do not record the model that generated their
+captions, which is given with --modelVersion or computed from the models of --dataDir and --variant.
+Usage:
+	python tools/cacheBundle.py build STORE... -o OUTPUT [--dataDir DIR] [--variant VARIANT]
+	python tools/cacheBundle.py merge INPUT... -o OUTPUT [--conflicts first|last|drop] [--maxEntries N]
+		[--maxKB N]
+	python tools/cacheBundle.py info BUNDLE...
+"""
+
+import argparse
+import os
+import sys
+import time
+import types
+
+ADDON_PACKAGE_DIR = os.path.normpath(os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, "addon", "globalPlugins", "imageCaptioning"
+))
+# Register the add-on package without running its __init__ module, which needs NVDA
+_package = types.ModuleType("imageCaptioning")
+_package.__path__ = [ADDON_PACKAGE_DIR]
+sys.modules.setdefault("imageCaptioning", _package)
+from imageCaptioning import _cacheBundle  # noqa: E402
+from imageCaptioning._captionCache import CaptionCache  # noqa: E402
+from imageCaptioning._modelVariants import VARIANTS, modelVersion  # noqa: E402
+
+
+def _readStore(path: str):
+	"""@return: the entries of a caption cache store, most recently used first"""
+	cache = CaptionCache(sys.maxsize, sys.maxsize, path)
+	if not len(cache):
+		print(f"Warning: {path} holds no captions or is not a caption cache store", file=sys.stderr)
+	return [
+		(_cacheBundle.contentDigest(imageHash), caption)
+		for imageHash, caption in reversed(cache.items())
+	]
+
+
+def _storeModelVersion(args) -> str:
+	return args.modelVersion or modelVersion(args.dataDir, args.variant)
+
+
+def _readInputs(args):
+	"""Reads the inputs of build and merge.
+	@return: the model version and the entries of each input
+	"""
+	version = None
+	inputs = []
+	for path in args.inputs:
+		if path.endswith(_cacheBundle.EXTENSION):
+			bundle = _cacheBundle.CacheBundle(path)
+			inputVersion = bundle.modelVersion
+			entries = list(bundle.entries())
+			bundle.close()
+		else:
+			inputVersion = _storeModelVersion(args)
+			entries = _readStore(path)
+		if version is None:
+			version = inputVersion
+		elif inputVersion != version:
+			raise SystemExit(
+				f"{path} was generated by model version {inputVersion}, other inputs by {version}. "
+				"Captions of different models cannot be merged."
+			)
+		inputs.append(entries)
+	return version, inputs
+
+
+def _write(args, version: str, inputs):
+	maxBytes = args.maxKB * 1024 if args.maxKB else None
+	entries = _cacheBundle.mergeEntries(inputs, args.conflicts, args.maxEntries, maxBytes)
+	metadata = {
+		"created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+		"sources": [os.path.basename(path) for path in args.inputs],
+	}
+	count = _cacheBundle.writeBundle(args.output, entries, version, metadata)
+	size = os.path.getsize(args.output)
+	print(f"Wrote {count} captions of model version {version} to {args.output} ({size / 1024:.1f} KB)")
+
+
+def _info(args):
+	for path in args.inputs:
+		bundle = _cacheBundle.CacheBundle(path)
+		print(f"{path}: {len(bundle)} captions, {os.path.getsize(path) / 1024:.1f} KB")
+		for key, value in sorted(bundle.metadata.items()):
+			print(f"\t{key}: {value}")
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("command", choices=("build", "merge", "info"))
+	parser.add_argument("inputs", nargs="+", help="bundles or caption cache stores")
+	parser.add_argument("-o", "--output", help="bundle to write, for build and merge")
+	parser.add_argument(
+		"--conflicts", choices=_cacheBundle.CONFLICT_POLICIES, default="first",
+		help="caption kept for images with different captions in several inputs: the caption of the first or "
+		"last input holding the image, or none (default: first)"
+	)
+	parser.add_argument("--maxEntries", type=int, help="maximum number of captions of the output")
+	parser.add_argument("--maxKB", type=int, help="maximum size of the output in kilobytes")
+	parser.add_argument("--modelVersion", help="model version of the captions of caption cache stores")
+	parser.add_argument(
+		"--dataDir", default=os.path.join(ADDON_PACKAGE_DIR, "data"),
+		help="directory of the models that generated the captions of caption cache stores"
+	)
+	parser.add_argument(
+		"--variant", choices=VARIANTS, default=VARIANTS[0],
+		help="model variant that generated the captions of caption cache stores"
+	)
+	args = parser.parse_args()
+	if args.command == "info":
+		_info(args)
+		return
+	if not args.output:
+		parser.error(f"{args.command} requires --output")
+	if args.command == "build" and any(path.endswith(_cacheBundle.EXTENSION) for path in args.inputs):
+		parser.error("build reads caption cache stores, use merge to combine bundles")
+	version, inputs = _readInputs(args)
+	_write(args, version, inputs)
+
+
+if __name__ == "__main__":
+	main()
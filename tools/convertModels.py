@@ -0,0 +1,102 @@
+# Image Captioning model variant conversion
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Produces the reduced precision variants of the models shipped with the add-on, see
+addon/globalPlugins/imageCaptioning/_modelVariants.py:
+- int8: weights of matrix multiplications and convolutions are quantised to 8 bit integers and activations
+are quantised dynamically at run time. The models are about four times smaller on disk and in memory and
+usually faster on CPUs without AVX-512.
+- fp16: weights are stored as 16 bit floats and converted back to 32 bit floats when the model is loaded,
+so computations keep full precision. The model files are half the size, which only makes the add-on smaller
+to download: ONNX Runtime folds the conversion when loading the model, so it runs and uses as much memory as
+the fp32 variant.
+Requires onnx and onnxruntime.
+Usage: python tools/convertModels.py [--dataDir DIR] [--variants int8,fp16]
+"""
+
+import argparse
+import os
+import sys
+
+import numpy
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+ADDON_PACKAGE_DIR = os.path.normpath(os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, "addon", "globalPlugins", "imageCaptioning"
+))
+sys.path.insert(0, ADDON_PACKAGE_DIR)
+from _modelVariants import modelPath  # noqa: E402
+
+#: Models converted when present in the data directory
+MODELS = ("encoder", "decoder", "decoder_step")
+#: Initializers with fewer elements than this, such as biases, are kept as 32 bit floats
+_minFp16Elements = 1024
+
+
+def convertToFp16Weights(model: onnx.ModelProto) -> onnx.ModelProto:
+	"""Stores the large float initializers of a model as 16 bit floats, each followed by a Cast node that
+	restores the original 32 bit tensor under its original name, so the rest of the graph is unchanged."""
+	graph = model.graph
+	initializers = []
+	casts = []
+	converted = set()
+	for initializer in graph.initializer:
+		size = int(numpy.prod(initializer.dims))
+		if initializer.data_type != TensorProto.FLOAT or size < _minFp16Elements:
+			initializers.append(initializer)
+			continue
+		half = numpy_helper.from_array(
+			numpy_helper.to_array(initializer).astype(numpy.float16), f"{initializer.name}_fp16"
+		)
+		initializers.append(half)
+		casts.append(helper.make_node("Cast", [half.name], [initializer.name], to=TensorProto.FLOAT))
+		converted.add(initializer.name)
+	del graph.initializer[:]
+	graph.initializer.extend(initializers)
+	nodes = casts + list(graph.node)
+	del graph.node[:]
+	graph.node.extend(nodes)
+	# older exporters also list initializers as graph inputs
+	inputs = [graphInput for graphInput in graph.input if graphInput.name not in converted]
+	del graph.input[:]
+	graph.input.extend(inputs)
+	return model
+
+
+def convert(dataDir: str, variant: str, weightType: QuantType):
+	for model in MODELS:
+		source = modelPath(dataDir, model, "fp32")
+		if not os.path.exists(source):
+			continue
+		target = modelPath(dataDir, model, variant)
+		if variant == "int8":
+			quantize_dynamic(source, target, weight_type=weightType)
+		elif variant == "fp16":
+			onnx.save(convertToFp16Weights(onnx.load(source)), target)
+		else:
+			raise ValueError(f"Unknown model variant {variant}")
+		onnx.checker.check_model(target)
+		sourceSize = os.path.getsize(source) / 2 ** 20
+		targetSize = os.path.getsize(target) / 2 ** 20
+		print(f"{os.path.basename(target)}: {sourceSize:.1f} MB -> {targetSize:.1f} MB")
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument(
+		"--dataDir", default=os.path.join(ADDON_PACKAGE_DIR, "data"), help="directory holding the fp32 models"
+	)
+	parser.add_argument("--variants", default="int8,fp16", help="comma separated variants to produce")
+	parser.add_argument(
+		"--weightType", choices=("QInt8", "QUInt8"), default="QUInt8",
+		help="type of the quantised weights of the int8 variant, QUInt8 is supported by more operators"
+	)
+	args = parser.parse_args()
+	for variant in args.variants.split(","):
+		convert(args.dataDir, variant, QuantType[args.weightType])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,43 @@
+# Image Captioning timing report
+# Copyright 2020 Shubham Dilip Jain, released under the AGPL-3.0 License
+
+"""Summarises the timings exported by the add-on (timings.jsonl in the imageCaptioning folder of the NVDA
+configuration, written when both timing settings are enabled) as the count and the p50, p95 and p99 of each
+recognition stage, in milliseconds.
+Usage: python tools/timingReport.py PATH [--json]
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+
+ADDON_PACKAGE_DIR = os.path.normpath(os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, "addon", "globalPlugins", "imageCaptioning"
+))
+sys.path.insert(0, ADDON_PACKAGE_DIR)
+from _instrumentation import STAGES, Histogram, formatReport, summarize  # noqa: E402
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("path", help="exported timings")
+	parser.add_argument("--json", action="store_true", help="print the percentiles as JSON")
+	args = parser.parse_args()
+	# keep every measurement of the file
+	histograms = OrderedDict((name, Histogram(None)) for name in STAGES)
+	with open(args.path, "r", encoding="utf-8") as f:
+		for line in f:
+			if not line.strip():
+				continue
+			measurement = json.loads(line)
+			histograms.setdefault(measurement["stage"], Histogram(None)).add(measurement["seconds"])
+	if args.json:
+		print(json.dumps(summarize(histograms), indent="\t"))
+	else:
+		print(formatReport(histograms))
+
+
+if __name__ == "__main__":
+	main()